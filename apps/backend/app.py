@@ -11,15 +11,28 @@ import os
 
 from paths import ENCODED_FILE_PATH, INDEX_PATH, FAISS_INDEX_PATH
 from config_loader import get_config
-from services.models import load_models
+from services.models import load_models, start_background_loading
+from services.search_engine import faiss_enabled, get_faiss_engine
 from services.opensearch import init_opensearch
+from services.responses import init_responses
+from services.generation import generation_enabled, load_generation
+from services import readiness
 
 load_dotenv()
 config = get_config()
 
-def create_app():
+def create_app(start_models=True):
+    """
+    Builds the Flask app.
+
+    Args:
+        start_models (bool): Start loading models. With [flask_app]
+            background_loading (the default) they load on a background thread
+            and routes answer 503 until what they need is ready.
+    """
     app = Flask(__name__)
     CORS(app)
+    init_responses(app)
 
     app.config["APP_CONFIG"] = config
     app.config["ENCODED_FILE_PATH"] = ENCODED_FILE_PATH
@@ -28,7 +41,7 @@ def create_app():
     
     # Import and register blueprints
     from routes.formula_search import formula_search_blueprint
-    from routes.late_fusion import late_fusion_blueprint
+    from routes.late_fusion import late_fusion_blueprint, model_loaders
     from routes.utility import utility_blueprint
 
     # Register blueprints with URL prefix
@@ -38,15 +51,29 @@ def create_app():
 
     # Initialize shared services so they can be used by blueprints.
     init_opensearch(app)
-    load_models()  # This loads both embedding model and TangentCFT backend
+    if start_models:
+        # Embedding model and TangentCFT backends, then fusion model, FAISS indexes and generation model if configured
+        extra_loaders = model_loaders()
+        if faiss_enabled():
+            extra_loaders.append(("search_engine", get_faiss_engine))
+        if generation_enabled():
+            extra_loaders.append(("generation", load_generation))
+        else:
+            readiness.set_state("generation", readiness.DISABLED, "[generation] model not set")
+        if config.getboolean("flask_app", "background_loading", fallback=True):
+            start_background_loading(extra_loaders)
+        else:
+            load_models(extra_loaders)
 
     return app
 
 if __name__ == "__main__":
-
-    app = create_app()
+    use_reloader = config.getboolean("flask_app", "reloader", fallback=True)
+    # The reloader runs this file twice: a watcher process that never serves and
+    # the server child (WERKZEUG_RUN_MAIN=true). Only the child loads models.
+    app = create_app(start_models=not use_reloader or os.environ.get("WERKZEUG_RUN_MAIN") == "true")
     app.run(
         port=config.getint("flask_app", "port"),
         debug=config.getboolean("flask_app", "debug"),
-        use_reloader=True
+        use_reloader=use_reloader
     )
@@ -0,0 +1,67 @@
+"""
+asgi.py
+
+ASGI entry point for MathMex backend. /search is served natively on an
+AsyncOpenSearch client, so one process can keep many searches waiting on
+the cluster; all other routes are served by the Flask app through a WSGI
+bridge that runs each request on a pool of [asgi] wsgi_threads threads, so
+a long /summarize stream does not hold up /healthz or /fusion-search.
+Run from apps/backend: uvicorn asgi:app --port 5001
+"""
+import asyncio
+import contextlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route, request_response
+
+from app import create_app, config
+from services.opensearch import create_async_opensearch
+from routes.formula_search import formula_search_async
+from services.readiness import RETRY_AFTER_SECONDS
+from services.responses import encode_payload
+
+flask_app = create_app()
+
+
+async def search(request: Request):
+    if request.method != "POST":
+        return JSONResponse({"error": "Method not allowed"}, status_code=405)
+    print("Received search request.")
+    try:
+        data = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        data = None
+    if not isinstance(data, dict):
+        payload, status = {"error": "Invalid JSON payload"}, 400
+    else:
+        payload, status = await formula_search_async(data, request.app.state.opensearch_client)
+    body, headers = encode_payload(payload, request.headers.get("accept-encoding"))
+    if status == 503:
+        headers["Retry-After"] = str(RETRY_AFTER_SECONDS)
+    return Response(body, status_code=status, headers=headers, media_type="application/json")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Model inference and TangentCFT run on this pool instead of the event loop
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=config.getint("asgi", "executor_threads", fallback=8))
+    )
+    app.state.opensearch_client = create_async_opensearch(config)
+    yield
+    await app.state.opensearch_client.close()
+
+
+app = Starlette(
+    routes=[
+        Route("/search", CORSMiddleware(request_response(search), allow_origins=["*"], allow_methods=["POST"], allow_headers=["*"])),
+        Mount("/", app=WSGIMiddleware(flask_app, workers=config.getint("asgi", "wsgi_threads", fallback=16))),
+    ],
+    lifespan=lifespan,
+)
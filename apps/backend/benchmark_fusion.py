@@ -0,0 +1,98 @@
+"""
+benchmark_fusion.py
+
+Compare /fusion-search's in-backend fusion ([fusion] mode = msearch or hybrid)
+against the formula-search LateFusionModel ([fusion] mode = external, the
+default) on the same queries. For each query both paths run against the same
+cluster with the same FUSION_* settings; the script reports how many of the
+top results they share, whether the first results agree, and the latency of
+each path. Run it before switching [fusion] mode away from external.
+
+Loads the embedding model, TangentCFT and LateFusionModel like the server.
+
+Run from project root: python apps/backend/benchmark_fusion.py [--queries FILE] [--top 10] [--mode msearch]
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from app import create_app
+from services import fusion
+from services.models import load_models
+from services.opensearch import get_opensearch_client
+from services.search_engine import faiss_enabled, get_faiss_engine, get_search_engine
+from routes import late_fusion
+
+parser = argparse.ArgumentParser(description="Compare in-backend fusion with LateFusionModel")
+parser.add_argument("--queries", help="Text file with one query per line (default: a built-in mix)")
+parser.add_argument("--top", type=int, default=10, help="Results compared per query (default: 10)")
+parser.add_argument("--mode", choices=("msearch", "hybrid"), default="msearch", help="In-backend mode to compare")
+parser.add_argument("--source", action="append", default=[], help="Restrict to a source (repeatable)")
+args = parser.parse_args()
+
+DEFAULT_QUERIES = [
+    "$x^2 + y^2 = r^2$",
+    "derivative of $\\sin(x)$",
+    "$\\int_0^1 x^n dx$ closed form",
+    "eigenvalues of a symmetric matrix",
+    "prove $\\sum_{k=1}^n k = \\frac{n(n+1)}{2}$",
+    "$e^{i\\pi} + 1 = 0$",
+    "mean value theorem",
+    "$\\lim_{x \\to 0} \\frac{\\sin x}{x}$ and $\\cos x$",
+]
+
+
+def load_queries():
+    if not args.queries:
+        return DEFAULT_QUERIES
+    with open(args.queries, encoding="utf-8") as f:
+        queries = [line.strip() for line in f if line.strip()]
+    if not queries:
+        sys.exit(f"No queries in {args.queries}")
+    return queries
+
+
+def timed(run):
+    start = time.perf_counter()
+    results = run()
+    return (time.perf_counter() - start) * 1000, [result.doc_id for result in results[:args.top]]
+
+
+def main():
+    extra_loaders = [("late_fusion", late_fusion.load_fusion_model)]
+    if faiss_enabled():
+        extra_loaders.append(("search_engine", get_faiss_engine))
+    load_models(extra_loaders=extra_loaders)
+    if late_fusion.fusion_model is None:
+        sys.exit("LateFusionModel did not load; check the formula-search path.")
+    app = create_app(start_models=False)
+    with app.app_context():
+        compare(get_search_engine(get_opensearch_client()))
+
+
+def compare(client):
+    fusion.MODE = args.mode
+
+    overlaps, first_agree, external_ms, backend_ms = [], [], [], []
+    for query in load_queries():
+        ext_ms, ext_ids = timed(lambda: late_fusion.external_fusion(client, query, args.source, []))
+        own_ms, own_ids = timed(lambda: late_fusion.multi_leg_fusion(client, query, args.source, [])[0])
+        overlap = len(set(ext_ids) & set(own_ids)) / max(len(ext_ids), 1)
+        overlaps.append(overlap)
+        first_agree.append(bool(ext_ids) and bool(own_ids) and ext_ids[0] == own_ids[0])
+        external_ms.append(ext_ms)
+        backend_ms.append(own_ms)
+        preview = (query[:48] + "…") if len(query) > 48 else query
+        print(f"{preview:<50} top-{args.top} overlap {overlap:6.1%}  external {ext_ms:7.1f} ms  "
+              f"{args.mode} {own_ms:7.1f} ms")
+
+    print(f"\n{len(overlaps)} queries, method {late_fusion.FUSION_SETTINGS.method}")
+    print(f"  mean top-{args.top} overlap: {np.mean(overlaps):.1%} (min {np.min(overlaps):.1%})")
+    print(f"  same first result: {np.mean(first_agree):.1%}")
+    print(f"  p50 ms  external {np.percentile(external_ms, 50):7.1f}  {args.mode} {np.percentile(backend_ms, 50):7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+benchmark_responses.py
+
+Compare Flask's default jsonify with the orjson provider in services/responses.py
+on typical result sets, and the size and cost of gzip and brotli on the result.
+Result sets have /search's shape (100 results) and /fusion-search's (50 results
+with fusion_info), built from rows of a TSV in data/tsvs/ or from synthetic text.
+No models or OpenSearch are needed.
+
+Run from project root: python apps/backend/benchmark_responses.py [--tsv FILE] [--results 100] [--mbps 50]
+"""
+import argparse
+import csv
+import random
+import sys
+import time
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from paths import DATA_PATH
+from services import responses
+
+parser = argparse.ArgumentParser(description="Benchmark response serialization and compression")
+parser.add_argument("--tsv", help="TSV in data/tsvs/ to take titles and bodies from (default: synthetic text)")
+parser.add_argument("--results", type=int, default=100, help="Results per /search response (default: 100)")
+parser.add_argument("--repeat", type=int, default=200, help="Serializations timed per case (default: 200)")
+parser.add_argument("--mbps", type=float, default=50.0, help="Link speed for the transfer estimate (default: 50)")
+args = parser.parse_args()
+
+SYNTHETIC_WORDS = (
+    "let $f(x) = x^2$ be continuous on the interval $[a, b]$ then by the mean value theorem there exists "
+    "$c \\in (a, b)$ such that $f'(c) = \\frac{f(b) - f(a)}{b - a}$ which generalizes Rolle's theorem and "
+    "the eigenvalues $\\lambda_i$ of a symmetric matrix $A = A^T$ are real with orthogonal eigenvectors"
+).split()
+
+
+def corpus_rows():
+    if args.tsv:
+        with open(DATA_PATH / "tsvs" / args.tsv, newline="", encoding="utf-8") as f:
+            rows = [(row[0], row[1]) for row in csv.reader(f, delimiter="\t") if len(row) >= 2]
+        if rows:
+            return rows
+        sys.exit(f"No rows in {args.tsv}")
+    rng = random.Random(0)
+    return [
+        (" ".join(rng.choices(SYNTHETIC_WORDS, k=6)), " ".join(rng.choices(SYNTHETIC_WORDS, k=rng.randint(40, 250))))
+        for _ in range(1000)
+    ]
+
+
+def search_payload(rows, rng, n):
+    results = [
+        {"title": title, "media_type": "article", "body_text": body, "link": f"https://example.org/{i}",
+         "score": rng.random()}
+        for i, (title, body) in enumerate(rng.sample(rows, min(n, len(rows))))
+    ]
+    return {"results": results, "total": len(results)}
+
+
+def fusion_payload(rows, rng, n):
+    payload = search_payload(rows, rng, n)
+    for rank, result in enumerate(payload["results"], start=1):
+        result["fusion_info"] = {"formula_rank": rank, "formula_score": rng.random(), "text_rank": None,
+                                 "text_score": None, "in_both": False}
+    payload["metadata"] = {"formulas_found": ["x^2"], "formula_results_count": n, "text_results_count": 0,
+                           "fusion_used": True}
+    return payload
+
+
+def time_response(app, payload):
+    """Mean ms per app.json.response(payload) and the body it produced."""
+    with app.app_context():
+        body = app.json.response(payload).get_data()
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            app.json.response(payload).get_data()
+    return (time.perf_counter() - start) * 1000 / args.repeat, body
+
+
+def time_compress(body, encoding):
+    start = time.perf_counter()
+    for _ in range(max(1, args.repeat // 10)):
+        compressed = responses.compress(body, encoding) if encoding else body
+    return (time.perf_counter() - start) * 1000 / max(1, args.repeat // 10), len(compressed)
+
+
+def main():
+    if responses.orjson is None:
+        sys.exit("orjson is not installed: pip install orjson")
+    default_app = Flask("default")
+    default_app.json = DefaultJSONProvider(default_app)
+    orjson_app = Flask("orjson")
+    orjson_app.json = responses.OrjsonProvider(orjson_app)
+
+    rng = random.Random(1)
+    rows = corpus_rows()
+    cases = [
+        ("/search", search_payload(rows, rng, args.results)),
+        ("/fusion-search", fusion_payload(rows, rng, min(50, args.results))),
+    ]
+    bytes_per_ms = args.mbps * 1e6 / 8 / 1000
+    encodings = [None, "gzip"] + (["br"] if responses.brotli is not None else [])
+
+    for name, payload in cases:
+        default_ms, default_body = time_response(default_app, payload)
+        orjson_ms, orjson_body = time_response(orjson_app, payload)
+        print(f"\n{name}: {len(payload['results'])} results")
+        print(f"  serialize  jsonify {default_ms:7.3f} ms   orjson {orjson_ms:7.3f} ms   "
+              f"({default_ms / orjson_ms:.1f}x)")
+        print(f"  {'encoding':<10}{'bytes':>10}{'compress ms':>14}{'transfer ms':>14}{'total ms':>11}")
+        before = default_ms + len(default_body) / bytes_per_ms
+        print(f"  {'(before)':<10}{len(default_body):>10}{0:>14.3f}{len(default_body) / bytes_per_ms:>14.2f}{before:>11.2f}")
+        for encoding in encodings:
+            compress_ms, size = time_compress(orjson_body, encoding)
+            transfer_ms = size / bytes_per_ms
+            total = orjson_ms + compress_ms + transfer_ms
+            print(f"  {encoding or 'identity':<10}{size:>10}{compress_ms:>14.3f}{transfer_ms:>14.2f}{total:>11.2f}")
+    print(f"\nTransfer at {args.mbps:g} Mbit/s. 'before' is jsonify without compression; "
+          f"responses over [responses] min_bytes = {responses.MIN_BYTES} are compressed.")
+    if responses.brotli is None:
+        print("brotli is not installed, so only gzip is offered (pip install brotli).")
+
+
+if __name__ == "__main__":
+    main()
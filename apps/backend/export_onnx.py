@@ -0,0 +1,172 @@
+"""
+export_onnx.py
+
+Export the [general] model to ONNX for [embedding] backend = onnx, write an
+int8 dynamically quantized copy, and check both against the PyTorch model
+(cosine agreement of the sentence vectors).
+Run from project root: python apps/backend/export_onnx.py [--out DIR] [--no-quantize] [--tsv FILE]
+  Re-run only the parity check on an existing export: export_onnx.py --check-only
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from paths import DATA_PATH
+from config_loader import get_config
+from services.onnx_encoder import (
+    FP32_FILE, INT8_FILE, MANIFEST, OnnxSentenceEncoder, default_export_dir, parity,
+)
+
+config = get_config()
+
+parser = argparse.ArgumentParser(description="Export the embedding model to ONNX and check parity")
+parser.add_argument("--model", default=os.path.expanduser(config.get("general", "model")),
+                    help="Model path or HuggingFace ID (default: [general] model)")
+parser.add_argument("--out", help="Export directory (default: [embedding] onnx_dir, else data/onnx/<model name>)")
+parser.add_argument("--no-quantize", action="store_true", help="Skip the int8 model")
+parser.add_argument("--check-only", action="store_true", help="Only run the parity check on an existing export")
+parser.add_argument("--tsv", help="TSV in data/tsvs/ to sample parity sentences from (default: built-in samples)")
+parser.add_argument("--samples", type=int, default=500, help="Sentences sampled from --tsv (default: 500)")
+parser.add_argument("--min-cosine", type=float, default=0.98,
+                    help="Fail if any sentence's cosine to the PyTorch vector is lower (default: 0.98)")
+parser.add_argument("--opset", type=int, default=14)
+args = parser.parse_args()
+
+OUT_DIR = Path(args.out) if args.out else default_export_dir(args.model)
+
+SAMPLE_SENTENCES = [
+    "Pythagorean theorem $a^2 + b^2 = c^2$",
+    "What is the derivative of $\\sin x$?",
+    "Eigenvalues of a symmetric matrix are real",
+    "$\\int_0^\\infty e^{-x^2} dx = \\frac{\\sqrt{\\pi}}{2}$",
+    "Prove that there are infinitely many primes",
+    "Fourier transform of a Gaussian",
+    "$\\sum_{n=1}^{\\infty} \\frac{1}{n^2} = \\frac{\\pi^2}{6}$",
+    "group homomorphism kernel normal subgroup",
+    "How do I solve a second order linear ODE with constant coefficients?",
+    "Cauchy-Schwarz inequality $|\\langle u, v \\rangle| \\le \\|u\\| \\|v\\|$",
+]
+
+
+def parity_sentences():
+    if not args.tsv:
+        return SAMPLE_SENTENCES
+    with open(DATA_PATH / "tsvs" / args.tsv, newline="", encoding="utf-8") as f:
+        rows = [row for row in csv.reader(f, delimiter="\t") if len(row) >= 2]
+    picks = np.random.default_rng(0).choice(len(rows), size=min(args.samples, len(rows)), replace=False)
+    return [f"{rows[i][0]} {rows[i][1]}".strip() for i in sorted(picks)]
+
+
+def export(model):
+    """Writes model.onnx, the tokenizer and the manifest to OUT_DIR."""
+    import torch
+
+    transformer, tokenizer = model[0].auto_model, model.tokenizer
+    pooling = next((m for m in model if type(m).__name__ == "Pooling"), None)
+    mode = pooling.get_pooling_mode_str() if pooling else "mean"
+    if mode not in ("mean", "cls", "max"):
+        sys.exit(f"Pooling mode '{mode}' is not supported by the ONNX encoder.")
+    unsupported = [type(m).__name__ for m in model if type(m).__name__ not in ("Transformer", "Pooling", "Normalize")]
+    if unsupported:
+        sys.exit(f"Model modules {unsupported} are not supported by the ONNX encoder.")
+
+    sample = tokenizer(["a short sample", "a somewhat longer sample sentence"], padding=True, return_tensors="pt")
+    input_names = list(sample.keys())
+
+    class Wrapper(torch.nn.Module):
+        """Takes the tokenizer outputs positionally and returns last_hidden_state."""
+
+        def __init__(self):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, *inputs):
+            return self.transformer(**dict(zip(input_names, inputs)), return_dict=False)[0]
+
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    transformer.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            Wrapper(),
+            tuple(sample[name] for name in input_names),
+            str(OUT_DIR / FP32_FILE),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                **{name: {0: "batch", 1: "sequence"} for name in input_names},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=args.opset,
+            do_constant_folding=True,
+        )
+    tokenizer.save_pretrained(str(OUT_DIR))
+    manifest = {
+        "source_model": args.model,
+        "pooling": mode,
+        "normalize": any(type(m).__name__ == "Normalize" for m in model),
+        "max_seq_length": model.max_seq_length,
+        "dimension": model.get_sentence_embedding_dimension(),
+        "inputs": input_names,
+    }
+    with open(OUT_DIR / MANIFEST, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Exported {args.model} to {OUT_DIR / FP32_FILE} ({manifest['pooling']} pooling)")
+
+
+def quantize():
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(str(OUT_DIR / FP32_FILE), str(OUT_DIR / INT8_FILE), weight_type=QuantType.QInt8)
+    sizes = [(OUT_DIR / name).stat().st_size / 2**20 for name in (FP32_FILE, INT8_FILE)]
+    print(f"Quantized to {OUT_DIR / INT8_FILE} ({sizes[0]:.0f} MB -> {sizes[1]:.0f} MB)")
+
+
+def timed_encode(encoder, sentences):
+    start = time.perf_counter()
+    for sentence in sentences:
+        encoder.encode(sentence)
+    return (time.perf_counter() - start) * 1000 / len(sentences)
+
+
+def check(model):
+    """Prints cosine agreement and single-query latency; returns False if below --min-cosine."""
+    sentences = parity_sentences()
+    torch_ms = timed_encode(model, sentences[:50])
+    print(f"\nParity on {len(sentences)} sentences (PyTorch: {torch_ms:.1f} ms/query)")
+    ok = True
+    for quantized in (False, True):
+        if not (OUT_DIR / (INT8_FILE if quantized else FP32_FILE)).exists():
+            continue
+        encoder = OnnxSentenceEncoder(OUT_DIR, quantized=quantized)
+        cosines = parity(model, encoder, sentences)
+        ms = timed_encode(encoder, sentences[:50])
+        label = "int8" if quantized else "fp32"
+        print(f"  {label}: cosine min {cosines.min():.5f}  p1 {np.percentile(cosines, 1):.5f}  "
+              f"mean {cosines.mean():.5f} | {ms:.1f} ms/query")
+        ok = ok and cosines.min() >= args.min_cosine
+    return ok
+
+
+def main():
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(args.model, device="cpu")
+    if not args.check_only:
+        export(model)
+        if not args.no_quantize:
+            quantize()
+    elif not (OUT_DIR / MANIFEST).exists():
+        sys.exit(f"No export in {OUT_DIR}; run without --check-only first.")
+    if not check(model):
+        sys.exit(f"Parity check failed: some cosines are below {args.min_cosine}")
+    print("Parity check passed. Set [embedding] backend = onnx to use the export.")
+
+
+if __name__ == "__main__":
+    main()
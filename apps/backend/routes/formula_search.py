@@ -2,22 +2,36 @@ from flask import Blueprint, request, jsonify, current_app
 from opensearchpy.exceptions import (
     ConnectionError as OpenSearchConnectionError,
     AuthorizationException as OpenSearchAuthorizationException,
+    NotFoundError,
+    TransportError,
 )
-import io
-import sys
-import os
-import tempfile
-import csv
+import asyncio
+import re
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from utils.format import format_for_mathmex, format_for_mathlive, format_for_tangent_cft_search
+from utils.format import format_for_mathmex, format_for_mathlive
 from schemas.indexes import source_to_index
-from services.models import get_embedding_model, get_tangent_backend
+from services.models import get_tangent_backend
+from services.formula_cache import encode_formulas_cached
+from services.vector_store import body_vector_store, formula_vector_store
+from services import two_stage, readiness, pagination, generation
+from services.index_layout import search_targets, knn_query
+from services.search_engine import UnsupportedQuery, get_search_engine, get_faiss_engine, faiss_enabled
+from services.query_cache import (
+    result_cache_key, get_cached_results, cache_results, encode_text_cached, encode_texts_cached,
+    normalize_query,
+)
+from config_loader import get_config
 from routes.utility import llm_response
+from utils.output import capture_stdout
 
 formula_search_blueprint = Blueprint('formula_search', __name__)
 
+# /search needs the text model; formula search and FAISS may be unavailable, but not mid-load
+SEARCH_REQUIRES = ("embedding",)
+SEARCH_OPTIONAL = ("tangent_cft", "search_engine")
+
 @formula_search_blueprint.route("/search", methods=["POST"])
+@readiness.requires(*SEARCH_REQUIRES, optional=SEARCH_OPTIONAL)
 def formula_search():
     print("Received search request.")
     data = request.get_json()
@@ -26,36 +40,53 @@ def formula_search():
     do_enhance = data.get('do_enhance', False)
     diversify = data.get('diversify', False)
     raw_query = data.get("query")
+    try:
+        if "cursor" in data:
+            return jsonify(next_search_page(data["cursor"]))
+        page_size = pagination.page_size_from(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except OpenSearchConnectionError:
+        return jsonify({"error": "Search service unavailable", "detail": "Cannot connect to OpenSearch"}), 503
+    except OpenSearchAuthorizationException:
+        return jsonify({"error": "Search forbidden", "detail": "OpenSearch user lacks search permissions"}), 403
+    except TransportError as e:
+        print(f"Next page failed ({e})")
+        return jsonify({"error": "Search failed", "detail": str(e.error)}), 502
     print(f"Received Query: {raw_query}. Running Retrieval")
 
-    query_file = None
+    cache_key = result_cache_key(
+        "search", raw_query, sources, media_types, do_enhance=do_enhance, diversify=diversify
+    )
+    cached = get_cached_results(cache_key)
+    if cached is not None:
+        if page_size:
+            return jsonify(pagination.list_page(cached, page_size))
+        return jsonify({'results': cached, 'total': len(cached)})
+
+    def text_search_response():
+        if page_size and pit_available(sources, diversify, current_app.opensearch_client):
+            try:
+                return jsonify(pit_first_page(raw_query, sources, media_types, do_enhance, page_size))
+            except OpenSearchConnectionError:
+                raise
+            except TransportError as e:
+                # e.g. indices without a keyword doc_ID to sort on; page over the full list instead
+                print(f"Point-in-time paging failed ({e}); paging over the full result list")
+        results = perform_search(raw_query, sources, media_types, do_enhance, diversify, custom_vec=False)
+        return search_response(cache_key, results, page_size)
+
     try:
         backend = get_tangent_backend()
         if backend is None:
-            results = perform_search(raw_query, sources, media_types, do_enhance, diversify, custom_vec=False)
-            return jsonify({'results': results, 'total': len(results)})
-
-        query_ml = format_for_tangent_cft_search(raw_query)
-        query_file = write_temp_query_tsv(query_ml)
-        backend.data_reader.queries_dir_path = query_file
-        ENCODED_FILE_PATH = current_app.config["ENCODED_FILE_PATH"]
-
-        text_trap = io.StringIO()
-        old_stdout = sys.stdout
+            return text_search_response()
 
         try:
-            sys.stdout = text_trap
-            query_vector = backend.retrieval(
-                encoded_file_path=ENCODED_FILE_PATH,
-                embedding_type=getattr(backend, 'embedding_type', None),
-                ignore_full_relative_path=True,
-                tokenize_all=False,
-                tokenize_number=True,
-                streaming=True,
-                faiss=True,
-                single_query=True,
-                do_retrieval=False
-            )
+            with capture_stdout():
+                query_vector = encode_query_formula(raw_query)
+            # Queries that do not parse as a formula encode to an all-zero row
+            if query_vector is None:
+                return text_search_response()
             results = perform_search(
                 raw_query,
                 sources,
@@ -67,38 +98,383 @@ def formula_search():
             )
             # Fallback to text search when formula search returns nothing (e.g. docs have no formulas)
             if not results:
-                results = perform_search(raw_query, sources, media_types, do_enhance, diversify, custom_vec=False)
-            return jsonify({'results': results, 'total': len(results)})
+                return text_search_response()
+            return search_response(cache_key, results, page_size)
         except ValueError as e:
             return jsonify({'error': str(e)}), 400
         except Exception:
-            results = perform_search(raw_query, sources, media_types, do_enhance, diversify, custom_vec=False)
-            return jsonify({'results': results, 'total': len(results)})
-        finally:
-            sys.stdout = old_stdout
+            return text_search_response()
+    except OpenSearchConnectionError:
+        return jsonify({"error": "Search service unavailable", "detail": "Cannot connect to OpenSearch"}), 503
+    except OpenSearchAuthorizationException:
+        return jsonify({"error": "Search forbidden", "detail": "OpenSearch user lacks search permissions"}), 403
+
+async def formula_search_async(data, client):
+    """
+    Async counterpart of formula_search for the ASGI server.
+
+    OpenSearch calls are awaited on the async client; the embedding model,
+    TangentCFT and the LLM run in the default executor.
+    Returns:
+        tuple[dict, int]: The JSON payload and HTTP status.
+    """
+    blocking = readiness.unavailable(SEARCH_REQUIRES, SEARCH_OPTIONAL)
+    if blocking:
+        return readiness.not_ready_payload(blocking), 503
+
+    sources = data.get('sources', [])
+    media_types = data.get('mediaTypes', [])
+    do_enhance = data.get('do_enhance', False)
+    diversify = data.get('diversify', False)
+    raw_query = data.get("query")
+    try:
+        if "cursor" in data:
+            # The async server only issues list cursors, which need no OpenSearch call
+            state = pagination.load_cursor(data["cursor"])
+            if state["kind"] != "list":
+                raise pagination.InvalidCursor("Invalid or expired cursor")
+            return pagination.next_list_page(state), 200
+        page_size = pagination.page_size_from(data)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    def payload(results):
+        if page_size:
+            return pagination.list_page(results, page_size)
+        return {'results': results, 'total': len(results)}
+
+    cache_key = result_cache_key(
+        "search", raw_query, sources, media_types, do_enhance=do_enhance, diversify=diversify
+    )
+    cached = get_cached_results(cache_key)
+    if cached is not None:
+        return payload(cached), 200
+
+    async def text_search():
+        return await perform_search_async(client, raw_query, sources, media_types, do_enhance, diversify)
+
+    def encode_quietly(query):
+        with capture_stdout():
+            return encode_query_formula(query)
+
+    loop = asyncio.get_running_loop()
+    try:
+        results = None
+        if get_tangent_backend() is not None:
             try:
-                if query_file and os.path.exists(query_file):
-                    os.remove(query_file)
-            except Exception as cleanup_err:
-                print(f"Warning: failed to delete temp file {query_file}: {cleanup_err}")
+                query_vector = await loop.run_in_executor(None, encode_quietly, raw_query)
+                if query_vector is not None:
+                    results = await perform_search_async(
+                        client, raw_query, sources, media_types, do_enhance, diversify,
+                        custom_vec=True, custom_query_vec=query_vector
+                    )
+            except ValueError:
+                raise
+            except Exception:
+                results = None
+        if not results:
+            results = await text_search()
+        cache_results(cache_key, results)
+        return payload(results), 200
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    except OpenSearchConnectionError:
+        return {"error": "Search service unavailable", "detail": "Cannot connect to OpenSearch"}, 503
+    except OpenSearchAuthorizationException:
+        return {"error": "Search forbidden", "detail": "OpenSearch user lacks search permissions"}, 403
+
+MAX_BATCH_QUERIES = get_config().getint("batch_search", "max_queries", fallback=500)
+
+@formula_search_blueprint.route("/search/batch", methods=["POST"])
+@readiness.requires(*SEARCH_REQUIRES, optional=SEARCH_OPTIONAL)
+def formula_search_batch():
+    """
+    Runs many /search queries in one request.
+
+    The body is {"queries": [...]} plus optional sources, mediaTypes, do_enhance
+    and diversify defaults. Each entry is a query string or an object with
+    "query" and any of those options. Results come back in input order; a
+    query that fails gets {"query", "error"} in its slot.
+    """
+    data = request.get_json() or {}
+    entries = data.get("queries")
+    if not isinstance(entries, list) or not entries:
+        return jsonify({"error": "Expected a non-empty 'queries' list"}), 400
+    if len(entries) > MAX_BATCH_QUERIES:
+        return jsonify({"error": f"At most {MAX_BATCH_QUERIES} queries per batch"}), 400
+    print(f"Received batch search request with {len(entries)} queries.")
+
+    items = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"query": entry}
+        if not isinstance(entry, dict):
+            items.append({"query": entry, "error": "Each query must be a string or an object"})
+            continue
+        if entry.get("query") is not None and not isinstance(entry["query"], str):
+            items.append({"query": entry["query"], "error": "'query' must be a string"})
+            continue
+        items.append({
+            "query": entry.get("query"),
+            "sources": entry.get("sources", data.get("sources", [])),
+            "media_types": entry.get("mediaTypes", data.get("mediaTypes", [])),
+            "do_enhance": entry.get("do_enhance", data.get("do_enhance", False)),
+            "diversify": entry.get("diversify", data.get("diversify", False)),
+        })
+    try:
+        outputs = perform_search_batch(items)
     except OpenSearchConnectionError:
         return jsonify({"error": "Search service unavailable", "detail": "Cannot connect to OpenSearch"}), 503
     except OpenSearchAuthorizationException:
         return jsonify({"error": "Search forbidden", "detail": "OpenSearch user lacks search permissions"}), 403
+    return jsonify({"results": outputs, "total": len(outputs)})
+
+def perform_search_batch(items):
+    """
+    Batch counterpart of formula_search for a list of query items.
+
+    Formula queries are encoded in one TangentCFT call and text queries in
+    one embedding call; every round of kNN requests (first searches,
+    two-stage deepening, text fallback for empty formula results) is one
+    _msearch.
+    Args:
+        items (list[dict]): query, sources, media_types, do_enhance, diversify per query.
+    Returns:
+        list[dict]: Per query, {"query", "results", "total"} or {"query", "error"}.
+            Items that already carry an "error" are returned as such.
+    """
+    outputs = [None] * len(items)
+    todo = []
+    for i, item in enumerate(items):
+        if "error" in item:
+            outputs[i] = {"query": item["query"], "error": item["error"]}
+            continue
+        item["cache_key"] = result_cache_key(
+            "search", item["query"], item["sources"], item["media_types"],
+            do_enhance=item["do_enhance"], diversify=item["diversify"],
+        )
+        cached = get_cached_results(item["cache_key"]) if item["query"] else None
+        if not item["query"]:
+            outputs[i] = {"query": item["query"], "error": "No query provided"}
+        elif cached is not None:
+            outputs[i] = {"query": item["query"], "results": cached, "total": len(cached)}
+        else:
+            todo.append(i)
+
+    formula_vectors = {}
+    if todo and get_tangent_backend() is not None:
+        try:
+            with capture_stdout():
+                vectors = encode_formulas_cached([items[i]["query"] for i in todo])
+            # Queries that do not parse as a formula encode to an all-zero row
+            formula_vectors = {i: vector.tolist() for i, vector in zip(todo, vectors) if vector.any()}
+        except Exception as e:
+            print(f"Batch search: formula encoding failed ({type(e).__name__}: {e}), using text search")
+
+    def search_entry(i, vector, custom_vec):
+        use_two_stage = two_stage_available(items[i]["sources"], custom_vec)
+        return {"i": i, "vector": vector, "custom_vec": custom_vec, "two_stage": use_two_stage,
+                "k": two_stage.CANDIDATES if use_two_stage else None}
 
-def convert_numpy(obj):
-    if isinstance(obj, dict):
-        return {k: convert_numpy(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_numpy(x) for x in obj]
-    elif isinstance(obj, tuple):
-        return tuple(convert_numpy(x) for x in obj)
-    elif isinstance(obj, (np.integer,)):
-        return int(obj)
-    elif isinstance(obj, (np.floating,)):
-        return float(obj)
+    def fail(i, e):
+        print(f"Batch search: query {i} failed ({type(e).__name__}: {e})")
+        outputs[i] = {"query": items[i]["query"], "error": str(e)}
+
+    def text_searches(indices):
+        """
+        Text search entries for these queries, encoded in one batch. A query
+        whose enhancement or encoding fails gets its error instead of an entry.
+        """
+        texts = {}
+        for i in indices:
+            try:
+                texts[i] = format_for_mathmex(enhance_query(items[i]["query"], items[i]["do_enhance"]))
+            except Exception as e:
+                fail(i, e)
+        if not texts:
+            return []
+        vectors = {}
+        try:
+            vectors = dict(zip(texts, encode_texts_cached(list(texts.values()))))
+        except Exception as e:
+            # Find the queries that fail on their own; the rest still run
+            print(f"Batch search: text encoding failed ({type(e).__name__}: {e}), encoding queries one at a time")
+            for i, text in texts.items():
+                try:
+                    vectors[i] = encode_texts_cached([text])[0]
+                except Exception as e:
+                    fail(i, e)
+        return [search_entry(i, vectors[i], False) for i in texts if i in vectors]
+
+    pending = [search_entry(i, formula_vectors[i], True) for i in todo if i in formula_vectors]
+    pending += text_searches([i for i in todo if i not in formula_vectors])
+
+    client = get_search_engine(current_app.opensearch_client)
+    while pending:
+        requests = []
+        for search in pending:
+            item = items[search["i"]]
+            options = {}
+            if search["two_stage"]:
+                options = dict(k=search["k"], size=search["k"], ef_search=two_stage.EF_SEARCH, with_ids=True)
+            requests.append(build_search_body(
+                search["vector"], item["sources"], item["media_types"], item["diversify"], search["custom_vec"],
+                **options,
+            ))
+        lines = []
+        for search_params, query_body, _ in requests:
+            lines.extend([search_params, query_body])
+        responses = client.msearch(body=lines)["responses"]
+
+        next_round, fallback = [], []
+        for search, (search_params, query_body, use_local_vectors), response in zip(pending, requests, responses):
+            i, item = search["i"], items[search["i"]]
+            if "error" in response:
+                outputs[i] = {"query": item["query"], "error": str(response["error"].get("reason", response["error"]))}
+                continue
+            if search["two_stage"]:
+                k = two_stage.next_depth(response, search["k"], query_body)
+                if k:
+                    search["k"] = k
+                    next_round.append(search)
+                    continue
+                response = rescore_candidates(response, search["vector"], search["custom_vec"])
+            results = process_search_response(response, search["vector"], item["diversify"], use_local_vectors)
+            # Same fallback as /search: formula queries with no hits retry as text
+            if search["custom_vec"] and not results:
+                fallback.append(i)
+                continue
+            cache_results(item["cache_key"], results)
+            outputs[i] = {"query": item["query"], "results": results, "total": len(results)}
+
+        pending = next_round + text_searches(fallback)
+    return outputs
+
+def encode_query_formula(raw_query):
+    """Returns the query's formula vector as a list, or None if it does not encode as a formula."""
+    if not raw_query:
+        return None
+    query_vector = encode_formulas_cached([raw_query])[0]
+    return query_vector.tolist() if query_vector.any() else None
+
+def search_response(cache_key, results, page_size=None):
+    """Caches a successful result list under the request key and returns it (or its first page) as JSON."""
+    cache_results(cache_key, results)
+    if page_size:
+        return jsonify(pagination.list_page(results, page_size))
+    return jsonify({'results': results, 'total': len(results)})
+
+def pit_available(sources, diversify, client):
+    """
+    Plain text search on OpenSearch can page with a point in time. MMR and
+    two-stage rescoring reorder the whole candidate list, FAISS has no PIT,
+    and schema v1 indices cannot sort on doc_ID, so those page over a cached
+    list instead.
+    """
+    if (
+        not pagination.PIT_ENABLED
+        or diversify
+        or faiss_enabled()
+        or two_stage_available(sources, custom_vec=False)
+    ):
+        return False
+    indices = search_targets(sources)[0]["index"]
+    return pagination.pit_sortable(client, indices if isinstance(indices, list) else [indices])
+
+PIT_SORT = [{"_score": {"order": "desc"}}, {"doc_ID": {"order": "asc"}}]
+
+def pit_first_page(raw_query, sources, media_types, do_enhance, page_size):
+    """Opens a point in time over the searched indices and returns the first page of text results."""
+    query = enhance_query(raw_query, do_enhance)
+    query_vec = encode_text_cached(format_for_mathmex(query))
+    search_params, query_body, _ = build_search_body(query_vec, sources, media_types)
+    client = current_app.opensearch_client
+    index = search_params["index"]
+    pit = client.create_pit(
+        index=",".join(index) if isinstance(index, list) else index,
+        keep_alive=pagination.KEEP_ALIVE,
+        routing=search_params.get("routing"),
+    )
+    # PIT searches name no index; the PIT already pins indices, routing and the snapshot
+    query_body["track_scores"] = True
+    query_body["sort"] = PIT_SORT
+    state = {"kind": "pit", "pit_id": pit["pit_id"], "body": query_body, "after": None, "seen": (),
+             "page_size": page_size}
+    try:
+        return pit_page(client, state)
+    except Exception:
+        # No cursor will ever reference this point in time
+        close_pit(client, pit["pit_id"])
+        raise
+
+def close_pit(client, pit_id):
+    """Deletes a point in time; if that fails, it still expires after KEEP_ALIVE."""
+    try:
+        client.delete_pit(body={"pit_id": [pit_id]})
+    except Exception as e:
+        print(f"Could not close point in time ({type(e).__name__}: {e}); it expires after {pagination.KEEP_ALIVE}")
+
+def pit_page(client, state):
+    """
+    Reads the next page_size unique results after state["after"].
+
+    Hits whose body text was already returned (on this or an earlier page) are
+    skipped, so the pages together match the deduplicated full list.
+    """
+    page_size = state["page_size"]
+    seen = set(state["seen"])
+    after = state["after"]
+    pit_id = state["pit_id"]
+    fetch = page_size + max(5, page_size // 4)
+    results = []
+    exhausted = False
+    total = None
+    while len(results) < page_size:
+        body = dict(state["body"], size=fetch, pit={"id": pit_id, "keep_alive": pagination.KEEP_ALIVE})
+        if after is not None:
+            body["search_after"] = after
+        try:
+            response = client.search(body=body)
+        except NotFoundError:
+            raise pagination.InvalidCursor(f"Cursor expired (point in time kept for {pagination.KEEP_ALIVE})")
+        pit_id = response.get("pit_id", pit_id)
+        hits = response["hits"]["hits"]
+        if total is None:
+            total = response["hits"].get("total", {}).get("value")
+        for hit in hits:
+            after = hit["sort"]
+            result = hit_to_result(hit)
+            key = pagination.body_key(result["body_text"])
+            if key in seen:
+                continue
+            seen.add(key)
+            results.append(result)
+            if len(results) == page_size:
+                break
+        if len(hits) < fetch:
+            exhausted = True
+            break
+    if exhausted:
+        close_pit(client, pit_id)
+        next_cursor = None
     else:
-        return obj
+        next_cursor = pagination.save_cursor(
+            dict(state, pit_id=pit_id, after=after, seen=tuple(seen))
+        )
+    # total counts kNN hits before dedup, so it is an upper bound
+    return {"results": results, "total": total, "next_cursor": next_cursor}
+
+def next_search_page(cursor):
+    """
+    The page behind a cursor from an earlier /search response.
+
+    Raises:
+        pagination.InvalidCursor: If the cursor is unknown or expired.
+    """
+    state = pagination.load_cursor(cursor)
+    if state["kind"] == "pit":
+        return pit_page(current_app.opensearch_client, state)
+    return pagination.next_list_page(state)
 
 def perform_search(
     query,
@@ -109,138 +485,256 @@ def perform_search(
     custom_vec=False,
     custom_query_vec=None
 ):
+    query = enhance_query(query, do_enhance)
+    query_vec = custom_query_vec if custom_vec else encode_text_cached(format_for_mathmex(query))
+    client = get_search_engine(current_app.opensearch_client)
+    if two_stage_available(sources, custom_vec):
+        k = two_stage.CANDIDATES
+        while k:
+            search_params, query_body, use_local_vectors = build_search_body(
+                query_vec, sources, media_types, diversify, custom_vec,
+                k=k, size=k, ef_search=two_stage.EF_SEARCH, with_ids=True,
+            )
+            response = client.search(body=query_body, **search_params)
+            k = two_stage.next_depth(response, k, query_body)
+        response = rescore_candidates(response, query_vec, custom_vec)
+        return process_search_response(response, query_vec, diversify, use_local_vectors)
+    search_params, query_body, use_local_vectors = build_search_body(query_vec, sources, media_types, diversify, custom_vec)
+    response = client.search(body=query_body, **search_params)
+    return process_search_response(response, query_vec, diversify, use_local_vectors)
+
+async def perform_search_async(
+    client,
+    query,
+    sources=None,
+    media_types=None,
+    do_enhance=False,
+    diversify=False,
+    custom_vec=False,
+    custom_query_vec=None
+):
+    """perform_search for an AsyncOpenSearch client; blocking model work runs in the default executor."""
+    loop = asyncio.get_running_loop()
+    query = await loop.run_in_executor(None, enhance_query, query, do_enhance)
+    if custom_vec:
+        query_vec = custom_query_vec
+    else:
+        query_vec = await loop.run_in_executor(None, encode_text_cached, format_for_mathmex(query))
+    if faiss_enabled():
+        # In-process search is CPU work, so it runs off the event loop
+        engine = get_faiss_engine()
+
+        async def search(query_body, search_params):
+            try:
+                return await loop.run_in_executor(None, lambda: engine.search(body=query_body, **search_params))
+            except UnsupportedQuery as e:
+                # Same fallback as get_search_engine() gives the sync path
+                print(f"FAISS: {e}; sending this request to OpenSearch")
+                return await client.search(body=query_body, **search_params)
+    else:
+        async def search(query_body, search_params):
+            return await client.search(body=query_body, **search_params)
+    if two_stage_available(sources, custom_vec):
+        k = two_stage.CANDIDATES
+        while k:
+            search_params, query_body, use_local_vectors = build_search_body(
+                query_vec, sources, media_types, diversify, custom_vec,
+                k=k, size=k, ef_search=two_stage.EF_SEARCH, with_ids=True,
+            )
+            response = await search(query_body, search_params)
+            k = two_stage.next_depth(response, k, query_body)
+        response = await loop.run_in_executor(None, rescore_candidates, response, query_vec, custom_vec)
+    else:
+        search_params, query_body, use_local_vectors = build_search_body(
+            query_vec, sources, media_types, diversify, custom_vec
+        )
+        response = await search(query_body, search_params)
+    if diversify:
+        return await loop.run_in_executor(
+            None, process_search_response, response, query_vec, diversify, use_local_vectors
+        )
+    return process_search_response(response, query_vec, diversify, use_local_vectors)
+
+def enhance_query(query, do_enhance=False):
+    """Validates the query and optionally expands it with the LLM."""
     if not query:
         raise ValueError("No query provided")
     if do_enhance:
-        prompt = f"""
+        # Enhancements are cached per normalized query; fallbacks are not, so a later call can still generate
+        query = normalize_query(query)
+        enhanced = generation.enhancement_cache.get(query)
+        if enhanced is None:
+            prompt = f"""
             You are a mathematics expert. Provide a brief, technical explanation (2-3 sentences) about the mathematical concept or topic: "{query}"
             Focus on key terminology, related concepts, and mathematical relationships that would help in finding relevant academic content.
             Response:
         """
-        query = llm_response(prompt, response_type="enhancement", fallback=f"Mathematical concepts related to {query} including definitions, theorems, and applications.")
-    indices = (
-        [source_to_index[s] for s in sources if s in source_to_index]
-        if sources
-        else list(source_to_index.values())
-    )
-    if custom_vec:
-        query_vec = custom_query_vec
-        # Formula search: KNN on nested formulas.formula_vector (300-dim)
-        knn_field = "formulas.formula_vector"
-        use_nested = True
-    else:
-        model = get_embedding_model()
-        query_vec = model.encode(format_for_mathmex(query)).tolist()
-        # Text search: KNN on body_vector (768-dim); many docs have empty formulas
-        knn_field = "body_vector"
-        use_nested = False
+            fallback = f"Mathematical concepts related to {query} including definitions, theorems, and applications."
+            enhanced = llm_response(prompt, response_type="enhancement", fallback=fallback)
+            if enhanced != fallback:
+                generation.enhancement_cache.put(query, enhanced)
+        query = enhanced
+    return query
+
+def build_search_body(query_vec, sources=None, media_types=None, diversify=False, custom_vec=False,
+                      k=1000, size=100, ef_search=None, with_ids=False):
+    """
+    Builds the kNN search request for a query vector.
+
+    k, size and ef_search are tuned by two-stage search; with_ids adds the
+    doc_ID and source fields needed to look hits up in the local vector stores.
+    Returns:
+        tuple: (search_params, query_body, use_local_vectors); search_params
+        holds index (and routing) for client.search.
+    """
+    search_params, source_filter = search_targets(sources)
+    filters = []
+    if source_filter:
+        filters.append(source_filter)
+    if media_types:
+        filters.append({"terms": {"media_type": media_types}})
 
-    if use_nested:
+    if custom_vec:
+        # Formula search: KNN on nested formulas.formula_vector (300-dim).
+        # Filters are on the parent document, so they stay outside the nested query.
         query_clause = {
             "nested": {
                 "path": "formulas",
-                "query": {
-                    "knn": {knn_field: {"vector": query_vec, "k": 1000}}
-                },
+                "query": knn_query("formulas.formula_vector", query_vec, k, ef_search=ef_search),
                 "score_mode": "max"
             }
         }
+        post_filters = filters
+    elif source_filter:
+        # Consolidated index: source and media type filter inside the ANN search
+        query_clause = knn_query("body_vector", query_vec, k, filters, ef_search=ef_search)
+        post_filters = []
     else:
-        query_clause = {"knn": {knn_field: {"vector": query_vec, "k": 1000}}}
+        # Text search: KNN on body_vector (768-dim); many docs have empty formulas
+        query_clause = knn_query("body_vector", query_vec, k, ef_search=ef_search)
+        post_filters = filters
 
     source_includes = ["title", "media_type", "body_text", "link"]
-    if diversify:
+    # Diversification vectors come from the local store when every index has one;
+    # only fall back to shipping body_vector in _source when they are missing.
+    # Schema v2 indices keep vectors out of _source, so they need the local store.
+    vector_indices = search_targets(sources, consolidated=False)[0]["index"]
+    use_local_vectors = diversify and all(body_vector_store.has(index) for index in vector_indices)
+    if use_local_vectors or with_ids:
+        source_includes.extend(["doc_ID", "source"])
+    if diversify and not use_local_vectors:
         source_includes.append("body_vector")
     query_body = {
-        "size": 100,
+        "size": size,
         "_source": {"includes": source_includes},
         "query": {"bool": {"must": [query_clause]}}
     }
-    if media_types:
-        query_body["query"]["bool"]["filter"] = [
-            {"terms": {"media_type": media_types}}
-        ]
-    client = current_app.opensearch_client
-    response = client.search(index=indices, body=query_body)
-    results = [
-        {
-            "title": hit["_source"].get("title"),
-            "media_type": hit["_source"].get("media_type"),
-            "body_text": format_for_mathlive(hit["_source"].get("body_text")),
-            "link": hit["_source"].get("link"),
-            "score": hit["_score"],
-        }
-        for hit in response["hits"]["hits"]
-    ]
-    results = delete_dups(results, unique_key="body_text")
+    if post_filters:
+        query_body["query"]["bool"]["filter"] = post_filters
+    return search_params, query_body, use_local_vectors
+
+def two_stage_available(sources, custom_vec):
+    """Two-stage search needs local vectors for every searched source."""
+    if not two_stage.ENABLED:
+        return False
+    store = formula_vector_store if custom_vec else body_vector_store
+    return all(store.has(index) for index in search_targets(sources, consolidated=False)[0]["index"])
+
+def rescore_candidates(response, query_vec, custom_vec):
+    """Stage two: exact cosine scores from the local stores replace the ANN scores."""
+    keys = [(vector_index(hit), hit["_source"].get("doc_ID")) for hit in response["hits"]["hits"]]
+    if custom_vec:
+        cosines, found = formula_vector_store.best_cosine(keys, query_vec)
+    else:
+        doc_vectors, found = body_vector_store.lookup(keys)
+        cosines = two_stage.cosine_to(doc_vectors, query_vec)
+    return two_stage.rescore(response, cosines, found)
+
+def process_search_response(response, query_vec, diversify=False, use_local_vectors=False):
+    """Turns a kNN search response into deduplicated (and optionally diversified) results."""
+    hits = response["hits"]["hits"]
+    results = [hit_to_result(hit) for hit in hits]
+    # Keep the hit alongside each result so dedup and MMR stay aligned with its vector
+    unique_hits = delete_dups(list(zip(results, hits)), unique_key=lambda pair: pair[0]["body_text"])
+    results = [result for result, _ in unique_hits]
     if diversify and len(results) > 1:
-        results = mmr(results, query_vec, lambda_param=0.7, k=min(50, len(results)))
-    for result in results:
-        result.pop('body_vector', None)
+        if use_local_vectors:
+            doc_vectors, _ = body_vector_store.lookup(
+                [(vector_index(hit), hit["_source"].get("doc_ID")) for _, hit in unique_hits]
+            )
+        else:
+            body_vectors = [hit["_source"].get("body_vector") for _, hit in unique_hits]
+            dim = max((len(v) for v in body_vectors if v), default=0)
+            if not dim:
+                print("Diversify: no body vectors in _source (schema v2 index without data/vectors/ files); "
+                      "results are not re-ranked")
+            doc_vectors = np.array([v or [0.0] * dim for v in body_vectors], dtype=np.float32)
+        scores = np.array([result["score"] for result in results], dtype=np.float32)
+        results = mmr(results, doc_vectors, query_vec, scores, lambda_param=0.7, k=min(50, len(results)))
     return results
 
-def mmr(results, query_vector, lambda_param=0.7, k=50):
-    if len(results) <= 1:
-        return results
-    doc_vectors = np.array([result['body_vector'] for result in results if result.get('body_vector')])
-    query_vec = np.array(query_vector).reshape(1, -1)
-    relevance_scores = cosine_similarity(query_vec, doc_vectors)[0]
-    selected_indices = []
-    remaining_indices = list(range(len(results)))
-    best_idx = np.argmax(relevance_scores)
-    selected_indices.append(best_idx)
-    remaining_indices.remove(best_idx)
-    while len(selected_indices) < k and remaining_indices:
-        mmr_scores = []
-        for idx in remaining_indices:
-            relevance = relevance_scores[idx]
-            if selected_indices:
-                selected_vectors = doc_vectors[selected_indices]
-                current_vector = doc_vectors[idx].reshape(1, -1)
-                similarities = cosine_similarity(current_vector, selected_vectors)[0]
-                max_similarity = np.max(similarities)
-            else:
-                max_similarity = 0
-            mmr_score = lambda_param * relevance - (1 - lambda_param) * max_similarity
-            mmr_scores.append((idx, mmr_score))
-        best_idx, _ = max(mmr_scores, key=lambda x: x[1])
-        selected_indices.append(best_idx)
-        remaining_indices.remove(best_idx)
-    return [results[idx] for idx in selected_indices]
+def hit_to_result(hit):
+    """The fields /search returns for one hit."""
+    return {
+        "title": hit["_source"].get("title"),
+        "media_type": hit["_source"].get("media_type"),
+        "body_text": format_for_mathlive(hit["_source"].get("body_text")),
+        "link": hit["_source"].get("link"),
+        "score": hit["_score"],
+    }
 
-def write_temp_query_tsv(mathml_string: str):
+def vector_index(hit):
     """
-    Writes a temporary TSV with one query entry matching MSE format.
-    Returns the path to the file.
+    Per-source index name for a hit, which is what the local vector store is keyed by.
+    Indices moved by migrate_index.py are served as <name>_v<N> behind an alias, so
+    a version suffix is dropped when the hit has no source field.
     """
-    # Make sure the MathML is not wrapped in extra quotes
-    mathml_string = mathml_string.strip().strip('"').strip("'")
+    source_index = source_to_index.get(hit["_source"].get("source"))
+    if source_index:
+        return source_index
+    return re.sub(r"_v\d+$", "", hit["_index"])
 
-    tmp_tsv = tempfile.NamedTemporaryFile(
-        mode="w", suffix=".tsv", delete=False, newline='', encoding="utf-8"
-    )
+def mmr(results, doc_vectors, query_vector, scores=None, lambda_param=0.7, k=50):
+    """
+    Maximal marginal relevance re-ranking over a (n, dim) matrix of document vectors.
 
-    writer = csv.DictWriter(
-        tmp_tsv,
-        delimiter="\t",
-        fieldnames=["id", "topic_id", "thread_id", "type", "formula"]
-    )
-    writer.writeheader()
-    writer.writerow({
-        "id": "user_query",
-        "topic_id": "A.000",
-        "thread_id": "0000000",
-        "type": "title",
-        "formula": mathml_string
-    })
-    tmp_tsv.close()
-    return tmp_tsv.name
+    Vectors are normalized once; each selection step then costs one
+    matrix-vector product to update a running max-similarity vector.
+    Relevance is cosine similarity to the query when the dimensions match
+    (text search), otherwise the search scores scaled to [0, 1] (formula search).
+    """
+    n = len(results)
+    if n <= 1 or doc_vectors.size == 0:
+        return results
+    norms = np.linalg.norm(doc_vectors, axis=1, keepdims=True)
+    docs = doc_vectors / np.where(norms == 0, 1.0, norms)
+    query_vec = np.asarray(query_vector, dtype=np.float32).ravel()
+    if query_vec.shape[0] == docs.shape[1]:
+        relevance = docs @ (query_vec / (np.linalg.norm(query_vec) or 1.0))
+    elif scores is not None and scores.max() > 0:
+        relevance = scores / scores.max()
+    else:
+        relevance = np.zeros(n, dtype=np.float32)
+
+    max_similarity = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    selected_indices = [int(np.argmax(relevance))]
+    available[selected_indices[0]] = False
+    while len(selected_indices) < k and available.any():
+        max_similarity = np.maximum(max_similarity, docs @ docs[selected_indices[-1]])
+        mmr_scores = lambda_param * relevance - (1 - lambda_param) * max_similarity
+        mmr_scores[~available] = -np.inf
+        best_idx = int(np.argmax(mmr_scores))
+        selected_indices.append(best_idx)
+        available[best_idx] = False
+    return [results[idx] for idx in selected_indices]
 
 def delete_dups(list, unique_key="body_text"):
+    key = unique_key if callable(unique_key) else (lambda d: d[unique_key])
     seen_ids = set()
     unique_dicts = []
     for d in list:
-        if d[unique_key] not in seen_ids:
-            seen_ids.add(d[unique_key])
+        if key(d) not in seen_ids:
+            seen_ids.add(key(d))
             unique_dicts.append(d)
     return unique_dicts
\ No newline at end of file
@@ -1,4 +1,7 @@
-from typing import List
+from typing import Dict, List
+from dataclasses import asdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from flask import Blueprint, request, jsonify
 import os
 import threading
@@ -9,45 +12,51 @@ from utils.format import (
     format_for_mathmex,
     format_for_mathlive,
     format_for_tangent_cft_search,
+    extract_formulas,
 )
 from schemas.indexes import source_to_index
-from services.models import get_embedding_model, get_tangent_backend
+from services.models import get_embedding_model, get_encoder_pool
+from services.encoder_pool import EncoderPoolBusy
 from services.opensearch import get_opensearch_client
+from services.search_engine import faiss_enabled, get_search_engine
+from services.query_cache import result_cache_key, get_cached_results, cache_results, encode_text_cached
+from services.formula_cache import encode_formulas_cached
+from services import fusion, readiness, pagination
+from services.fusion import FusionSettings, fuse, hybrid_supported, hybrid_results
+from services.index_layout import search_targets
+from routes.formula_search import build_search_body
+from utils.output import capture_stdout
+
+FUSION_SETTINGS = FusionSettings.from_env()
 
 fusion_model = None
-formula_search_lock = threading.Lock()
-
-try:
-    if FORMULA_SEARCH_PATH.exists():
-        setup_formula_search_imports()
-        from LateFusionModel.late_fusion_model import LateFusionModel, FusionConfig
-
-        fusion_model = LateFusionModel(FusionConfig(
-            method=os.getenv("FUSION_METHOD", "rrf"),
-            rrf_k=int(os.getenv("FUSION_RRF_K", "60")),
-            weight_formula=float(os.getenv("FUSION_WEIGHT_FORMULA", "0.3")),
-            weight_text=float(os.getenv("FUSION_WEIGHT_TEXT", "0.7")),
-            hybrid_rrf_weight=float(os.getenv("FUSION_HYBRID_RRF_WEIGHT", "0.5")),
-            formula_topk=int(os.getenv("FUSION_FORMULA_TOPK", "100")),
-            text_topk=int(os.getenv("FUSION_TEXT_TOPK", "100")),
-            final_topk=int(os.getenv("FUSION_FINAL_TOPK", "100")),
-        ))
-        print("LateFusion model loaded successfully")
-    else:
-        print("LateFusion: formula-search path not found, fusion disabled")
-except Exception as e:
-    fusion_model = None
-    print(f"LateFusion: failed to load ({type(e).__name__}: {e})")
+
+
+def load_fusion_model():
+    """Builds LateFusionModel for [fusion] mode = external; run by the background model loader."""
+    global fusion_model
+    if not FORMULA_SEARCH_PATH.exists():
+        raise RuntimeError("formula-search path not found")
+    setup_formula_search_imports()
+    from LateFusionModel.late_fusion_model import LateFusionModel, FusionConfig
+
+    fusion_model = LateFusionModel(FusionConfig(**asdict(FUSION_SETTINGS)))
+
+
+def model_loaders():
+    """Components this blueprint needs loaded besides the shared models."""
+    return [("late_fusion", load_fusion_model)] if fusion.MODE == "external" else []
 
 late_fusion_blueprint = Blueprint("late_fusion", __name__)
 
 @late_fusion_blueprint.route("/fusion-search", methods=["POST"])
+@readiness.requires("embedding", optional=("tangent_cft", "search_engine", "late_fusion"))
 def fusion_search():
     """
     Dual-mode search combining structural and semantic retrieval.
     """
     print("Received fusion-search request")
-    if fusion_model is None:
+    if fusion.MODE == "external" and fusion_model is None:
         print("Fusion-search: model not loaded, returning 503")
         return jsonify({"error": "Fusion search not available"}), 503
     try:
@@ -55,35 +64,33 @@ def fusion_search():
         if not request_data:
             return jsonify({"error": "Invalid JSON payload"}), 400
 
+        if "cursor" in request_data:
+            return jsonify(pagination.next_list_page(pagination.load_cursor(request_data["cursor"])))
+
         user_query = request_data.get("query", "")
         selected_sources = request_data.get("sources", [])
         selected_media_types = request_data.get("mediaTypes", [])
         max_results = request_data.get("top_k", 50)
+        page_size = pagination.page_size_from(request_data)
 
         if not user_query or not user_query.strip():
             return jsonify({"error": "No query provided"}), 400
 
-        # ---- NEW access pattern (process-wide singletons) ----
-        text_model = get_embedding_model()
-        opensearch_client = get_opensearch_client()
-        tangent_cft_backend = get_tangent_backend()  # Use the loaded backend from models.py
-        if tangent_cft_backend is None:
-            print("Fusion-search: TangentCFT backend not loaded, formula path may be text-only")
-
-        fused_results = fusion_model.process_query(
-            query=user_query,
-            tangent_cft_backend=tangent_cft_backend,
-            opensearch_client=opensearch_client,
-            text_model=text_model,
-            source_to_index_map=source_to_index,
-            sources=selected_sources,
-            media_types=selected_media_types,
-            formula_formatter=format_for_tangent_cft_search,
-            text_formatter=format_for_mathmex,
-            formula_search_lock=formula_search_lock,
-        )
+        cache_key = result_cache_key("fusion", user_query, selected_sources, selected_media_types)
+        cached = get_cached_results(cache_key)
+        if cached is not None:
+            return jsonify(fusion_response(cached["results"], cached["metadata"], max_results, page_size))
 
-        formulas_found = fusion_model._extract_formulas(user_query)
+        opensearch_client = get_search_engine(get_opensearch_client())
+        if fusion.MODE == "external":
+            fused_results = external_fusion(
+                opensearch_client, user_query, selected_sources, selected_media_types
+            )
+            formulas_found = fusion_model._extract_formulas(user_query)
+        else:
+            fused_results, formulas_found = multi_leg_fusion(
+                opensearch_client, user_query, selected_sources, selected_media_types
+            )
 
         formula_count = sum(1 for r in fused_results if r.formula_score is not None)
         text_count = sum(1 for r in fused_results if r.text_score is not None)
@@ -92,20 +99,19 @@ def fusion_search():
         print(f"Fusion-search: query=\"{q_preview}\" formulas={formula_count} text={text_count} fusion_used={formula_count > 0}")
 
         final_results = prepare_fusion_response(fused_results)
+        metadata = {
+            "formulas_found": formulas_found,
+            "formula_results_count": formula_count,
+            "text_results_count": text_count,
+            "fusion_used": formula_count > 0,
+        }
+        cache_results(cache_key, {"results": final_results, "metadata": metadata})
 
-        return jsonify(
-            {
-                "results": final_results[:max_results],
-                "total": len(final_results),
-                "metadata": {
-                    "formulas_found": formulas_found,
-                    "formula_results_count": formula_count,
-                    "text_results_count": text_count,
-                    "fusion_used": formula_count > 0,
-                },
-            }
-        )
+        return jsonify(fusion_response(final_results, metadata, max_results, page_size))
 
+    except EncoderPoolBusy as e:
+        print(f"Fusion-search: {e}")
+        return jsonify({"error": "Formula search busy", "detail": str(e)}), 503
     except ValueError as e:
         print(f"Fusion-search: validation error: {e}")
         logging.warning(f"Fusion search validation error: {e}")
@@ -124,35 +130,172 @@ def fusion_search():
         return jsonify(error_details), 500
 
 
+def fusion_response(results, metadata, max_results, page_size=None):
+    """
+    The /fusion-search payload: the top max_results, or with page_size their
+    first page and a cursor for the rest (pages are slices of the same list).
+    """
+    if page_size:
+        return pagination.list_page(results[:max_results], page_size, extra={"metadata": metadata})
+    return {"results": results[:max_results], "total": len(results), "metadata": metadata}
+
+
+HYDRATION_FIELDS = ["title", "media_type", "body_text", "link"]
+HYDRATION_CHUNK_SIZE = int(os.getenv("FUSION_HYDRATION_CHUNK_SIZE", "100"))
+
+
+def external_fusion(opensearch_client, user_query, sources, media_types):
+    """Fusion by LateFusionModel, which sends its own formula and text requests."""
+    text_model = get_embedding_model()
+    encoder_pool = get_encoder_pool()
+    if encoder_pool is None:
+        print("Fusion-search: TangentCFT backend not loaded, formula path may be text-only")
+        worker_context = nullcontext(None)
+    else:
+        # Each pooled worker owns its backend, so fusion queries no longer share one lock
+        worker_context = encoder_pool.acquire()
+
+    with worker_context as worker:
+        return fusion_model.process_query(
+            query=user_query,
+            tangent_cft_backend=worker.backend if worker else None,
+            opensearch_client=opensearch_client,
+            text_model=text_model,
+            source_to_index_map=source_to_index,
+            sources=sources,
+            media_types=media_types,
+            formula_formatter=format_for_tangent_cft_search,
+            text_formatter=format_for_mathmex,
+            formula_search_lock=worker.lock if worker else threading.Lock(),
+        )
+
+
+def multi_leg_fusion(opensearch_client, user_query, sources, media_types):
+    """
+    Runs the text leg and one formula leg per query formula in a single _msearch
+    and fuses the responses. With [fusion] mode = hybrid, a single-formula query
+    goes to OpenSearch as one hybrid query through the fusion search pipeline.
+
+    Returns:
+        tuple: (list of FusedResult, formulas found in the query)
+    """
+    formulas = extract_formulas(user_query)
+    formula_vectors = []
+    if formulas and get_encoder_pool() is not None:
+        with capture_stdout():
+            vectors = encode_formulas_cached(formulas)
+        # Formulas that do not parse encode to all-zero rows
+        formula_vectors = [vector.tolist() for vector in vectors if vector.any()]
+    text_vector = encode_text_cached(format_for_mathmex(user_query))
+
+    text_params, text_body, _ = build_search_body(
+        text_vector, sources, media_types,
+        k=FUSION_SETTINGS.text_topk, size=FUSION_SETTINGS.text_topk,
+    )
+    formula_legs = [
+        build_search_body(
+            vector, sources, media_types, custom_vec=True,
+            k=FUSION_SETTINGS.formula_topk, size=FUSION_SETTINGS.formula_topk,
+        )
+        for vector in formula_vectors
+    ]
+
+    if (fusion.MODE == "hybrid" and len(formula_legs) == 1
+            and hybrid_supported(FUSION_SETTINGS) and not faiss_enabled()):
+        formula_params, formula_body, _ = formula_legs[0]
+        body = {
+            "size": FUSION_SETTINGS.final_topk,
+            "_source": text_body["_source"],
+            "query": {"hybrid": {"queries": [
+                formula_body["query"]["bool"]["must"][0],
+                text_body["query"]["bool"]["must"][0],
+            ]}},
+        }
+        # The formula leg always carries the full source and media type filters
+        if formula_body["query"]["bool"].get("filter"):
+            body["post_filter"] = {"bool": {"filter": formula_body["query"]["bool"]["filter"]}}
+        response = opensearch_client.search(
+            body=body, params={"search_pipeline": fusion.HYBRID_PIPELINE}, **formula_params
+        )
+        return hybrid_results(response), formulas
+
+    # Each leg's index/routing parameters are its _msearch header
+    lines = [text_params, text_body]
+    for params, body, _ in formula_legs:
+        lines.extend([params, body])
+    responses = opensearch_client.msearch(body=lines)["responses"]
+    errors = [response["error"] for response in responses if "error" in response]
+    if len(errors) == len(responses):
+        raise RuntimeError(f"All fusion legs failed: {errors[0]}")
+    for error in errors:
+        print(f"Fusion-search: one leg failed ({error})")
+    hit_lists = [response["hits"]["hits"] if "error" not in response else [] for response in responses]
+    return fuse(hit_lists[1:], hit_lists[0], FUSION_SETTINGS), formulas
+
+
+def fetch_documents(opensearch_client, doc_ids: List[str]) -> Dict[str, dict]:
+    """
+    Fetch display fields for many documents with one ids query across all indices
+    (the per-source indices, or the consolidated index when that layout is configured).
+
+    Large id lists are split into chunks of HYDRATION_CHUNK_SIZE that run
+    concurrently. If an id exists in several indices, the first index in
+    source_to_index order wins.
+    """
+    index_names = search_targets()[0]["index"]
+    index_names = index_names if isinstance(index_names, list) else [index_names]
+    index_rank = {name: rank for rank, name in enumerate(index_names)}
+
+    def fetch_chunk(chunk):
+        response = opensearch_client.search(
+            index=index_names,
+            body={
+                "size": len(chunk) * len(index_names),
+                "_source": {"includes": HYDRATION_FIELDS},
+                "query": {"ids": {"values": chunk}},
+            },
+            ignore_unavailable=True,
+        )
+        return response["hits"]["hits"]
+
+    chunks = [doc_ids[i:i + HYDRATION_CHUNK_SIZE] for i in range(0, len(doc_ids), HYDRATION_CHUNK_SIZE)]
+    if len(chunks) > 1:
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            hits = [hit for chunk_hits in executor.map(fetch_chunk, chunks) for hit in chunk_hits]
+    else:
+        hits = [hit for chunk in chunks for hit in fetch_chunk(chunk)]
+
+    documents = {}
+    best_rank = {}
+    for hit in hits:
+        rank = index_rank.get(hit["_index"], len(index_names))
+        if hit["_id"] not in documents or rank < best_rank[hit["_id"]]:
+            documents[hit["_id"]] = hit["_source"]
+            best_rank[hit["_id"]] = rank
+    return documents
+
+
 def prepare_fusion_response(fused_results: List):
     """
-    Fetch full document metadata for fused results from OpenSearch.
+    Builds the response entries for fused results, fetching metadata the results do not carry.
     """
-    opensearch_client = get_opensearch_client()
+    opensearch_client = get_search_engine(get_opensearch_client())
 
-    output_results = []
-    document_cache = {}
+    # Multi-leg fusion already has each hit's display fields; only fetch the rest
+    document_cache = {
+        fused_result.doc_id: fused_result.source
+        for fused_result in fused_results
+        if getattr(fused_result, "source", None)
+    }
+    doc_ids = list(dict.fromkeys(
+        fused_result.doc_id for fused_result in fused_results if fused_result.doc_id not in document_cache
+    ))
+    if doc_ids:
+        document_cache.update(fetch_documents(opensearch_client, doc_ids))
 
+    output_results = []
     for fused_result in fused_results:
-        doc_id = fused_result.doc_id
-
-        if doc_id not in document_cache:
-            found = False
-            for index_name in source_to_index.values():
-                try:
-                    document = opensearch_client.get(
-                        index=index_name, id=doc_id
-                    )
-                    document_cache[doc_id] = document["_source"]
-                    found = True
-                    break
-                except Exception:
-                    continue
-
-            if not found:
-                continue
-
-        doc_metadata = document_cache.get(doc_id)
+        doc_metadata = document_cache.get(fused_result.doc_id)
         if not doc_metadata:
             continue
 
@@ -1,11 +1,47 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 import saytex
-from services.models import get_embedding_model, get_generation_model
+from services.models import get_embedding_model, get_encoder_pool, text_batcher
+from services.formula_cache import get_formula_cache
+from services import query_cache, readiness, generation
+from services.generation import GenerationBusy
+from services.responses import dumps
+from config_loader import get_config
 from utils.format import format_for_mathlive
 utility_blueprint = Blueprint("utility", __name__)
 
+_config = get_config()
+# Generation settings per response type; timeouts bound how long a request waits on the worker
+GENERATION_SETTINGS = {
+    "enhancement": {
+        "max_new_tokens": _config.getint("generation", "enhancement_max_new_tokens", fallback=64),
+        "temperature": 0.3,
+        "timeout": _config.getfloat("generation", "enhancement_timeout", fallback=10.0),
+        "min_length": 10,
+        "max_output_length": 300,
+        "cleanup_markers": ["Response:"],
+    },
+    "summary": {
+        "max_new_tokens": _config.getint("generation", "summary_max_new_tokens", fallback=1024),
+        "temperature": 0.7,
+        "timeout": _config.getfloat("generation", "summary_timeout", fallback=300.0),
+        "min_length": 20,
+        "max_output_length": None,
+        "cleanup_markers": ["COMPREHENSIVE ANSWER:"],
+    },
+}
+
 @utility_blueprint.route("/summarize", methods=["POST"])
+@readiness.requires(optional=("generation",))
 def summarize():
+    """
+    Answers the query from the given results with the generation model.
+
+    With {"stream": true} or Accept: text/event-stream the answer streams as
+    server-sent events: "token" events carry raw text as it is generated, and
+    a final "done" event carries the cleaned, formatted summary.
+    Returns:
+        JSON: {"summary": str}, or an event stream; 503 if the generation queue is full.
+    """
     data = request.get_json()
     query = data.get('query', '')
     sources = data.get('results', [])
@@ -33,15 +69,64 @@ def summarize():
         COMPREHENSIVE ANSWER:
     """
 
-    summary = llm_response(
-        prompt=prompt,
-        response_type="summary",
-        fallback=f"I need more specific information to provide a comprehensive answer. Please try refining your search query or selecting more relevant sources."
-    )
+    fallback = "I need more specific information to provide a comprehensive answer. Please try refining your search query or selecting more relevant sources."
+
+    if data.get('stream') or request.accept_mimetypes.best == "text/event-stream":
+        return summarize_stream(prompt, fallback)
+
+    try:
+        summary = llm_response(prompt=prompt, response_type="summary", fallback=fallback, raise_busy=True)
+    except GenerationBusy as e:
+        return generation_busy(e)
 
     return jsonify({'summary': format_for_mathlive(summary)})
 
 
+def summarize_stream(prompt, fallback):
+    """Streams a summary as server-sent events; the job is cancelled if the client goes away."""
+    worker = generation.get_worker()
+    if worker is None:
+        events = iter([sse_event("done", {"summary": format_for_mathlive(fallback)})])
+        return Response(events, mimetype="text/event-stream", headers=SSE_HEADERS)
+    settings = GENERATION_SETTINGS["summary"]
+    try:
+        job = worker.submit(prompt, settings["max_new_tokens"], settings["temperature"])
+    except GenerationBusy as e:
+        return generation_busy(e)
+
+    def events():
+        pieces = []
+        try:
+            for chunk in job.stream(timeout=settings["timeout"]):
+                pieces.append(chunk)
+                yield sse_event("token", {"text": chunk})
+            summary = clean_generated("".join(pieces), "summary", fallback)
+            yield sse_event("done", {"summary": format_for_mathlive(summary)})
+        except Exception as e:
+            print(f"LLM generation error (summary stream): {e}")
+            yield sse_event("error", {"error": "Generation failed", "detail": str(e)})
+        finally:
+            # Also runs when the client disconnects mid-stream, which stops the generation
+            job.cancel()
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {dumps(payload).decode('utf-8')}\n\n"
+
+
+def generation_busy(error):
+    return (
+        jsonify({'error': 'Generation busy', 'detail': str(error)}),
+        503,
+        {"Retry-After": str(readiness.RETRY_AFTER_SECONDS)},
+    )
+
+
 @utility_blueprint.route("/speech-to-latex", methods=["POST"])
 def speech_to_latex():
     """
@@ -84,56 +169,109 @@ def speech_to_latex():
         return jsonify({'error': str(e)}), 500
     
     
-    # note, if trying to use this function, ensure the generation model is loaded in services/models.py
-    # It is defaulted to commented out to save resources
-def llm_response(prompt, response_type="summary", fallback="Unable to generate response"):
-    # Configure parameters based on response type
-    if response_type == "enhancement":
-        max_new_tokens = 64
-        temperature = 0.3
-        min_length = 10
-        max_output_length = 300
-        cleanup_markers = ["Response:"]
-
-    else:  # summary
-        max_new_tokens = 1024
-        temperature = 0.7
-        min_length = 20
-        max_output_length = None
-        cleanup_markers = ["COMPREHENSIVE ANSWER:"]
-    
-    try:
-        response = generation_model(
-            prompt, 
-            max_new_tokens=max_new_tokens,
-            temperature=temperature,
-            do_sample=True
-        )[0]['generated_text']
-        
-        # Extract only the answer part (after the prompt)
-        generated_text = response.replace(prompt, '').strip()
-        
-        # Clean up any artifacts
-        for marker in cleanup_markers:
-            if generated_text.startswith(marker):
-                generated_text = generated_text.replace(marker, '').strip()
-        
-        # Summary-specific cleanup: strip incomplete sentences at the last period
-        if response_type == "summary" and generated_text and '.' in generated_text:
-            last_period_index = generated_text.rfind('.')
-            if last_period_index != -1:
-                generated_text = generated_text[:last_period_index + 1].strip()
-        
-        # Ensure we have a meaningful response
-        if not generated_text or len(generated_text.strip()) < min_length:
-            return fallback
-        
-        # Truncate if too long (for enhancement only)
-        if max_output_length and len(generated_text) > max_output_length:
-            generated_text = generated_text[:max_output_length] + "..."
-            
-        return generated_text
+@utility_blueprint.route("/cache-stats", methods=["GET"])
+def cache_stats():
+    """
+    Reports hit/miss/eviction counters for the query caches.
+    Returns:
+        JSON: Counters and sizes keyed by cache name.
+    """
+    return jsonify({
+        'formula_vectors': get_formula_cache().stats(),
+        **query_cache.stats(),
+        'query_enhancements': generation.enhancement_cache.stats(),
+    })
 
+
+@utility_blueprint.route("/encoder-stats", methods=["GET"])
+def encoder_stats():
+    """
+    Reports the query text batcher's batch size, queue wait and encode time
+    histograms, the TangentCFT pool's occupancy and the generation queue.
+    Returns:
+        JSON: {"text": ..., "formula": ..., "generation": ...}; null for a component that is off.
+    """
+    pool = get_encoder_pool()
+    worker = generation.get_worker()
+    return jsonify({
+        'text': text_batcher.stats() if text_batcher else None,
+        'formula': pool.stats() if pool else None,
+        'generation': worker.stats() if worker else None,
+    })
+
+
+@utility_blueprint.route("/healthz", methods=["GET"])
+def healthz():
+    """
+    Liveness: the process is up and serving, whatever its models are doing.
+    Returns:
+        JSON: {"status": "ok"}
+    """
+    return jsonify({'status': 'ok'})
+
+
+@utility_blueprint.route("/readyz", methods=["GET"])
+def readyz():
+    """
+    Readiness: 200 once the required models are loaded and nothing is still
+    loading, otherwise 503. Either way the body lists every component's state.
+    Returns:
+        JSON: {"ready": bool, "components": {name: {"state", "error", "since"}}}
+    """
+    ready = readiness.is_ready()
+    body = {'ready': ready, 'components': readiness.component_states()}
+    return jsonify(body), 200 if ready else 503
+
+
+def llm_response(prompt, response_type="summary", fallback="Unable to generate response", raise_busy=False):
+    """
+    Generates text for a prompt on the generation worker and cleans it up.
+
+    Args:
+        response_type (str): "summary" or "enhancement"; selects GENERATION_SETTINGS.
+        fallback (str): Returned when no model is loaded, generation fails or times out.
+        raise_busy (bool): Raise GenerationBusy instead of returning fallback when the queue is full.
+    """
+    settings = GENERATION_SETTINGS.get(response_type, GENERATION_SETTINGS["summary"])
+    worker = generation.get_worker()
+    if worker is None:
+        return fallback
+    try:
+        job = worker.submit(prompt, settings["max_new_tokens"], settings["temperature"])
+        return clean_generated(job.result(timeout=settings["timeout"]), response_type, fallback)
+    except GenerationBusy:
+        if raise_busy:
+            raise
+        print(f"LLM generation skipped ({response_type}): queue full")
+        return fallback
     except Exception as e:
         print(f"LLM generation error ({response_type}): {e}")
         return fallback
+
+
+def clean_generated(generated_text, response_type="summary", fallback="Unable to generate response"):
+    """Strips prompt markers and trailing partial sentences; fallback if too little is left."""
+    settings = GENERATION_SETTINGS.get(response_type, GENERATION_SETTINGS["summary"])
+    generated_text = generated_text.strip()
+
+    # Clean up any artifacts
+    for marker in settings["cleanup_markers"]:
+        if generated_text.startswith(marker):
+            generated_text = generated_text.replace(marker, '').strip()
+
+    # Summary-specific cleanup: strip incomplete sentences at the last period
+    if response_type == "summary" and generated_text and '.' in generated_text:
+        last_period_index = generated_text.rfind('.')
+        if last_period_index != -1:
+            generated_text = generated_text[:last_period_index + 1].strip()
+
+    # Ensure we have a meaningful response
+    if not generated_text or len(generated_text.strip()) < settings["min_length"]:
+        return fallback
+
+    # Truncate if too long (for enhancement only)
+    max_output_length = settings["max_output_length"]
+    if max_output_length and len(generated_text) > max_output_length:
+        generated_text = generated_text[:max_output_length] + "..."
+
+    return generated_text
@@ -9,3 +9,7 @@ source_to_index = {
     # "proof-wiki": "mathmex_proof-wiki",
     # "wikimedia": "mathmex_wikimedia",
 }
+
+# Single index holding every source, with a keyword "source" field and routing by
+# source. Searched instead of the per-source indices when [opensearch] consolidated = true.
+CONSOLIDATED_INDEX = "mathmex_all"
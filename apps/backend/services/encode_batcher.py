@@ -0,0 +1,149 @@
+"""
+Micro-batching for query text encodes.
+
+Request threads hand their texts to one EncodeBatcher instead of calling the
+embedding model themselves. A dispatcher thread gathers the requests that
+arrive within wait_ms of the oldest one (or until max_batch texts) and runs
+them through the model in a single forward pass. Requests that queued while
+the previous batch was running are already past their window, so under load
+batches form without extra waiting, and an idle server adds at most wait_ms.
+"""
+import bisect
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class Histogram:
+    """Fixed-bucket histogram; bucket "le_X" counts observations <= X."""
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.bounds, value)] += 1
+            self._sum += value
+            self._max = max(self._max, value)
+
+    def snapshot(self):
+        with self._lock:
+            count = sum(self._counts)
+            labels = [f"le_{bound:g}" for bound in self.bounds] + ["inf"]
+            return {
+                "buckets": dict(zip(labels, self._counts)),
+                "count": count,
+                "mean": self._sum / count if count else 0.0,
+                "max": self._max,
+            }
+
+
+class _Request:
+    __slots__ = ("texts", "enqueued", "done", "result", "error")
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class EncodeBatcher:
+    """
+    Gathers concurrent encode calls into batched model calls.
+
+    Args:
+        encode_batch (callable): Takes a list of texts, returns an (n, dim) array.
+        max_batch (int): Most texts per model call; one larger request still runs whole.
+        wait_ms (float): How long the oldest queued request may wait for company.
+    """
+
+    def __init__(self, encode_batch, max_batch=32, wait_ms=2.0):
+        self.encode_batch = encode_batch
+        self.max_batch = max(1, max_batch)
+        self.wait = max(0.0, wait_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64, 128])
+        self.wait_ms = Histogram([0.5, 1, 2, 5, 10, 20, 50, 100, 250])
+        self.encode_ms = Histogram([1, 2, 5, 10, 20, 50, 100, 250, 500])
+
+    def encode(self, texts):
+        """
+        Encodes texts as part of the next batch and blocks until done.
+
+        Returns:
+            np.ndarray: (len(texts), dim) float32, in input order.
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        self._ensure_started()
+        request = _Request(list(texts))
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    thread = threading.Thread(target=self._run, name="encode-batcher", daemon=True)
+                    thread.start()
+                    self._thread = thread
+
+    def _collect(self):
+        """Blocks for the next request, then gathers more until the window or batch is full."""
+        batch = [self._queue.get()]
+        size = len(batch[0].texts)
+        deadline = batch[0].enqueued + self.wait
+        while size < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            start = time.perf_counter()
+            for request in batch:
+                self.wait_ms.observe((start - request.enqueued) * 1000)
+            texts = [text for request in batch for text in request.texts]
+            self.batch_sizes.observe(len(texts))
+            try:
+                vectors = np.asarray(self.encode_batch(texts), dtype=np.float32)
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+                    request.done.set()
+                continue
+            self.encode_ms.observe((time.perf_counter() - start) * 1000)
+            offset = 0
+            for request in batch:
+                request.result = vectors[offset:offset + len(request.texts)]
+                offset += len(request.texts)
+                request.done.set()
+
+    def stats(self):
+        return {
+            "max_batch": self.max_batch,
+            "wait_window_ms": self.wait * 1000,
+            "queued": self._queue.qsize(),
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.wait_ms.snapshot(),
+            "encode_ms": self.encode_ms.snapshot(),
+        }
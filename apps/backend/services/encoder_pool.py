@@ -0,0 +1,64 @@
+"""
+Pool of independent TangentCFT backend instances.
+
+Each worker owns its own backend (model, encoder maps and data reader), so
+formula encodes that still go through backend state (e.g. LateFusionModel)
+can run side by side instead of queueing on one process-wide lock.
+"""
+import queue
+import threading
+from contextlib import contextmanager
+
+
+class EncoderPoolBusy(RuntimeError):
+    """Raised when no worker is free and the wait queue is full, or the wait timed out."""
+
+
+class EncoderWorker:
+    """A backend instance plus a lock private to it, for APIs that expect one."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.Lock()
+
+
+class TangentEncoderPool:
+    """
+    Hands out TangentCFT workers to one caller at a time.
+
+    Args:
+        backends (list): Loaded TangentCFTBackEnd instances, one per worker.
+        max_waiting (int): Callers allowed to wait for a worker before new
+            callers are rejected immediately.
+        timeout (float): Seconds a caller waits for a worker.
+    """
+
+    def __init__(self, backends, max_waiting=16, timeout=10.0):
+        self.size = len(backends)
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self._free = queue.Queue()
+        for backend in backends:
+            self._free.put(EncoderWorker(backend))
+        # Bounds callers that hold or wait for a worker
+        self._slots = threading.BoundedSemaphore(self.size + max_waiting)
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        """Context manager yielding a free EncoderWorker."""
+        if not self._slots.acquire(blocking=False):
+            raise EncoderPoolBusy("Formula encoder queue is full")
+        try:
+            try:
+                worker = self._free.get(timeout=self.timeout if timeout is None else timeout)
+            except queue.Empty:
+                raise EncoderPoolBusy("Timed out waiting for a formula encoder")
+            try:
+                yield worker
+            finally:
+                self._free.put(worker)
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        return {"workers": self.size, "free": self._free.qsize(), "max_waiting": self.max_waiting}
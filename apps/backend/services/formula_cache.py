@@ -0,0 +1,204 @@
+"""
+Two-level cache for TangentCFT query formula vectors.
+
+Level one is an in-process LRU; level two is a SQLite file shared by every
+worker process and kept across restarts. Keys are normalized LaTeX so that
+trivially different spellings of the same formula share one entry.
+"""
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from paths import DATA_PATH
+from config_loader import get_config
+from services.models import encode_formulas
+
+_DELIMITERS = re.compile(r'^(\$\$|\$|\\\(|\\\[)(.*?)(\$\$|\$|\\\)|\\\])$', re.DOTALL)
+# Whitespace only matters after a control word followed by a letter ("\alpha x")
+# or as a control space ("\ "); every other run of whitespace can be dropped.
+_SPACE = re.compile(r'(\\[a-zA-Z]+\s+(?=[a-zA-Z])|\\\s)|\s+')
+
+
+def _keep_significant_space(m):
+    return ' '.join(m.group(1).split()) + ' ' if m.group(1) else ''
+
+
+def normalize_latex(latex: str) -> str:
+    """
+    Normalizes a LaTeX formula for use as a cache key.
+
+    Strips math delimiters ($...$, $$...$$, \\(...\\), \\[...\\]) and drops
+    whitespace that does not change how the formula parses.
+
+    Args:
+        latex (str): The LaTeX formula.
+    Returns:
+        str: The normalized formula.
+    """
+    s = latex.strip()
+    m = _DELIMITERS.match(s)
+    if m:
+        s = m.group(2).strip()
+    return _SPACE.sub(_keep_significant_space, s)
+
+
+class FormulaVectorCache:
+    """
+    Formula vector cache with an LRU in front of a size-bounded SQLite store.
+
+    Disk entries are evicted least-recently-used first once the store grows
+    past max_disk_entries. Counters are available through stats().
+    """
+
+    def __init__(self, db_path, max_memory_entries=1024, max_disk_entries=100000):
+        self.db_path = str(db_path)
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS formula_vectors ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS formula_vectors_last_used ON formula_vectors (last_used)")
+        conn.commit()
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared across threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+                self._counters["memory_evictions"] += 1
+
+    def get(self, latex):
+        """Returns the cached vector for a formula, or None on a miss."""
+        key = normalize_latex(latex)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return vector
+
+        conn = self._connection()
+        row = conn.execute("SELECT vector FROM formula_vectors WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self._count("misses")
+            return None
+        conn.execute("UPDATE formula_vectors SET last_used = ? WHERE key = ?", (time.time(), key))
+        conn.commit()
+        vector = np.frombuffer(row[0], dtype=np.float32)
+        self._remember(key, vector)
+        self._count("disk_hits")
+        return vector
+
+    def put(self, latex, vector):
+        """Stores a formula vector in both levels, evicting old disk entries if needed."""
+        key = normalize_latex(latex)
+        vector = np.ascontiguousarray(vector, dtype=np.float32)
+        self._remember(key, vector)
+
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO formula_vectors (key, vector, last_used) VALUES (?, ?, ?)",
+            (key, vector.tobytes(), time.time()),
+        )
+        excess = conn.execute("SELECT COUNT(*) FROM formula_vectors").fetchone()[0] - self.max_disk_entries
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM formula_vectors WHERE key IN ("
+                " SELECT key FROM formula_vectors ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+            self._count("disk_evictions", excess)
+        conn.commit()
+
+    def stats(self):
+        """Returns hit/miss/eviction counters and current sizes."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+        stats["disk_entries"] = self._connection().execute("SELECT COUNT(*) FROM formula_vectors").fetchone()[0]
+        stats["max_memory_entries"] = self.max_memory_entries
+        stats["max_disk_entries"] = self.max_disk_entries
+        return stats
+
+
+_formula_cache = None
+_formula_cache_lock = threading.Lock()
+
+
+def get_formula_cache():
+    """Returns the process-wide formula vector cache, creating it from config.ini on first use."""
+    global _formula_cache
+    if _formula_cache is None:
+        with _formula_cache_lock:
+            if _formula_cache is None:
+                config = get_config()
+                _formula_cache = FormulaVectorCache(
+                    db_path=config.get(
+                        "formula_cache", "path",
+                        fallback=str(DATA_PATH / "cache" / "formula_vectors.sqlite"),
+                    ),
+                    max_memory_entries=config.getint("formula_cache", "memory_entries", fallback=1024),
+                    max_disk_entries=config.getint("formula_cache", "disk_entries", fallback=100000),
+                )
+    return _formula_cache
+
+
+def encode_formulas_cached(latex_list, failed=None):
+    """
+    Same contract as encode_formulas, but serves repeated formulas from the cache.
+    Only successfully encoded (non-zero) vectors are cached.
+    """
+    cache = get_formula_cache()
+    vectors = [cache.get(latex) for latex in latex_list]
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if missing:
+        missing_failed = []
+        encoded = encode_formulas([latex_list[i] for i in missing], failed=missing_failed)
+        if failed is not None:
+            failed.extend(missing[j] for j in missing_failed)
+        for i, vec in zip(missing, encoded):
+            if vec.size and vec.any():
+                cache.put(latex_list[i], vec)
+            vectors[i] = vec
+
+    dim = next((v.size for v in vectors if v.size), 0)
+    out = np.zeros((len(latex_list), dim), dtype=np.float32)
+    for i, vec in enumerate(vectors):
+        if vec.size == dim:
+            out[i] = vec
+    return out
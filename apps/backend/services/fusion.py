@@ -0,0 +1,174 @@
+"""
+Late fusion of formula and text rankings.
+
+/fusion-search sends its text leg and one formula leg per formula in the
+query in a single _msearch; fuse() combines the responses in process with the
+FUSION_* settings. With [fusion] mode = hybrid, OpenSearch fuses instead: a
+hybrid query runs through a search pipeline created from pipeline_body() by
+apps/opensearch/scripts/create_search_pipeline.py.
+"""
+import os
+from dataclasses import dataclass
+
+from config_loader import get_config
+
+_config = get_config()
+# external: LateFusionModel.process_query (the default). msearch: both legs in one
+# _msearch, fused here. hybrid: OpenSearch hybrid query and search pipeline where
+# the method allows it. Check msearch/hybrid against external with
+# benchmark_fusion.py before switching.
+MODE = _config.get("fusion", "mode", fallback="external").strip().lower()
+HYBRID_PIPELINE = _config.get("fusion", "hybrid_pipeline", fallback="mathmex-fusion")
+
+
+@dataclass
+class FusionSettings:
+    """Fusion parameters; the same FUSION_* environment variables configure LateFusionModel."""
+    method: str = "rrf"
+    rrf_k: int = 60
+    weight_formula: float = 0.3
+    weight_text: float = 0.7
+    hybrid_rrf_weight: float = 0.5
+    formula_topk: int = 100
+    text_topk: int = 100
+    final_topk: int = 100
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            method=os.getenv("FUSION_METHOD", "rrf"),
+            rrf_k=int(os.getenv("FUSION_RRF_K", "60")),
+            weight_formula=float(os.getenv("FUSION_WEIGHT_FORMULA", "0.3")),
+            weight_text=float(os.getenv("FUSION_WEIGHT_TEXT", "0.7")),
+            hybrid_rrf_weight=float(os.getenv("FUSION_HYBRID_RRF_WEIGHT", "0.5")),
+            formula_topk=int(os.getenv("FUSION_FORMULA_TOPK", "100")),
+            text_topk=int(os.getenv("FUSION_TEXT_TOPK", "100")),
+            final_topk=int(os.getenv("FUSION_FINAL_TOPK", "100")),
+        )
+
+
+@dataclass
+class FusedResult:
+    """One fused document, with the fields of LateFusionModel's results plus the hit's _source."""
+    doc_id: str
+    fused_score: float
+    formula_rank: int = None
+    formula_score: float = None
+    text_rank: int = None
+    text_score: float = None
+    in_both: bool = False
+    source: dict = None
+
+
+def _ranking(hit_lists, topk):
+    """Merges hit lists by each document's best score. Returns {_id: (rank, score, _source)}."""
+    best = {}
+    for hits in hit_lists:
+        for hit in hits:
+            if hit["_id"] not in best or hit["_score"] > best[hit["_id"]]["_score"]:
+                best[hit["_id"]] = hit
+    ranked = sorted(best.values(), key=lambda hit: -hit["_score"])[:topk]
+    return {hit["_id"]: (rank, hit["_score"], hit["_source"]) for rank, hit in enumerate(ranked, start=1)}
+
+
+def _min_max(ranking):
+    if not ranking:
+        return {}
+    scores = [score for _, score, _ in ranking.values()]
+    low, span = min(scores), (max(scores) - min(scores)) or 1.0
+    return {doc_id: (score - low) / span for doc_id, (_, score, _) in ranking.items()}
+
+
+def fuse(formula_hit_lists, text_hits, settings):
+    """
+    Fuses formula and text hits.
+
+    Args:
+        formula_hit_lists (list[list[dict]]): Hits of each formula leg; a document's
+            formula score is its best over all legs.
+        text_hits (list[dict]): Hits of the text leg.
+        settings (FusionSettings): method is rrf (sum of 1 / (rrf_k + rank)),
+            weighted (weighted sum of min-max normalized scores) or hybrid
+            (hybrid_rrf_weight * normalized rrf + the rest weighted).
+    Returns:
+        list[FusedResult]: At most final_topk results, best first.
+    """
+    formula = _ranking(formula_hit_lists, settings.formula_topk)
+    text = _ranking([text_hits], settings.text_topk)
+
+    rrf = {}
+    for ranking in (formula, text):
+        for doc_id, (rank, _, _) in ranking.items():
+            rrf[doc_id] = rrf.get(doc_id, 0.0) + 1.0 / (settings.rrf_k + rank)
+    formula_norm, text_norm = _min_max(formula), _min_max(text)
+    weighted = {
+        doc_id: settings.weight_formula * formula_norm.get(doc_id, 0.0)
+        + settings.weight_text * text_norm.get(doc_id, 0.0)
+        for doc_id in rrf
+    }
+    if settings.method == "weighted":
+        fused = weighted
+    elif settings.method == "hybrid":
+        top_rrf = max(rrf.values(), default=1.0)
+        h = settings.hybrid_rrf_weight
+        fused = {doc_id: h * rrf[doc_id] / top_rrf + (1 - h) * weighted[doc_id] for doc_id in rrf}
+    else:
+        fused = rrf
+
+    results = []
+    for doc_id, score in fused.items():
+        f_rank, f_score, f_source = formula.get(doc_id, (None, None, None))
+        t_rank, t_score, t_source = text.get(doc_id, (None, None, None))
+        results.append(FusedResult(
+            doc_id=doc_id,
+            fused_score=score,
+            formula_rank=f_rank,
+            formula_score=f_score,
+            text_rank=t_rank,
+            text_score=t_score,
+            in_both=f_rank is not None and t_rank is not None,
+            source=t_source or f_source,
+        ))
+    results.sort(key=lambda result: -result.fused_score)
+    return results[:settings.final_topk]
+
+
+def hybrid_supported(settings):
+    """Search pipelines can do weighted (normalization) and rrf (score ranker), not the rrf/weighted mix."""
+    return settings.method in ("rrf", "weighted")
+
+
+def pipeline_body(settings):
+    """
+    Search pipeline for a hybrid query whose sub-queries are [formula, text].
+
+    Raises:
+        ValueError: For fusion methods a pipeline cannot express.
+    """
+    if settings.method == "rrf":
+        processor = {"score-ranker-processor": {
+            "combination": {"technique": "rrf", "rank_constant": settings.rrf_k},
+        }}
+    elif settings.method == "weighted":
+        total = (settings.weight_formula + settings.weight_text) or 1.0
+        processor = {"normalization-processor": {
+            "normalization": {"technique": "min_max"},
+            "combination": {
+                "technique": "arithmetic_mean",
+                "parameters": {"weights": [settings.weight_formula / total, settings.weight_text / total]},
+            },
+        }}
+    else:
+        raise ValueError(f"FUSION_METHOD={settings.method} cannot run as a search pipeline; use rrf or weighted")
+    return {
+        "description": f"MathMex formula + text fusion ({settings.method})",
+        "phase_results_processors": [processor],
+    }
+
+
+def hybrid_results(response):
+    """FusedResults from a hybrid query response, where only the combined score is known."""
+    return [
+        FusedResult(doc_id=hit["_id"], fused_score=hit["_score"], source=hit["_source"])
+        for hit in response["hits"]["hits"]
+    ]
@@ -0,0 +1,246 @@
+"""
+Text generation on a dedicated worker thread.
+
+/summarize and query enhancement (do_enhance) hand their prompts to one
+GenerationWorker instead of running the model in the request thread. The
+worker runs one generation at a time from a bounded queue. When the queue is
+full, submit() raises GenerationBusy at once (a 503) instead of letting
+requests pile up behind tens of seconds of generation. Text is pushed to the
+job as it is decoded, so /summarize can stream it as server-sent events, and a
+cancelled job (client gone, timeout) stops at the next token.
+
+[generation] model names a causal LM (HuggingFace ID or local path). A small
+instruct model on CPU, e.g. HuggingFaceTB/SmolLM2-135M-Instruct, is enough to
+run the feature without a GPU.
+"""
+import os
+import queue
+import threading
+import time
+
+from config_loader import get_config
+from services.encode_batcher import Histogram
+from services.query_cache import TTLCache
+
+_config = get_config()
+MODEL = os.path.expanduser(_config.get("generation", "model", fallback=""))
+DEVICE = _config.get("generation", "device", fallback="cpu")
+THREADS = _config.getint("generation", "threads", fallback=0)
+QUEUE_SIZE = _config.getint("generation", "queue_size", fallback=4)
+
+# Enhancements depend only on the query and the model, so they do not expire
+enhancement_cache = TTLCache(max_entries=_config.getint("generation", "enhancement_entries", fallback=2048))
+
+_DONE = object()
+
+
+class GenerationBusy(RuntimeError):
+    """The generation queue is full."""
+
+
+class GenerationJob:
+    """One prompt in the worker's queue; its text arrives through stream() or result()."""
+
+    def __init__(self, prompt, max_new_tokens, temperature):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.enqueued = time.perf_counter()
+        self.cancelled = threading.Event()
+        self._chunks = queue.Queue()
+
+    def cancel(self):
+        """Stops the generation at its next token, or skips it if it has not started."""
+        self.cancelled.set()
+
+    def stream(self, timeout=None):
+        """
+        Yields text pieces as they are generated.
+
+        Args:
+            timeout (float, optional): Longest wait for any one piece (including
+                time spent queued); the job is cancelled when it runs out.
+        Raises:
+            TimeoutError: If a piece takes longer than timeout.
+        """
+        while True:
+            try:
+                chunk = self._chunks.get(timeout=timeout)
+            except queue.Empty:
+                self.cancel()
+                raise TimeoutError(f"No generated text within {timeout}s")
+            if chunk is _DONE:
+                return
+            if isinstance(chunk, BaseException):
+                raise chunk
+            yield chunk
+
+    def result(self, timeout=None):
+        """
+        Blocks until the generation finishes and returns all of its text.
+
+        Raises:
+            TimeoutError: If it does not finish within timeout seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        pieces = []
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                self.cancel()
+                raise TimeoutError(f"Generation did not finish within {timeout}s")
+            try:
+                chunk = self._chunks.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if chunk is _DONE:
+                return "".join(pieces)
+            if isinstance(chunk, BaseException):
+                raise chunk
+            pieces.append(chunk)
+
+    def _put(self, chunk):
+        self._chunks.put(chunk)
+
+
+class TransformersGenerator:
+    """Greedy or sampled generation with a transformers causal LM, streaming decoded text."""
+
+    def __init__(self, model_name, device="cpu", threads=0):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteria, TextStreamer
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForCausalLM.from_pretrained(model_name).to(device)
+        self.model.eval()
+
+        class CallbackStreamer(TextStreamer):
+            def __init__(self, tokenizer, on_text):
+                super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+                self.on_text = on_text
+
+            def on_finalized_text(self, text, stream_end=False):
+                if text:
+                    self.on_text(text)
+
+        class StopWhen(StoppingCriteria):
+            def __init__(self, should_stop):
+                self.should_stop = should_stop
+
+            def __call__(self, input_ids, scores, **kwargs):
+                return self.should_stop()
+
+        self._streamer = CallbackStreamer
+        self._stop = StopWhen
+
+    def generate(self, prompt, max_new_tokens, temperature, on_text, should_stop):
+        """Runs one generation in this thread, calling on_text with each decoded piece."""
+        from transformers import StoppingCriteriaList
+
+        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+        sampling = {"do_sample": True, "temperature": temperature} if temperature else {"do_sample": False}
+        with self.torch.no_grad():
+            self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                streamer=self._streamer(self.tokenizer, on_text),
+                stopping_criteria=StoppingCriteriaList([self._stop(should_stop)]),
+                pad_token_id=self.tokenizer.pad_token_id or self.tokenizer.eos_token_id,
+                **sampling,
+            )
+
+
+class GenerationWorker:
+    """
+    Runs generations one at a time on a daemon thread.
+
+    Args:
+        generator: Has generate(prompt, max_new_tokens, temperature, on_text, should_stop).
+        queue_size (int): Jobs that may wait for the worker; more raise GenerationBusy.
+    """
+
+    def __init__(self, generator, queue_size=QUEUE_SIZE):
+        self.generator = generator
+        self.queue_size = max(1, queue_size)
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._counters = {"completed": 0, "failed": 0, "cancelled": 0, "rejected": 0}
+        self._lock = threading.Lock()
+        self.wait_ms = Histogram([10, 100, 500, 1000, 5000, 10000, 30000, 60000])
+        self.generate_ms = Histogram([100, 500, 1000, 5000, 10000, 30000, 60000, 120000])
+        self._thread = threading.Thread(target=self._run, name="generation-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt, max_new_tokens, temperature=0.0):
+        """
+        Queues a prompt and returns its job without waiting.
+
+        Raises:
+            GenerationBusy: If queue_size jobs are already waiting.
+        """
+        job = GenerationJob(prompt, max_new_tokens, temperature)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._count("rejected")
+            raise GenerationBusy(f"{self.queue_size} generations already queued")
+        return job
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            start = time.perf_counter()
+            self.wait_ms.observe((start - job.enqueued) * 1000)
+            if job.cancelled.is_set():
+                self._count("cancelled")
+                job._put(_DONE)
+                continue
+            try:
+                self.generator.generate(
+                    job.prompt, job.max_new_tokens, job.temperature,
+                    on_text=job._put, should_stop=job.cancelled.is_set,
+                )
+            except Exception as e:
+                print(f"Generation failed ({type(e).__name__}: {e})")
+                self._count("failed")
+                job._put(e)
+                continue
+            self.generate_ms.observe((time.perf_counter() - start) * 1000)
+            self._count("cancelled" if job.cancelled.is_set() else "completed")
+            job._put(_DONE)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            "queue_size": self.queue_size,
+            "queued": self._queue.qsize(),
+            **counters,
+            "queue_wait_ms": self.wait_ms.snapshot(),
+            "generate_ms": self.generate_ms.snapshot(),
+        }
+
+
+worker = None
+
+
+def generation_enabled():
+    return bool(MODEL)
+
+
+def load_generation():
+    """Loads [generation] model and starts the worker; a readiness loader."""
+    global worker
+    if worker is None:
+        worker = GenerationWorker(TransformersGenerator(MODEL, DEVICE, THREADS), QUEUE_SIZE)
+        print(f"Generation model: {MODEL} on {DEVICE}")
+
+
+def get_worker():
+    return worker
@@ -0,0 +1,49 @@
+"""
+Where kNN searches go: one index per source (fan-out) or one consolidated index.
+
+With [opensearch] consolidated = true, every source lives in CONSOLIDATED_INDEX
+with a keyword "source" field and is routed by source name. Source and media
+type selection then become filters inside the kNN search, and a search over a
+subset of sources only touches the shards those sources are routed to.
+Efficient kNN filters need a faiss or Lucene mapping profile.
+"""
+from config_loader import get_config
+from schemas.indexes import source_to_index, CONSOLIDATED_INDEX
+
+CONSOLIDATED = get_config().getboolean("opensearch", "consolidated", fallback=False)
+
+
+def search_targets(sources=None, consolidated=None):
+    """
+    Resolves the selected sources to search request parameters.
+
+    Args:
+        sources (list, optional): Source names; all sources if empty.
+        consolidated (bool, optional): Override the configured layout (used by benchmarks).
+    Returns:
+        tuple: (params, source_filter). params holds "index" (and "routing" for a
+        subset of sources on the consolidated index) for client.search;
+        source_filter is a terms filter on "source", or None for fan-out.
+    """
+    consolidated = CONSOLIDATED if consolidated is None else consolidated
+    selected = [s for s in sources if s in source_to_index] if sources else list(source_to_index)
+    if not consolidated:
+        return {"index": [source_to_index[s] for s in selected]}, None
+    params = {"index": CONSOLIDATED_INDEX}
+    if sources and len(selected) < len(source_to_index):
+        params["routing"] = ",".join(selected)
+    return params, {"terms": {"source": selected}}
+
+
+def knn_query(field, vector, k, filters=None, ef_search=None):
+    """
+    A knn clause for one vector field; filters (list of query clauses) are
+    applied inside the ANN search rather than to its results. ef_search
+    overrides the graph search width for this query only.
+    """
+    spec = {"vector": vector, "k": k}
+    if filters:
+        spec["filter"] = {"bool": {"filter": filters}}
+    if ef_search:
+        spec["method_parameters"] = {"ef_search": ef_search}
+    return {"knn": {field: spec}}
@@ -1,54 +1,128 @@
-from sentence_transformers import SentenceTransformer
+import numpy as np
 import os
 import sys
+import threading
 
 from paths import ROOT, FORMULA_SEARCH_PATH, setup_formula_search_imports
 from config_loader import get_config
+from services.encoder_pool import TangentEncoderPool
+from services.encode_batcher import EncodeBatcher
+from services import readiness, onnx_encoder
 
 embedding_model = None
 tangent_backend = None
-generation_model = None
+encoder_pool = None
 
-def load_models():
-    global embedding_model, tangent_backend, generation_model
+_loader_thread = None
+_loader_lock = threading.Lock()
 
-    if embedding_model is None:
-        config = get_config()
-        model_path = os.path.expanduser(config.get("general", "model"))
+def create_tangent_backend():
+    """Builds and loads one independent TangentCFT backend instance."""
+    setup_formula_search_imports()
+    fs = str(FORMULA_SEARCH_PATH)
+    from tangent_cft_back_end import TangentCFTBackEnd
+    from Embedding_Preprocessing.encoder_tuple_level import TupleTokenizationMode
+    backend = TangentCFTBackEnd(
+        config_file=f"{fs}/Configuration/config/config_1",
+        path_data_set=f"{fs}/ARQMathDataset",
+        is_wiki=False,
+        streaming=True,
+        read_slt=True,
+        queries_directory_path=str(ROOT / "ARQMathQueries" / "test_SLT.tsv"),
+        faiss=True
+    )
+    backend.load_model(
+        map_file_path=f"{fs}/Embedding_Preprocessing/slt_encoder.tsv",
+        model_file_path=f"{fs}/slt_model",
+        embedding_type=TupleTokenizationMode(3),
+        ignore_full_relative_path=True,
+        tokenize_all=False,
+        tokenize_number=True
+    )
+    return backend
+
+def _load_embedding_model(backend=None):
+    """Loads [general] model with PyTorch, or its ONNX export when the backend ([embedding] backend) is onnx."""
+    global embedding_model
+    if embedding_model is not None:
+        return
+    backend = backend or onnx_encoder.BACKEND
+    if backend == "onnx":
+        embedding_model = onnx_encoder.OnnxSentenceEncoder()
+        print(f"Embedding model: ONNX Runtime ({embedding_model.model_file.name})")
+    else:
+        # Imported here so ONNX-only nodes do not need torch
+        from sentence_transformers import SentenceTransformer
+
+        model_path = os.path.expanduser(get_config().get("general", "model"))
         embedding_model = SentenceTransformer(model_path)
 
-    if tangent_backend is None and FORMULA_SEARCH_PATH.exists():
-        try:
-            setup_formula_search_imports()
-            fs = str(FORMULA_SEARCH_PATH)
-            from tangent_cft_back_end import TangentCFTBackEnd
-            from Embedding_Preprocessing.encoder_tuple_level import TupleTokenizationMode
-            tangent_backend = TangentCFTBackEnd(
-                config_file=f"{fs}/Configuration/config/config_1",
-                path_data_set=f"{fs}/ARQMathDataset",
-                is_wiki=False,
-                streaming=True,
-                read_slt=True,
-                queries_directory_path=str(ROOT / "ARQMathQueries" / "test_SLT.tsv"),
-                faiss=True
-            )
-            tangent_backend.load_model(
-                map_file_path=f"{fs}/Embedding_Preprocessing/slt_encoder.tsv",
-                model_file_path=f"{fs}/slt_model",
-                embedding_type=TupleTokenizationMode(3),
-                ignore_full_relative_path=True,
-                tokenize_all=False,
-                tokenize_number=True
-            )
-        except Exception:
-            tangent_backend = None
+def _load_tangent_backend():
+    global tangent_backend, encoder_pool
+    if tangent_backend is not None:
+        return
+    config = get_config()
+    # Each worker gets its own backend so formula encodes run in parallel
+    workers = max(1, config.getint("formula_encoder", "workers", fallback=1))
+    backends = [create_tangent_backend() for _ in range(workers)]
+    encoder_pool = TangentEncoderPool(
+        backends,
+        max_waiting=config.getint("formula_encoder", "max_waiting", fallback=16),
+        timeout=config.getfloat("formula_encoder", "timeout", fallback=10.0),
+    )
+    tangent_backend = backends[0]
+
+def _model_components(extra_loaders=(), embedding_backend=None):
+    """(name, loader) for every component to load; TangentCFT only with formula-search present."""
+    components = [("embedding", lambda: _load_embedding_model(embedding_backend))]
+    if FORMULA_SEARCH_PATH.exists():
+        components.append(("tangent_cft", _load_tangent_backend))
+    else:
+        readiness.set_state("tangent_cft", readiness.DISABLED, "formula-search not found")
+    return components + list(extra_loaders)
 
-    # uncommment when we want to use the generation model
-    # if generation_model is None:
-    #     generation_model = pipeline("text-generation", model="mistralai/Mistral-7B-v0.3")
+def load_models(extra_loaders=(), strict=True, embedding_backend=None):
+    """
+    Loads the embedding model, the TangentCFT backends and any extra components
+    in this thread, recording each one's state in services.readiness.
+
+    Args:
+        extra_loaders: (name, callable) pairs loaded after the models.
+        strict (bool): Re-raise a failure to load the embedding model.
+        embedding_backend (str, optional): torch or onnx, overriding [embedding] backend.
+    """
+    for name, loader in _model_components(extra_loaders, embedding_backend):
+        readiness.load_component(name, loader, reraise=strict and name == "embedding")
 
     print("Models are loaded")
 
+def start_background_loading(extra_loaders=()):
+    """
+    Starts load_models on a daemon thread and returns at once, so the server can
+    take requests (and answer /readyz) while models load. Safe to call twice.
+    """
+    global _loader_thread
+    with _loader_lock:
+        if _loader_thread is not None:
+            return _loader_thread
+        components = _model_components(extra_loaders)
+        # Mark everything loading up front so readiness never sees a gap
+        for name, _ in components:
+            readiness.set_state(name, readiness.LOADING)
+
+        def load_all():
+            for name, loader in components:
+                readiness.load_component(name, loader)
+            print("Models are loaded")
+
+        _loader_thread = threading.Thread(
+            target=load_all,
+            name="model-loader",
+            daemon=True,
+        )
+        _loader_thread.start()
+        return _loader_thread
+
 # Note these are just passing references, not copies. So this is efficient versus reloading models in multiple places.
 def get_embedding_model():
     return embedding_model
@@ -56,5 +130,106 @@ def get_embedding_model():
 def get_tangent_backend():
     return tangent_backend
 
-def get_generation_model():
-    return generation_model
\ No newline at end of file
+def get_encoder_pool():
+    return encoder_pool
+
+TEXT_BATCH_SIZE = 64
+
+def _encode_text_batch(texts):
+    return get_embedding_model().encode(
+        texts, batch_size=TEXT_BATCH_SIZE, convert_to_numpy=True, show_progress_bar=False
+    )
+
+_batching_config = get_config()
+# Concurrent query encodes share forward passes; see services/encode_batcher.py
+text_batcher = EncodeBatcher(
+    _encode_text_batch,
+    max_batch=_batching_config.getint("query_encoder", "max_batch", fallback=32),
+    wait_ms=_batching_config.getfloat("query_encoder", "wait_ms", fallback=2.0),
+) if _batching_config.getboolean("query_encoder", "batching", fallback=True) else None
+
+def encode_texts(texts):
+    """
+    Encode query texts with the embedding model, batched with concurrent callers.
+
+    Args:
+        texts (list[str]): Texts to encode.
+    Returns:
+        np.ndarray: Array of shape (len(texts), dim), in input order.
+    """
+    if get_embedding_model() is None:
+        raise RuntimeError("Embedding model is not loaded")
+    if text_batcher is None:
+        return np.asarray(_encode_text_batch(list(texts)), dtype=np.float32)
+    return text_batcher.encode(texts)
+
+def encode_formulas(latex_list, failed=None):
+    """
+    Encode LaTeX formulas into TangentCFT vectors without touching the filesystem.
+
+    Each formula is converted to MathML, parsed into SLT tuples and embedded
+    in turn, all under one TangentCFT worker from the encoder pool (acquired
+    once per call). The backend's encoder maps are read but never updated.
+
+    Args:
+        latex_list (list[str]): LaTeX formulas to encode.
+        failed (list, optional): Indices of formulas whose conversion or
+            encoding raised are appended here.
+    Returns:
+        np.ndarray: Array of shape (len(latex_list), dim). Rows for formulas
+        with no SLT tuples (e.g. plain text) and for failed formulas are all zeros.
+    Raises:
+        EncoderPoolBusy: If no worker became free in time.
+    """
+    pool = get_encoder_pool()
+    if pool is None:
+        raise RuntimeError("TangentCFT backend is not loaded")
+    with pool.acquire() as worker:
+        return _encode_formulas_with(worker.backend, latex_list, failed)
+
+def _encode_formulas_with(backend, latex_list, failed=None):
+    from utils.format import format_for_tangent_cft_search
+    from TangentS.math_tan.math_extractor import MathExtractor
+    from Embedding_Preprocessing.encoder_tuple_level import TupleEncoder, TupleTokenizationMode
+
+    embedding_type = getattr(backend, "embedding_type", None) or TupleTokenizationMode(3)
+    vectors = [None] * len(latex_list)
+    errors = []
+    for i, latex in enumerate(latex_list):
+        try:
+            mathml = format_for_tangent_cft_search(latex)
+            trees = MathExtractor.parse_from_xml(mathml, 1, operator=False)
+            tuples = [t for tree in trees.values() for t in tree.get_pairs(window=2, eob=True)]
+            if not tuples:
+                continue
+            # Unknown tokens get ids local to this call; the update maps are discarded
+            encoded, _, _, _, _ = TupleEncoder.encode_tuples(
+                backend.encoder_map_node,
+                backend.encoder_map_edge,
+                backend.node_id,
+                backend.edge_id,
+                tuples,
+                embedding_type,
+                True,   # ignore_full_relative_path
+                False,  # tokenize_all
+                True,   # tokenize_number
+            )
+            vec = np.asarray(backend.module.get_query_vector(encoded), dtype=np.float32).ravel()
+            if vec.size:
+                vectors[i] = vec
+        except Exception as e:
+            errors.append(i)
+            print(f"Formula encoding failed for formula {i} ({latex!r}): {type(e).__name__}: {e}")
+    if errors:
+        print(f"Formula encoding failed for {len(errors)} of {len(latex_list)} formulas: {errors[:20]}")
+        if failed is not None:
+            failed.extend(errors)
+
+    dim = next((v.size for v in vectors if v is not None), 0)
+    if dim == 0:
+        return np.zeros((len(latex_list), 0), dtype=np.float32)
+    out = np.zeros((len(latex_list), dim), dtype=np.float32)
+    for i, vec in enumerate(vectors):
+        if vec is not None:
+            out[i] = vec
+    return out
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""
+ONNX Runtime inference for the sentence embedding model.
+
+export_onnx.py writes the [general] model's transformer to
+data/onnx/<model name>/model.onnx (and model_int8.onnx, dynamically quantized),
+with its tokenizer and a manifest holding the pooling settings.
+OnnxSentenceEncoder runs that export on CPU and provides the part of
+SentenceTransformer the backend and generate_vectors.py use: encode(),
+tokenizer, max_seq_length and get_sentence_embedding_dimension().
+Selected with [embedding] backend = onnx.
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from paths import DATA_PATH
+from config_loader import get_config
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+MANIFEST = "mathmex_onnx.json"
+FP32_FILE = "model.onnx"
+INT8_FILE = "model_int8.onnx"
+
+_config = get_config()
+BACKEND = _config.get("embedding", "backend", fallback="torch").strip().lower()
+QUANTIZED = _config.getboolean("embedding", "quantized", fallback=True)
+THREADS = _config.getint("embedding", "threads", fallback=0)
+
+
+def default_export_dir(model_path=None):
+    """data/onnx/<last part of the model path or HuggingFace ID>, unless [embedding] onnx_dir is set."""
+    configured = _config.get("embedding", "onnx_dir", fallback="")
+    if configured:
+        return Path(os.path.expanduser(configured))
+    model_path = model_path or os.path.expanduser(_config.get("general", "model"))
+    return DATA_PATH / "onnx" / Path(model_path.rstrip("/")).name
+
+
+class OnnxSentenceEncoder:
+    """A SentenceTransformer stand-in backed by an exported ONNX transformer."""
+
+    def __init__(self, export_dir=None, quantized=QUANTIZED, threads=THREADS):
+        if onnxruntime is None:
+            raise RuntimeError("onnxruntime is not installed: pip install onnxruntime")
+        from transformers import AutoTokenizer
+
+        self.export_dir = Path(export_dir or default_export_dir())
+        manifest_path = self.export_dir / MANIFEST
+        if not manifest_path.exists():
+            raise FileNotFoundError(f"{manifest_path} not found; run apps/backend/export_onnx.py first")
+        with open(manifest_path, encoding="utf-8") as f:
+            self.manifest = json.load(f)
+
+        model_file = self.export_dir / (INT8_FILE if quantized else FP32_FILE)
+        if not model_file.exists():
+            raise FileNotFoundError(f"{model_file} not found; run apps/backend/export_onnx.py"
+                                    + ("" if quantized else " (or set [embedding] quantized = true)"))
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            str(model_file), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = [i.name for i in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(str(self.export_dir))
+        self.max_seq_length = self.manifest["max_seq_length"]
+        self.pooling = self.manifest["pooling"]
+        self.normalize = self.manifest["normalize"]
+        self.model_file = model_file
+
+    def get_sentence_embedding_dimension(self):
+        return self.manifest["dimension"]
+
+    def _pool(self, hidden, attention_mask):
+        if self.pooling == "cls":
+            return hidden[:, 0]
+        mask = attention_mask[..., None].astype(hidden.dtype)
+        if self.pooling == "max":
+            return np.where(mask > 0, hidden, -1e9).max(axis=1)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, convert_to_numpy=True,
+               normalize_embeddings=False, **kwargs):
+        """
+        Same contract as SentenceTransformer.encode for the options MathMex uses.
+
+        Returns:
+            np.ndarray: (dim,) for a single string, else (len(sentences), dim) float32.
+        """
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        # Longest first, as SentenceTransformer does, so batches pad to similar lengths
+        order = np.argsort([-len(s) for s in sentences], kind="stable")
+        embeddings = np.empty((len(sentences), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        for start in range(0, len(sentences), batch_size):
+            batch = order[start:start + batch_size]
+            encoded = self.tokenizer(
+                [sentences[i] for i in batch],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            feeds = {name: encoded[name].astype(np.int64) for name in self._input_names}
+            hidden = self.session.run(None, feeds)[0]
+            embeddings[batch] = self._pool(hidden, encoded["attention_mask"])
+        if self.normalize or normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings /= np.where(norms == 0, 1.0, norms)
+        return embeddings[0] if single else embeddings
+
+
+def parity(reference, candidate, sentences, batch_size=32):
+    """
+    Cosine similarity between two encoders' vectors for the same sentences.
+
+    Returns:
+        np.ndarray: One cosine per sentence.
+    """
+    a = np.asarray(reference.encode(sentences, batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+    b = np.asarray(candidate.encode(sentences, batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+    norms = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    return (a * b).sum(axis=1) / np.where(norms == 0, 1.0, norms)
@@ -18,6 +18,24 @@ def init_opensearch(app):
         ssl_show_warn=False,
     )
 
+def create_async_opensearch(config):
+    """Builds an AsyncOpenSearch client with the same settings as init_opensearch (used by asgi.py)."""
+    from opensearchpy import AsyncOpenSearch
+
+    return AsyncOpenSearch(
+        hosts=[{
+            "host": config.get("opensearch", "host"),
+        }],
+        http_auth=(
+            config.get("opensearch", "username"),
+            config.get("opensearch", "password"),
+        ),
+        use_ssl=True,
+        verify_certs=False,
+        ssl_show_warn=False,
+        maxsize=config.getint("asgi", "opensearch_connections", fallback=256),
+    )
+
 def perform_search(query, k=10):
     model = get_embedding_model()
     client = get_opensearch_client()
@@ -0,0 +1,134 @@
+"""
+Cursor pagination for /search and /fusion-search.
+
+A request with page_size gets the first page and a next_cursor; sending
+{"cursor": ...} back returns the following page. Cursors are opaque tokens
+for state held in a TTL cache, which like the result cache is per process.
+
+There are two kinds of cursor:
+
+- pit: plain text kNN on OpenSearch. Pages are read through a point in time
+  with search_after, so the first page only fetches about a page of hits.
+  Hashes of the body texts already returned travel with the cursor, so
+  duplicates are dropped exactly as in the full list. Only indices whose
+  doc_ID is a keyword (schema v2) can be sorted this way; pit_sortable()
+  checks each index's mapping and remembers the answer for pit_check_ttl.
+- list: everything else (diversified, two-stage, formula, FAISS, fusion). The
+  full ranked list is computed once and pages are slices of it, so dedup and
+  MMR order match the unpaged response.
+"""
+import hashlib
+import secrets
+
+from config_loader import get_config
+from services.query_cache import TTLCache
+
+_config = get_config()
+MAX_PAGE_SIZE = _config.getint("pagination", "max_page_size", fallback=100)
+KEEP_ALIVE = _config.get("pagination", "keep_alive", fallback="2m")
+# Plain text search pages through OpenSearch PIT + search_after. The sort uses the
+# doc_ID keyword as tie-breaker, so this needs schema v2 indices (migrate_index.py).
+PIT_ENABLED = _config.getboolean("pagination", "pit", fallback=True)
+
+# index name -> True if its doc_ID can break PIT sort ties; rechecked after a migration
+sortable_cache = TTLCache(max_entries=256, ttl=_config.getfloat("pagination", "pit_check_ttl", fallback=600.0))
+
+cursor_cache = TTLCache(
+    max_entries=_config.getint("pagination", "cursor_entries", fallback=4096),
+    ttl=_config.getfloat("pagination", "cursor_ttl", fallback=600.0),
+)
+
+
+class InvalidCursor(ValueError):
+    """The cursor is malformed, expired or evicted."""
+
+
+def page_size_from(data):
+    """
+    The requested page size, or None for an unpaged request.
+
+    Raises:
+        ValueError: If page_size is not an integer between 1 and MAX_PAGE_SIZE.
+    """
+    page_size = data.get("page_size")
+    if page_size is None:
+        return None
+    if not isinstance(page_size, int) or isinstance(page_size, bool) or not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise ValueError(f"page_size must be an integer from 1 to {MAX_PAGE_SIZE}")
+    return page_size
+
+
+def body_key(body_text):
+    """Short hash of a result's body text, the key dedup uses."""
+    return hashlib.blake2b((body_text or "").encode("utf-8"), digest_size=8).hexdigest()
+
+
+def pit_sortable(client, indices):
+    """
+    True if every index maps doc_ID as a keyword, so PIT pages can sort on it.
+
+    Each index's mapping is fetched once per pit_check_ttl; a failed lookup
+    counts as not sortable without being remembered.
+    """
+    for index in indices:
+        sortable = sortable_cache.get(index)
+        if sortable is None:
+            try:
+                mappings = client.indices.get_mapping(index=index)
+            except Exception as e:
+                print(f"Could not read the mapping of {index} ({type(e).__name__}: {e}); not paging it with a point in time")
+                return False
+            # An alias resolves to the mappings of the indices behind it
+            sortable = bool(mappings) and all(
+                mapping.get("mappings", {}).get("properties", {}).get("doc_ID", {}).get("type") == "keyword"
+                for mapping in mappings.values()
+            )
+            if not sortable:
+                print(f"{index} has no keyword doc_ID (schema v1); paging it over the full result list")
+            sortable_cache.put(index, sortable)
+        if not sortable:
+            return False
+    return True
+
+
+def save_cursor(state):
+    """Stores cursor state and returns its token."""
+    token = secrets.token_urlsafe(16)
+    cursor_cache.put(token, state)
+    return token
+
+
+def load_cursor(token):
+    """
+    Returns the state behind a cursor token.
+
+    Raises:
+        InvalidCursor: If the token is unknown or has expired.
+    """
+    state = cursor_cache.get(token) if isinstance(token, str) else None
+    if state is None:
+        raise InvalidCursor("Invalid or expired cursor")
+    return state
+
+
+def list_page(results, page_size, offset=0, extra=None):
+    """
+    One page of a fully ranked result list, with a cursor for the rest.
+
+    Args:
+        results (list): Every result, already deduplicated and ordered.
+        extra (dict, optional): Fields returned with every page (e.g. fusion metadata).
+    Returns:
+        dict: {"results", "total", "next_cursor", **extra}
+    """
+    end = offset + page_size
+    next_cursor = None
+    if end < len(results):
+        next_cursor = save_cursor({
+            "kind": "list", "results": results, "offset": end, "page_size": page_size, "extra": extra or {},
+        })
+    return {"results": results[offset:end], "total": len(results), "next_cursor": next_cursor, **(extra or {})}
+
+
+def next_list_page(state):
+    return list_page(state["results"], state["page_size"], state["offset"], state["extra"])
@@ -0,0 +1,178 @@
+"""
+In-process caches for query embeddings and search results.
+
+Both caches are dropped whenever an index is re-ingested. Ingestion scripts
+call mark_index_updated(), which touches a marker file under data/cache/;
+serving processes notice the new mtime on their next lookup.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from paths import DATA_PATH
+from config_loader import get_config
+
+INDEX_GENERATION_FILE = DATA_PATH / "cache" / "index_generation"
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries optionally expire after ttl seconds.
+    A ttl of None keeps entries until they are evicted for space.
+    """
+
+    def __init__(self, max_entries, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key):
+        """Returns the cached value, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            value, stored_at = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self._counters["expirations"] += 1
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+        stats["max_entries"] = self.max_entries
+        stats["ttl"] = self.ttl
+        return stats
+
+
+_config = get_config()
+result_cache = TTLCache(
+    max_entries=_config.getint("query_cache", "result_entries", fallback=2048),
+    ttl=_config.getfloat("query_cache", "result_ttl", fallback=300.0),
+)
+embedding_cache = TTLCache(
+    max_entries=_config.getint("query_cache", "embedding_entries", fallback=4096),
+)
+_generation_check_interval = _config.getfloat("query_cache", "generation_check_interval", fallback=5.0)
+_generation = None
+_generation_checked_at = 0.0
+_generation_lock = threading.Lock()
+
+
+def mark_index_updated():
+    """Signals serving processes that index contents changed. Call after (re-)ingesting."""
+    INDEX_GENERATION_FILE.parent.mkdir(parents=True, exist_ok=True)
+    INDEX_GENERATION_FILE.write_text(str(time.time()))
+
+
+def _read_generation():
+    try:
+        return INDEX_GENERATION_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _check_generation():
+    """Clears both caches if the index generation marker changed since the last check."""
+    global _generation, _generation_checked_at
+    now = time.monotonic()
+    if now - _generation_checked_at < _generation_check_interval:
+        return
+    with _generation_lock:
+        if now - _generation_checked_at < _generation_check_interval:
+            return
+        _generation_checked_at = now
+        generation = _read_generation()
+        if generation != _generation:
+            if _generation is not None or generation is not None:
+                result_cache.clear()
+                embedding_cache.clear()
+            _generation = generation
+
+
+def normalize_query(query):
+    """Collapses whitespace so trivially different spellings share a cache entry."""
+    return " ".join((query or "").split())
+
+
+def result_cache_key(endpoint, query, sources=None, media_types=None, **flags):
+    """
+    Builds a hashable key from a search request. Source and media type lists
+    are order-insensitive; flags are included by name.
+    """
+    return (
+        endpoint,
+        normalize_query(query),
+        tuple(sorted(sources or [])),
+        tuple(sorted(media_types or [])),
+        tuple(sorted((name, bool(value)) for name, value in flags.items())),
+    )
+
+
+def get_cached_results(key):
+    _check_generation()
+    return result_cache.get(key)
+
+
+def cache_results(key, results):
+    result_cache.put(key, results)
+
+
+def encode_text_cached(text):
+    """
+    Encodes text with the embedding model, serving repeated inputs from cache.
+    Returns:
+        list[float]: The embedding as a plain list, ready for a kNN query.
+    """
+    from services.models import encode_texts
+
+    _check_generation()
+    vector = embedding_cache.get(text)
+    if vector is None:
+        vector = encode_texts([text])[0].tolist()
+        embedding_cache.put(text, vector)
+    return vector
+
+
+def encode_texts_cached(texts):
+    """
+    Batch form of encode_text_cached: cache misses are encoded in one model call.
+    Returns:
+        list[list[float]]: One embedding per text, in input order.
+    """
+    from services.models import encode_texts
+
+    _check_generation()
+    vectors = [embedding_cache.get(text) for text in texts]
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+    if missing:
+        encoded = dict(zip(missing, (vector.tolist() for vector in encode_texts(missing))))
+        for text, vector in encoded.items():
+            embedding_cache.put(text, vector)
+        vectors = [vector if vector is not None else encoded[text] for text, vector in zip(texts, vectors)]
+    return vectors
+
+
+def stats():
+    return {"search_results": result_cache.stats(), "query_embeddings": embedding_cache.stats()}
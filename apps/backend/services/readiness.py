@@ -0,0 +1,118 @@
+"""
+Load states of the backend's models and other slow-starting components.
+
+Each component is loading, ready, failed or disabled. Models load on a
+background thread (services.models.start_background_loading), so the server
+answers /healthz and /readyz right away. Routes wrapped in requires() return
+503 with Retry-After until what they need is ready, instead of blocking or
+quietly degrading.
+"""
+import threading
+import time
+from functools import wraps
+
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+DISABLED = "disabled"
+
+# Without these /readyz never reports ready; other components are optional
+REQUIRED = ("embedding",)
+
+RETRY_AFTER_SECONDS = 5
+
+_states = {}
+_lock = threading.Lock()
+
+
+def set_state(component, state, error=None):
+    with _lock:
+        _states[component] = {"state": state, "error": error, "since": time.time()}
+
+
+def get_state(component):
+    with _lock:
+        entry = _states.get(component)
+    return entry["state"] if entry else None
+
+
+def component_states():
+    """Copy of every component's state, error and when it entered that state."""
+    with _lock:
+        return {name: dict(entry) for name, entry in _states.items()}
+
+
+def load_component(component, loader, reraise=False):
+    """
+    Runs loader and records the component as ready, or as failed with the error.
+
+    Returns:
+        bool: True if the loader succeeded.
+    """
+    set_state(component, LOADING)
+    start = time.perf_counter()
+    try:
+        loader()
+    except Exception as e:
+        set_state(component, FAILED, f"{type(e).__name__}: {e}")
+        print(f"{component}: failed to load ({type(e).__name__}: {e})")
+        if reraise:
+            raise
+        return False
+    set_state(component, READY)
+    print(f"{component}: ready in {time.perf_counter() - start:.1f}s")
+    return True
+
+
+def unavailable(required=(), optional=()):
+    """
+    Components a request cannot run without yet.
+
+    Args:
+        required: Components that must be ready.
+        optional: Components that may be failed or disabled (the request then
+            degrades, e.g. to text-only search) but must not still be loading.
+    Returns:
+        dict: State of each blocking component; empty if the request can run.
+    """
+    blocking = {}
+    for component in required:
+        state = get_state(component)
+        if state != READY:
+            blocking[component] = state or LOADING
+    for component in optional:
+        if get_state(component) == LOADING:
+            blocking[component] = LOADING
+    return blocking
+
+
+def not_ready_payload(blocking):
+    """503 body for a request that arrived before its models were ready."""
+    failed = [name for name, state in blocking.items() if state == FAILED]
+    return {
+        "error": "Service unavailable" if failed else "Models are still loading",
+        "components": blocking,
+    }
+
+
+def is_ready():
+    """True once required components are ready and nothing is still loading."""
+    states = component_states()
+    return (
+        all(states.get(name, {}).get("state") == READY for name in REQUIRED)
+        and not any(entry["state"] == LOADING for entry in states.values())
+    )
+
+
+def requires(*required, optional=()):
+    """Flask route decorator: 503 with Retry-After until the components are usable."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            blocking = unavailable(required, optional)
+            if blocking:
+                from flask import jsonify
+                return jsonify(not_ready_payload(blocking)), 503, {"Retry-After": str(RETRY_AFTER_SECONDS)}
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
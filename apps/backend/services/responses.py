@@ -0,0 +1,153 @@
+"""
+JSON serialization and compression for API responses.
+
+With orjson installed, jsonify() in every blueprint goes through
+OrjsonProvider, which writes bytes directly and handles numpy scalars and
+arrays natively, so results no longer need a pure-Python numpy pass.
+Responses of at least [responses] min_bytes are compressed with brotli (if
+installed) or gzip, whichever the client's Accept-Encoding prefers. The
+ASGI /search route uses the same functions through encode_payload().
+"""
+import gzip
+import json
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+from config_loader import get_config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_config = get_config()
+COMPRESS = _config.getboolean("responses", "compress", fallback=True)
+MIN_BYTES = _config.getint("responses", "min_bytes", fallback=1024)
+GZIP_LEVEL = _config.getint("responses", "gzip_level", fallback=5)
+BROTLI_QUALITY = _config.getint("responses", "brotli_quality", fallback=4)
+
+COMPRESSIBLE_TYPES = {"application/json", "text/plain", "text/html", "text/csv"}
+# Preferred first when the client weights encodings equally
+SUPPORTED_ENCODINGS = (("br",) if brotli is not None else ()) + ("gzip",)
+
+
+def dumps(obj, sort_keys=False):
+    """Serializes obj to JSON bytes, with orjson when available."""
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option, default=_default)
+    return json.dumps(obj, sort_keys=sort_keys, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def _default(obj):
+    """numpy values orjson does not take natively (and all of them for the json module)."""
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    return DefaultJSONProvider.default(obj)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson; installed by init_responses()."""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj, sort_keys=kwargs.get("sort_keys", self.sort_keys)).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            # Indented output for debugging; the speed does not matter there
+            return super().response(obj)
+        return self._app.response_class(dumps(obj, sort_keys=self.sort_keys), mimetype=self.mimetype)
+
+
+def negotiate(accept_encoding):
+    """
+    Picks the response encoding from an Accept-Encoding header.
+
+    Returns:
+        str | None: "br", "gzip", or None to send the body uncompressed.
+    """
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+    best, best_q = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def encode_payload(payload, accept_encoding):
+    """
+    JSON body and headers for a payload, compressed if large enough and accepted.
+
+    Returns:
+        tuple: (body bytes, dict of Content-Encoding and Vary headers)
+    """
+    body = dumps(payload)
+    if not COMPRESS or len(body) < MIN_BYTES:
+        return body, {}
+    encoding = negotiate(accept_encoding)
+    if encoding is None:
+        return body, {"Vary": "Accept-Encoding"}
+    return compress(body, encoding), {"Content-Encoding": encoding, "Vary": "Accept-Encoding"}
+
+
+def compress_response(response):
+    """after_request hook: compresses large buffered text and JSON responses."""
+    if (
+        not COMPRESS
+        or response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 206, 304)
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_TYPES
+    ):
+        return response
+    body = response.get_data()
+    if len(body) < MIN_BYTES:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate(request.headers.get("Accept-Encoding"))
+    if encoding is not None:
+        response.set_data(compress(body, encoding))
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_responses(app):
+    """Installs the orjson provider (if orjson is installed) and response compression."""
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
+    app.after_request(compress_response)
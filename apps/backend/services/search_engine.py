@@ -0,0 +1,355 @@
+"""
+Pluggable kNN search engines.
+
+Searches go through get_search_engine(client), which returns an object with
+the OpenSearch client methods MathMex uses, search(index=..., body=...,
+routing=...) and msearch(body=...), returning OpenSearch-shaped responses. [search_engine] backend
+picks the engine:
+
+- opensearch (default): the OpenSearch client itself.
+- faiss: FaissSearchEngine, in-process FAISS indexes built from data/vectors/
+  by apps/data-processing/build_faiss_index.py. Titles, bodies and links are
+  read from the source TSVs on demand, so no cluster is needed.
+
+FaissSearchEngine understands the query shapes MathMex builds (knn with
+filters, nested formula knn, bool must/filter with terms on media_type and
+source, ids). Anything else raises UnsupportedQuery; get_search_engine hands
+those requests to the OpenSearch client when there is one.
+"""
+import csv
+import io
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from paths import DATA_PATH
+from config_loader import get_config
+from schemas.indexes import source_to_index, CONSOLIDATED_INDEX
+from services.vector_store import LocalVectorStore
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+_config = get_config()
+BACKEND = _config.get("search_engine", "backend", fallback="opensearch").strip().lower()
+FAISS_DIR = DATA_PATH / _config.get("search_engine", "faiss_dir", fallback="faiss")
+NPROBE = _config.getint("search_engine", "nprobe", fallback=16)
+EF_SEARCH = _config.getint("search_engine", "ef_search", fallback=128)
+MMAP = _config.getboolean("search_engine", "mmap", fallback=True)
+
+_index_to_source = {index: source for source, index in source_to_index.items()}
+
+
+class UnsupportedQuery(ValueError):
+    """The request uses query DSL the in-process engine does not implement."""
+
+
+class SearchEngine:
+    """The search interface (search, msearch) shared by the OpenSearch client and local engines."""
+
+    def search(self, index=None, body=None, routing=None, **kwargs):
+        raise NotImplementedError
+
+    def msearch(self, body=None, index=None, **kwargs):
+        """
+        Runs _msearch-style (header, body) pairs one after another. A request
+        that fails gets an error entry, as in an OpenSearch _msearch response.
+        """
+        responses = []
+        for header, search_body in zip(body[::2], body[1::2]):
+            try:
+                responses.append(self.search(
+                    index=header.get("index", index), body=search_body, routing=header.get("routing"),
+                ))
+            except UnsupportedQuery as e:
+                responses.append({"error": {"type": "unsupported_query", "reason": str(e)}, "status": 400})
+        return {"took": sum(r.get("took", 0) for r in responses), "responses": responses}
+
+
+def _read_index(path):
+    if MMAP:
+        try:
+            return faiss.read_index(str(path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # Not every index type can be memory-mapped
+            pass
+    return faiss.read_index(str(path))
+
+
+def _search_parameters(index, k, ef_search):
+    """Per-query parameters, so concurrent searches never mutate shared index state."""
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=max(ef_search or EF_SEARCH, k))
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=NPROBE)
+    return None
+
+
+class _SourceIndexes:
+    """The FAISS indexes, doc IDs and TSV row offsets of one source."""
+
+    def __init__(self, manifest):
+        self.source = manifest["source"]
+        self.media_type = manifest["media_type"]
+        self.tsv = manifest["tsv"]
+        self.index_name = source_to_index.get(self.source, self.source)
+        self.offsets = np.load(FAISS_DIR / f"{self.source}_tsv_offsets.npy")
+        self.tsv_size = os.path.getsize(self.tsv)
+        vectors_dir = DATA_PATH / "vectors"
+        self.doc_ids = np.load(vectors_dir / f"{self.source}_doc_ids.npy", mmap_mode="r")
+        self.indexes = {
+            field: _read_index(FAISS_DIR / entry["file"])
+            for field, entry in manifest["fields"].items()
+        }
+        self.formula_ends = None
+        if "formulas.formula_vector" in self.indexes:
+            formula_index = np.load(vectors_dir / f"{self.source}_formula_index.npy", mmap_mode="r")
+            self.formula_ends = np.asarray(formula_index["end"])
+        self._fd = os.open(self.tsv, os.O_RDONLY)
+
+    def knn(self, field, query, k, ef_search=None):
+        """Top-k (doc rows, cosine) for one vector field; formula hits keep each document's best."""
+        index = self.indexes.get(field)
+        if index is None or index.ntotal == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        is_formula = field == "formulas.formula_vector"
+        # Several formulas can belong to one document, so over-fetch formula hits
+        depth = min(index.ntotal, k * 4 if is_formula else k)
+        params = _search_parameters(index, depth, ef_search)
+        scores, rows = index.search(query[None, :], depth, params=params)
+        scores, rows = scores[0], rows[0]
+        keep = rows >= 0
+        scores, rows = scores[keep], rows[keep]
+        if is_formula:
+            rows = np.searchsorted(self.formula_ends, rows, side="right")
+            # Results are score-sorted, so the first occurrence is the document's best formula
+            rows, first = np.unique(rows, return_index=True)
+            scores = scores[first]
+            order = np.argsort(-scores, kind="stable")[:k]
+            rows, scores = rows[order], scores[order]
+        return rows, scores
+
+    def document(self, row):
+        """The TSV fields of one document row."""
+        start = int(self.offsets[row])
+        end = int(self.offsets[row + 1]) if row + 1 < len(self.offsets) else self.tsv_size
+        text = os.pread(self._fd, end - start, start).decode("utf-8")
+        fields = next(csv.reader(io.StringIO(text, newline=""), delimiter="\t"), [])
+        return {
+            "doc_ID": self.doc_ids[row].decode(),
+            "source": self.source,
+            "title": fields[0] if len(fields) > 0 else "",
+            "media_type": self.media_type,
+            "body_text": fields[1] if len(fields) > 1 else "",
+            "link": fields[2] if len(fields) > 2 else "",
+        }
+
+
+class FaissSearchEngine(SearchEngine):
+    """In-process kNN over the per-source FAISS indexes in FAISS_DIR."""
+
+    def __init__(self, faiss_dir=FAISS_DIR):
+        if faiss is None:
+            raise RuntimeError("faiss is not installed: pip install faiss-cpu")
+        self.sources = {}
+        for path in sorted(faiss_dir.glob("*.json")):
+            with open(path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("source") not in source_to_index:
+                continue
+            self.sources[manifest["source"]] = _SourceIndexes(manifest)
+            print(f"FAISS: loaded {manifest['source']} ({', '.join(manifest['fields'])})")
+        self._rows = LocalVectorStore(kind="content")
+
+    def search(self, index=None, body=None, routing=None, **kwargs):
+        start = time.perf_counter()
+        body = body or {}
+        query, filters = self._split(body.get("query", {"match_all": {}}))
+        sources = self._selected_sources(index, routing, filters)
+        if "ids" in query:
+            hits = self._ids(sources, query["ids"].get("values", []))
+        elif "nested" in query:
+            nested = query["nested"]
+            if nested.get("path") != "formulas" or nested.get("score_mode", "max") != "max":
+                raise UnsupportedQuery("only nested formula kNN with score_mode max is supported")
+            hits = self._knn(sources, nested["query"])
+        else:
+            hits = self._knn(sources, query)
+
+        hits.sort(key=lambda hit: -hit[0])
+        hits = hits[:body.get("size", 10)]
+        includes = self._includes(body.get("_source", True))
+        hits = [self._hit(entry, includes) for entry in hits]
+        return {
+            "took": int((time.perf_counter() - start) * 1000),
+            "timed_out": False,
+            "hits": {
+                "total": {"value": len(hits), "relation": "eq"},
+                "max_score": hits[0]["_score"] if hits else None,
+                "hits": hits,
+            },
+        }
+
+    @staticmethod
+    def _split(query):
+        """Separates the scoring clause from its filters."""
+        filters = []
+        if "bool" in query:
+            clauses = query["bool"]
+            must = clauses.get("must", [])
+            must = must if isinstance(must, list) else [must]
+            if len(must) != 1 or set(clauses) - {"must", "filter"}:
+                raise UnsupportedQuery("bool queries need exactly one must clause and only filters")
+            extra = clauses.get("filter", [])
+            filters.extend(extra if isinstance(extra, list) else [extra])
+            query = must[0]
+        return query, filters
+
+    @staticmethod
+    def _filter_values(filters):
+        """Allowed values per field ("source", "media_type") from term/terms filters."""
+        allowed = {}
+        for clause in filters:
+            if "bool" in clause and set(clause["bool"]) == {"filter"}:
+                for field, values in FaissSearchEngine._filter_values(clause["bool"]["filter"]).items():
+                    allowed[field] = allowed[field] & values if field in allowed else values
+                continue
+            kind = "terms" if "terms" in clause else "term" if "term" in clause else None
+            if kind is None or len(clause[kind]) != 1:
+                raise UnsupportedQuery(f"unsupported filter {clause}")
+            field, values = next(iter(clause[kind].items()))
+            if field not in ("source", "media_type"):
+                raise UnsupportedQuery(f"unsupported filter field {field}")
+            if isinstance(values, dict):
+                values = values.get("value")
+            values = set(values) if isinstance(values, list) else {values}
+            allowed[field] = allowed[field] & values if field in allowed else values
+        return allowed
+
+    def _selected_sources(self, index, routing, filters):
+        names = index if isinstance(index, (list, tuple)) else str(index or "_all").split(",")
+        if any(name in (CONSOLIDATED_INDEX, "_all", "*") for name in names):
+            selected = set(self.sources)
+        else:
+            selected = {_index_to_source.get(name) for name in names} & set(self.sources)
+        if routing:
+            selected &= set(routing.split(","))
+        return self._restrict([self.sources[s] for s in self.sources if s in selected], filters)
+
+    def _restrict(self, sources, filters):
+        """Applies source and media_type filters; both are constant within a source."""
+        allowed = self._filter_values(filters)
+        if "source" in allowed:
+            sources = [s for s in sources if s.source in allowed["source"]]
+        if "media_type" in allowed:
+            sources = [s for s in sources if s.media_type in allowed["media_type"]]
+        return sources
+
+    def _knn(self, sources, query):
+        if "knn" not in query or len(query["knn"]) != 1:
+            raise UnsupportedQuery("expected a single-field knn query")
+        field, spec = next(iter(query["knn"].items()))
+        # Filters inside the kNN clause select sources just like top-level ones
+        if spec.get("filter"):
+            sources = self._restrict(sources, [spec["filter"]])
+        vector = np.asarray(spec["vector"], dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        ef_search = spec.get("method_parameters", {}).get("ef_search")
+        hits = []
+        for source in sources:
+            rows, cosines = source.knn(field, vector, spec["k"], ef_search)
+            # Same score as OpenSearch cosinesimil: (1 + cos) / 2
+            hits.extend(((1.0 + float(c)) / 2.0, source, int(r)) for r, c in zip(rows, cosines))
+        return hits
+
+    def _ids(self, sources, doc_ids):
+        hits = []
+        for source in sources:
+            for doc_id in doc_ids:
+                row = self._rows.row(source.index_name, doc_id)
+                if row >= 0:
+                    hits.append((1.0, source, row))
+        return hits
+
+    @staticmethod
+    def _includes(source_spec):
+        if source_spec is False:
+            return []
+        if isinstance(source_spec, dict):
+            return source_spec.get("includes")
+        if isinstance(source_spec, list):
+            return source_spec
+        return None
+
+    def _hit(self, entry, includes):
+        score, source, row = entry
+        document = source.document(row)
+        doc_id = document["doc_ID"]
+        if includes is not None:
+            if "body_vector" in includes:
+                vectors, found = self._rows.lookup([(source.index_name, doc_id)])
+                if found[0]:
+                    document["body_vector"] = vectors[0].tolist()
+            document = {key: value for key, value in document.items() if key in includes}
+        return {
+            "_index": source.index_name,
+            "_id": doc_id,
+            "_score": score,
+            "_source": document,
+        }
+
+
+class _WithFallback(SearchEngine):
+    """Runs searches on a local engine; requests it cannot answer go to the OpenSearch client."""
+
+    def __init__(self, engine, client):
+        self.engine = engine
+        self.client = client
+
+    def search(self, index=None, body=None, routing=None, **kwargs):
+        try:
+            return self.engine.search(index=index, body=body, routing=routing, **kwargs)
+        except UnsupportedQuery as e:
+            if self.client is None:
+                raise
+            print(f"FAISS: {e}; sending this request to OpenSearch")
+            params = {"routing": routing} if routing else {}
+            return self.client.search(index=index, body=body, **params, **kwargs)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def faiss_enabled():
+    return BACKEND == "faiss"
+
+
+def get_faiss_engine():
+    """The process-wide FaissSearchEngine, loaded on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = FaissSearchEngine()
+    return _engine
+
+
+def get_search_engine(opensearch_client=None):
+    """
+    The engine searches should go to.
+
+    Args:
+        opensearch_client: The OpenSearch client, used directly for the opensearch
+            backend and as the fallback for requests FAISS cannot answer.
+    Returns:
+        An object with OpenSearch-compatible search(index=, body=, routing=) and msearch(body=).
+    """
+    if not faiss_enabled():
+        return opensearch_client
+    return _WithFallback(get_faiss_engine(), opensearch_client)
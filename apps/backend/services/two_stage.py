@@ -0,0 +1,77 @@
+"""
+Two-stage kNN retrieval for perform_search.
+
+Stage one asks OpenSearch for a small candidate pool (k = size = candidates)
+with a query-time ef_search. Stage two re-scores the candidates exactly
+against full-precision vectors from the local memory-mapped stores in
+services/vector_store.py and keeps the best RESULT_SIZE. When filters
+applied after the kNN (or nested formula hits collapsing into documents)
+leave the pool thinner than min_pool, stage one is repeated with a larger k,
+up to max_k.
+"""
+import numpy as np
+
+from config_loader import get_config
+
+_config = get_config()
+ENABLED = _config.getboolean("two_stage", "enabled", fallback=False)
+CANDIDATES = _config.getint("two_stage", "candidates", fallback=200)
+EF_SEARCH = _config.getint("two_stage", "ef_search", fallback=200)
+MIN_POOL = _config.getint("two_stage", "min_pool", fallback=100)
+MAX_K = _config.getint("two_stage", "max_k", fallback=1000)
+DEEPEN_FACTOR = _config.getint("two_stage", "deepen_factor", fallback=4)
+
+# Hits returned after re-scoring, as in the single-stage search
+RESULT_SIZE = 100
+
+
+def may_thin(query_body):
+    """
+    True if the request can return fewer than k documents even when the index
+    has more: post-filters drop kNN hits, and nested formula hits collapse
+    into their parent documents.
+    """
+    bool_query = query_body["query"]["bool"]
+    return "filter" in bool_query or any("nested" in clause for clause in bool_query["must"])
+
+
+def next_depth(response, k, query_body):
+    """Returns the k for another stage-one round, or None if the candidate pool is deep enough."""
+    if len(response["hits"]["hits"]) >= MIN_POOL or k >= MAX_K or not may_thin(query_body):
+        return None
+    return min(k * DEEPEN_FACTOR, MAX_K)
+
+
+def knn_score(cosine):
+    """OpenSearch's cosinesimil score, so exact and ANN scores stay comparable."""
+    return (1.0 + cosine) / 2.0
+
+
+def rescore(response, cosines, found, size=RESULT_SIZE):
+    """
+    Replaces ANN scores with exact ones and re-sorts the hits in place.
+
+    Hits without a local vector keep their ANN score.
+    Args:
+        response (dict): Stage-one search response.
+        cosines (np.ndarray): Exact cosine similarity per hit.
+        found (np.ndarray): Mask of hits that had a local vector.
+    Returns:
+        dict: The response, with at most size hits.
+    """
+    hits = response["hits"]["hits"]
+    for hit, cosine, ok in zip(hits, cosines, found):
+        if ok:
+            hit["_score"] = float(knn_score(cosine))
+    hits.sort(key=lambda hit: hit["_score"], reverse=True)
+    del hits[size:]
+    return response
+
+
+def cosine_to(doc_vectors, query_vector):
+    """Cosine similarity of each row to the query."""
+    query = np.asarray(query_vector, dtype=np.float32).ravel()
+    if doc_vectors.size == 0 or doc_vectors.shape[1] != query.shape[0]:
+        return np.zeros(len(doc_vectors), dtype=np.float32)
+    norms = np.linalg.norm(doc_vectors, axis=1)
+    return doc_vectors @ (query / (np.linalg.norm(query) or 1.0)) / np.where(norms == 0, 1.0, norms)
@@ -0,0 +1,184 @@
+"""
+Local, memory-mapped access to the document vectors produced by
+generate_vectors.py (data/vectors/<source>_content_vectors.npy).
+
+Rows are addressed by the doc_ID stored in each OpenSearch document (a
+content hash, mapped to a row through <source>_doc_ids.npy), so callers
+only need to fetch doc_ID from the cluster instead of shipping full vectors
+back as JSON.
+
+Opened files are rechecked at most every [query_cache]
+generation_check_interval seconds. When the index generation marker or any
+of the files changed (re-ingest, generate_vectors.py run), the index is
+reopened, so lookups never use stale row numbers after a rebuild.
+"""
+import threading
+import time
+
+import numpy as np
+
+from config_loader import get_config
+from paths import DATA_PATH
+from schemas.indexes import source_to_index
+from services.query_cache import INDEX_GENERATION_FILE
+
+CHECK_INTERVAL = get_config().getfloat("query_cache", "generation_check_interval", fallback=5.0)
+
+_index_to_source = {index: source for source, index in source_to_index.items()}
+
+
+class LocalVectorStore:
+    """Lazily memory-maps one vector file per source and looks rows up by doc_ID."""
+
+    def __init__(self, vectors_dir=DATA_PATH / "vectors", kind="content"):
+        self.vectors_dir = vectors_dir
+        self.kind = kind
+        # index name -> dict of the open files ("vectors" is None if they are missing)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _paths(self, source):
+        return {
+            "vectors": self.vectors_dir / f"{source}_{self.kind}_vectors.npy",
+            "doc_ids": self.vectors_dir / f"{source}_doc_ids.npy",
+        }
+
+    @staticmethod
+    def _signature(paths):
+        """What must stay the same for open files to still be current."""
+        signature = []
+        for path in [INDEX_GENERATION_FILE, *paths]:
+            try:
+                stat = path.stat()
+                signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _entry(self, index_name):
+        """The open files for an index, reopened if they changed since they were opened."""
+        now = time.monotonic()
+        entry = self._entries.get(index_name)
+        if entry is not None and now - entry["checked_at"] < CHECK_INTERVAL:
+            return entry
+        with self._lock:
+            entry = self._entries.get(index_name)
+            if entry is not None and now - entry["checked_at"] < CHECK_INTERVAL:
+                return entry
+            source = _index_to_source.get(index_name)
+            paths = self._paths(source) if source else {}
+            signature = self._signature(paths.values())
+            if entry is None or entry["signature"] != signature:
+                if entry is not None:
+                    print(f"Vector files for {index_name} changed, reopening")
+                entry = {"vectors": None, "signature": signature}
+                if paths and all(path.exists() for path in paths.values()):
+                    self._open(entry, paths)
+            entry["checked_at"] = now
+            self._entries[index_name] = entry
+            return entry
+
+    def _open(self, entry, paths):
+        # Sorted IDs plus their row numbers; lookups are a binary search
+        ids = np.load(paths["doc_ids"], mmap_mode="r")
+        order = np.argsort(ids, kind="stable")
+        entry["sorted_ids"] = np.asarray(ids[order])
+        entry["order"] = order
+        entry["vectors"] = np.load(paths["vectors"], mmap_mode="r")
+
+    @staticmethod
+    def _row(entry, doc_id):
+        if entry["vectors"] is None or not doc_id:
+            return -1
+        sorted_ids, order = entry["sorted_ids"], entry["order"]
+        key = str(doc_id).encode()
+        pos = int(np.searchsorted(sorted_ids, key))
+        return int(order[pos]) if pos < len(sorted_ids) and sorted_ids[pos] == key else -1
+
+    def row(self, index_name, doc_id):
+        """Row of doc_ID in this index's vector files, or -1 if it is not there."""
+        return self._row(self._entry(index_name), doc_id)
+
+    def has(self, index_name):
+        """True if vectors for this index are available locally."""
+        return self._entry(index_name)["vectors"] is not None
+
+    def lookup(self, keys):
+        """
+        Gathers vectors for (index_name, doc_ID) pairs.
+
+        Args:
+            keys (list[tuple[str, str]]): Index name and doc_ID per document.
+        Returns:
+            tuple[np.ndarray, np.ndarray]: A float32 (n, dim) array and a boolean
+            mask of which rows were found. Missing rows are zeros.
+        """
+        rows = []
+        for index_name, doc_id in keys:
+            entry = self._entry(index_name)
+            row = self._row(entry, doc_id)
+            rows.append(entry["vectors"][row] if 0 <= row < entry["vectors"].shape[0] else None)
+
+        dim = next((r.shape[0] for r in rows if r is not None), 0)
+        out = np.zeros((len(rows), dim), dtype=np.float32)
+        found = np.zeros(len(rows), dtype=bool)
+        for i, row in enumerate(rows):
+            if row is not None:
+                out[i] = row
+                found[i] = True
+        return out, found
+
+
+class LocalFormulaStore(LocalVectorStore):
+    """
+    Per-document formula vectors: a document's rows of <source>_formulas_vectors.npy
+    are the (start, end) slice given by <source>_formula_index.npy.
+    """
+
+    def __init__(self, vectors_dir=DATA_PATH / "vectors"):
+        super().__init__(vectors_dir, kind="formulas")
+
+    def _paths(self, source):
+        paths = super()._paths(source)
+        paths["formula_index"] = self.vectors_dir / f"{source}_formula_index.npy"
+        return paths
+
+    def _open(self, entry, paths):
+        entry["formula_index"] = np.load(paths["formula_index"], mmap_mode="r")
+        super()._open(entry, paths)
+
+    def best_cosine(self, keys, query_vector):
+        """
+        Highest cosine similarity between the query and each document's formulas.
+
+        Args:
+            keys (list[tuple[str, str]]): Index name and doc_ID per document.
+            query_vector: Formula query vector.
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Similarities and a mask of documents found
+            with at least one formula.
+        """
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = np.zeros(len(keys), dtype=np.float32)
+        found = np.zeros(len(keys), dtype=bool)
+        for i, (index_name, doc_id) in enumerate(keys):
+            entry = self._entry(index_name)
+            row = self._row(entry, doc_id)
+            if row < 0:
+                continue
+            span = entry["formula_index"][row]
+            start, end = int(span["start"]), int(span["end"])
+            if end <= start:
+                continue
+            vectors = np.asarray(entry["vectors"][start:end], dtype=np.float32)
+            if vectors.shape[1] != query.shape[0]:
+                continue
+            norms = np.linalg.norm(vectors, axis=1)
+            scores[i] = float(np.max(vectors @ query / np.where(norms == 0, 1.0, norms)))
+            found[i] = True
+        return scores, found
+
+
+body_vector_store = LocalVectorStore(kind="content")
+formula_vector_store = LocalFormulaStore()
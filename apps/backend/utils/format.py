@@ -35,6 +35,18 @@ def format_for_mathmex(latex):
     # Join with spaces, remove empty $...$
     return " ".join([p for p in parts if p and p != "$$"])
 
+def extract_formulas(latex):
+    """
+    Returns the math parts of a query, i.e. everything outside \\text{...}:
+    '\\text{area} \\pi r^2 \\text{of a circle}' gives ['\\pi r^2'].
+
+    Args:
+        latex (str): The query as entered in MathLive.
+    Returns:
+        list[str]: The formulas, in order.
+    """
+    return [part.strip() for part in re.split(r'\\text\{[^}]*\}', latex or "") if part.strip()]
+
 def format_for_mathlive(text: str) -> str:
     """
     Replaces single $...$ wrappers with $$...$$ for MathLive consistency,
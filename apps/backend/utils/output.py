@@ -0,0 +1,53 @@
+import contextvars
+import io
+import sys
+import threading
+from contextlib import contextmanager
+
+# Buffer that receives print() output for the current thread / asyncio task, if any
+_capture_target = contextvars.ContextVar("capture_target", default=None)
+_install_lock = threading.Lock()
+
+
+class _ContextStdout:
+    """
+    Stand-in for sys.stdout that sends writes to the buffer captured by the
+    current context and everything else to the real stream.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, text):
+        target = _capture_target.get()
+        return (target if target is not None else self._stream).write(text)
+
+    def flush(self):
+        if _capture_target.get() is None:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def _install():
+    with _install_lock:
+        if not isinstance(sys.stdout, _ContextStdout):
+            sys.stdout = _ContextStdout(sys.stdout)
+
+
+@contextmanager
+def capture_stdout():
+    """
+    Captures print() output of the enclosed block into a StringIO.
+
+    Unlike swapping sys.stdout, this only affects the current thread or
+    asyncio task, so concurrent requests keep logging normally.
+    """
+    _install()
+    buffer = io.StringIO()
+    token = _capture_target.set(buffer)
+    try:
+        yield buffer
+    finally:
+        _capture_target.reset(token)
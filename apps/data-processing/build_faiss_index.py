@@ -0,0 +1,139 @@
+"""
+build_faiss_index.py
+
+Build per-source FAISS indexes from the vector files written by
+generate_vectors.py, for the in-process search engine
+(apps/backend/services/search_engine.py, [search_engine] backend = faiss).
+Reads data/vectors/ and data/tsvs/, writes data/faiss/.
+
+For each source this writes one index per vector field
+(<source>_{content,text,formulas}.faiss), the byte offset of every document's
+TSV row (<source>_tsv_offsets.npy, so titles and bodies are read on demand)
+and a manifest (<source>.json). Vectors are L2-normalized, so inner product
+is cosine similarity.
+
+Usage (from project root): python apps/data-processing/build_faiss_index.py SOURCE TSV_FILE [--type hnsw]
+  e.g. python apps/data-processing/build_faiss_index.py wikipedia final_wikipedia.tsv --type ivfpq
+"""
+import argparse
+import json
+import math
+import sys
+from pathlib import Path
+
+_BACKEND = Path(__file__).resolve().parents[1] / "backend"
+sys.path.insert(0, str(_BACKEND))
+
+from paths import DATA_PATH
+
+import numpy as np
+from tqdm import tqdm
+
+from documents import MEDIA_TYPE, iter_rows_with_offsets, vector_paths
+
+try:
+    import faiss
+except ImportError:
+    sys.exit("faiss is not installed: pip install faiss-cpu")
+
+parser = argparse.ArgumentParser(description="Build per-source FAISS indexes from data/vectors/")
+parser.add_argument("source", help="Source name (e.g. arxiv, wikipedia)")
+parser.add_argument("tsv", help="TSV filename in data/tsvs/ the vectors were generated from")
+parser.add_argument("--type", choices=["flat", "hnsw", "ivf", "ivfpq"], default="hnsw",
+                    help="Index type (default: hnsw). flat is exact; ivf/ivfpq are trained and the smallest.")
+parser.add_argument("--m", type=int, default=32, help="HNSW graph degree (default: 32)")
+parser.add_argument("--ef-construction", type=int, default=128, help="HNSW ef_construction (default: 128)")
+parser.add_argument("--nlist", type=int, help="IVF lists (default: 4 * sqrt(vectors))")
+parser.add_argument("--batch-size", type=int, default=50000, help="Vectors added per batch (default: 50000)")
+args = parser.parse_args()
+
+SOURCE = args.source
+TSV_FILE = DATA_PATH / "tsvs" / args.tsv
+VECTORS_DIR = DATA_PATH / "vectors"
+FAISS_DIR = DATA_PATH / "faiss"
+
+# Index file kind -> (vector_paths key, the OpenSearch field it stands in for)
+FIELDS = {
+    "content": ("body", "body_vector"),
+    "text": ("text", "text_vector"),
+    "formulas": ("formulas", "formulas.formula_vector"),
+}
+
+
+def normalized(vectors):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def pq_subquantizers(dim):
+    """Largest divisor of dim that gives at least 8 dimensions per sub-quantizer."""
+    return max(m for m in range(1, dim // 8 + 1) if dim % m == 0)
+
+
+def build_index(vectors):
+    """Builds and fills one index over a (n, dim) memmap. Returns (index, description)."""
+    n, dim = vectors.shape
+    if args.type == "flat":
+        index, description = faiss.IndexFlatIP(dim), "Flat"
+    elif args.type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, args.m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = args.ef_construction
+        description = f"HNSW{args.m}"
+    else:
+        nlist = args.nlist or int(4 * math.sqrt(n))
+        # faiss wants roughly 39+ training points per list
+        nlist = max(1, min(nlist, n // 39))
+        codes = f"PQ{pq_subquantizers(dim)}" if args.type == "ivfpq" else "Flat"
+        description = f"IVF{nlist},{codes}"
+        index = faiss.index_factory(dim, description, faiss.METRIC_INNER_PRODUCT)
+        sample = np.random.default_rng(0).choice(n, size=min(n, nlist * 256), replace=False)
+        print(f"  Training {description} on {len(sample)} vectors...")
+        index.train(normalized(vectors[np.sort(sample)]))
+
+    for start in tqdm(range(0, n, args.batch_size), desc=f"  Adding ({description})"):
+        index.add(normalized(vectors[start:start + args.batch_size]))
+    return index, description
+
+
+def main():
+    paths = vector_paths(VECTORS_DIR, SOURCE)
+    for path in [TSV_FILE, *paths.values()]:
+        if not Path(path).exists():
+            sys.exit(f"File not found: {path}\nRun generate_vectors.py first.")
+    FAISS_DIR.mkdir(parents=True, exist_ok=True)
+
+    # Vector rows are the TSV rows with at least three fields, in file order
+    offsets = np.array([offset for offset, row in iter_rows_with_offsets(TSV_FILE) if len(row) >= 3], dtype=np.int64)
+    doc_count = np.load(paths["doc_ids"], mmap_mode="r").shape[0]
+    if len(offsets) != doc_count:
+        sys.exit(f"{TSV_FILE} has {len(offsets)} usable rows but the vector files hold {doc_count}; "
+                 f"pass the TSV the vectors were generated from.")
+    np.save(FAISS_DIR / f"{SOURCE}_tsv_offsets.npy", offsets)
+
+    manifest = {
+        "source": SOURCE,
+        "media_type": MEDIA_TYPE.get(SOURCE, "article"),
+        "tsv": str(TSV_FILE),
+        "documents": doc_count,
+        "fields": {},
+    }
+    for kind, (key, field) in FIELDS.items():
+        vectors = np.load(paths[key], mmap_mode="r")
+        if vectors.ndim != 2 or vectors.shape[0] == 0 or vectors.shape[1] == 0:
+            print(f"No {kind} vectors for {SOURCE}; skipping {field}.")
+            continue
+        print(f"{field}: {vectors.shape[0]} vectors of dimension {vectors.shape[1]}")
+        index, description = build_index(vectors)
+        file_name = f"{SOURCE}_{kind}.faiss"
+        faiss.write_index(index, str(FAISS_DIR / file_name))
+        manifest["fields"][field] = {"file": file_name, "kind": kind, "index": description,
+                                     "vectors": int(vectors.shape[0]), "dimension": int(vectors.shape[1])}
+
+    with open(FAISS_DIR / f"{SOURCE}.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"FAISS indexes for {SOURCE} written to {FAISS_DIR}")
+
+
+if __name__ == "__main__":
+    main()
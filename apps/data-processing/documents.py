@@ -0,0 +1,160 @@
+"""
+documents.py
+
+Build OpenSearch documents from a TSV plus the vector files written by
+generate_vectors.py. Vectors are memory-mapped and rows are streamed, so
+memory use does not grow with the corpus.
+
+Used by generate_jsonl.py (JSONL export) and bulk_index.py --from-vectors
+(direct ingest without the JSONL intermediate).
+
+Document IDs are content hashes of the TSV row (see document_id), so the
+same row always maps to the same OpenSearch _id and re-ingesting a source
+overwrites documents instead of duplicating them.
+"""
+import csv
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder (much slower on vectors)
+    orjson = None
+
+MEDIA_TYPE = {
+    "arxiv": "pdf",
+    "mathematica": "article",
+    "math-overflow": "article",
+    "math-stack-exchange": "article",
+    "wikipedia": "article",
+    "youtube": "video",
+}
+
+
+def vector_paths(vectors_dir, source):
+    """Paths of the .npy files generate_vectors.py writes for a source."""
+    vectors_dir = Path(vectors_dir)
+    return {
+        "body": vectors_dir / f"{source}_content_vectors.npy",
+        "text": vectors_dir / f"{source}_text_vectors.npy",
+        "formulas": vectors_dir / f"{source}_formulas_vectors.npy",
+        "formula_index": vectors_dir / f"{source}_formula_index.npy",
+        "formula_latex": vectors_dir / f"{source}_all_formulas_flat.npy",
+        "doc_ids": vectors_dir / f"{source}_doc_ids.npy",
+    }
+
+
+def delta_path(vectors_dir, source):
+    """Path of the JSON file listing IDs added and removed by the last generate_vectors.py run."""
+    return Path(vectors_dir) / f"{source}_delta.json"
+
+
+def document_id(source, row):
+    """
+    Stable ID for a TSV row: a SHA-1 of the source name, title, body and link.
+
+    Args:
+        source (str): Source name (e.g. arxiv).
+        row (list): TSV fields; the first three are title, body and link.
+    Returns:
+        str: 40-character hex digest.
+    """
+    key = "\x1f".join([source, row[0], row[1], row[2]])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _load(path):
+    # Plain numeric arrays can be memory-mapped; object arrays (e.g. an empty save) cannot
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        return np.load(path, allow_pickle=True)
+
+
+def iter_documents(source, tsv_file, vectors_dir, only_ids=None):
+    """
+    Yields (row_number, document) for each usable TSV row. Vector fields are
+    numpy arrays; pass documents to serialize_document to get JSON.
+
+    Args:
+        only_ids (set, optional): If given, only documents with these IDs are yielded.
+    """
+    paths = vector_paths(vectors_dir, source)
+    body_vecs = _load(paths["body"])
+    text_vecs = _load(paths["text"])
+    formula_vecs = _load(paths["formulas"])
+    # One (doc_id, start, end) entry per vector row, read straight from the memmap
+    formula_index = _load(paths["formula_index"])
+    all_formulas_flat = _load(paths["formula_latex"])
+
+    with open(tsv_file, 'r', encoding='utf-8') as f_in:
+        reader = csv.reader(f_in, delimiter='\t')
+        # Vector files hold one row per usable TSV row, so skipped lines do not advance it
+        vec_row = -1
+        for i, row in enumerate(reader):
+            if len(row) < 3:
+                print(f"Skipping line {i} due to missing fields")
+                continue
+            vec_row += 1
+            doc_id = document_id(source, row)
+            if only_ids is not None and doc_id not in only_ids:
+                continue
+
+            # Get formula vector slice and LaTeX strings for this document
+            if vec_row < len(formula_index):
+                start, end = int(formula_index[vec_row]["start"]), int(formula_index[vec_row]["end"])
+            else:
+                start, end = 0, 0
+            doc_formulas = [
+                {"latex": str(latex), "formula_vector": np.asarray(vec)}
+                for latex, vec in zip(all_formulas_flat[start:end], formula_vecs[start:end])
+            ] if end > start else []
+
+            yield i, {
+                "doc_ID": doc_id,
+                "title": row[0],
+                "source": source,
+                "media_type": MEDIA_TYPE.get(source, "article"),
+                "body_text": row[1],
+                "body_vector": np.asarray(body_vecs[vec_row]),
+                "text_vector": np.asarray(text_vecs[vec_row]),
+                "formulas": doc_formulas,  # nested list with latex + vector
+                "link": row[2],
+            }
+
+
+def iter_rows_with_offsets(tsv_file):
+    """
+    Yields (byte_offset, row) for every TSV record, where byte_offset is where
+    the record starts in the file (records may span lines inside quotes).
+    """
+    with open(tsv_file, 'rb') as f:
+        position = {"end": 0}
+
+        def lines():
+            for raw in f:
+                position["end"] += len(raw)
+                yield raw.decode('utf-8')
+
+        start = 0
+        for row in csv.reader(lines(), delimiter='\t'):
+            yield start, row
+            start = position["end"]
+
+
+def _json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def serialize_document(document):
+    """Serializes a document (numpy vectors included) to a single-line JSON string."""
+    if orjson is not None:
+        return orjson.dumps(document, option=orjson.OPT_SERIALIZE_NUMPY, default=_json_default).decode()
+    return json.dumps(document, default=_json_default)
@@ -4,14 +4,30 @@ generate_vectors.py
 Generate vector embeddings from TSV for bulk indexing.
 Reads from data/tsvs/, writes to data/vectors/.
 
-Usage (from project root): python apps/data-processing/generate_vectors.py SOURCE TSV_FILE
+Vectors are written in shards to data/vectors/<source>_shards/ as they are
+produced, with a manifest recording completed shards. Pass --resume to pick
+up after the last completed shard; the final .npy files are assembled from
+the shards at the end. Outputs and the delta are staged as .tmp files, the
+manifest is marked "assembling", and only then are they swapped in, so a
+crash during the swap is finished by --resume instead of mixing old and new
+files.
+
+Each row is identified by a content hash (documents.document_id); the IDs are
+saved to data/vectors/<source>_doc_ids.npy alongside the vectors. With
+--delta, rows whose hash appears in the previous run's files reuse their
+vectors and only new or changed rows are embedded. Every run writes
+<source>_delta.json listing new and vanished IDs for bulk_index.py --delta,
+merged with any earlier delta that has not been ingested yet.
+
+Usage (from project root): python apps/data-processing/generate_vectors.py SOURCE TSV_FILE [--resume] [--delta]
   e.g. python processing/generate_vectors.py arxiv arxiv.tsv
 """
 import argparse
 import sys
-import os
 import csv
-import tempfile
+import json
+import os
+import shutil
 from pathlib import Path
 
 _BACKEND = Path(__file__).resolve().parents[1] / "backend"
@@ -20,88 +36,447 @@ sys.path.insert(0, str(_BACKEND))
 from dotenv import load_dotenv
 load_dotenv()
 
-from paths import ROOT, DATA_PATH, FORMULA_SEARCH_PATH, ENCODED_FILE_PATH, setup_formula_search_imports
-from config_loader import get_config
-from utils.format import format_for_tangent_cft_search
+from paths import DATA_PATH
+from documents import delta_path, document_id, vector_paths
+from services.models import load_models, get_embedding_model, get_tangent_backend, encode_formulas
 
 import numpy as np
-import faiss
 from tqdm import tqdm
 import regex as re
-import traceback
-from sentence_transformers import SentenceTransformer
-
-setup_formula_search_imports()
-from tangent_cft_back_end import TangentCFTBackEnd
-from Embedding_Preprocessing.encoder_tuple_level import TupleTokenizationMode
-
-def write_temp_query_tsv(mathml_string: str):
-    mathml_string = mathml_string.strip().strip('"').strip("'")
-    tmp_tsv = tempfile.NamedTemporaryFile(mode="w", suffix=".tsv", delete=False, newline="", encoding="utf-8")
-    writer = csv.DictWriter(tmp_tsv, delimiter="\t", fieldnames=["id", "topic_id", "thread_id", "type", "formula"])
-    writer.writeheader()
-    writer.writerow({"id": "user_query", "topic_id": "A.000", "thread_id": "0000000", "type": "title", "formula": mathml_string})
-    tmp_tsv.close()
-    return tmp_tsv.name
-
-fs = str(FORMULA_SEARCH_PATH)
-backend = TangentCFTBackEnd(
-    config_file=os.path.join(fs, "Configuration/config/config_1"),
-    path_data_set=os.path.join(fs, "ARQMathDataset"),
-    is_wiki=False,
-    streaming=True,
-    read_slt=True,
-    queries_directory_path=str(ROOT / "ARQMathQueries" / "test_SLT.tsv"),
-    faiss=True
-)
-backend.load_model(
-    map_file_path=os.path.join(fs, "Embedding_Preprocessing/slt_encoder.tsv"),
-    model_file_path=os.path.join(fs, "slt_model"),
-    embedding_type=TupleTokenizationMode(3),
-    ignore_full_relative_path=True,
-    tokenize_all=False,
-    tokenize_number=True
-)
-faiss_index = faiss.read_index(str(FORMULA_SEARCH_PATH / "slt_index.faiss"))
 
 parser = argparse.ArgumentParser(description="Generate vector embeddings from TSV")
 parser.add_argument("source", help="Source name (e.g. arxiv, wikipedia)")
 parser.add_argument("tsv", help="TSV filename in data/tsvs/ (e.g. arxiv.tsv)")
+parser.add_argument("--batch-size", type=int, default=64, help="Texts per model forward pass (default: 64)")
+parser.add_argument("--embedding-backend", choices=["torch", "onnx"],
+                    help="Embedding inference backend (default: [embedding] backend in config.ini)")
+parser.add_argument("--chunk-size", type=int, default=5000, help="Rows per encoding stage and shard (default: 5000)")
+parser.add_argument("--resume", action="store_true", help="Continue from the last completed shard of a previous run")
+parser.add_argument("--delta", action="store_true",
+                    help="Only embed rows that are new or changed since the previous run's vector files")
 args = parser.parse_args()
 
 SOURCE = args.source
 TSV_FILE = str(DATA_PATH / "tsvs" / args.tsv)
-BATCH_SIZE = 5000
+BATCH_SIZE = args.chunk_size
+ENCODE_BATCH_SIZE = args.batch_size
+VECTORS_DIR = DATA_PATH / "vectors"
+SHARD_DIR = VECTORS_DIR / f"{SOURCE}_shards"
+MANIFEST_PATH = SHARD_DIR / "manifest.json"
 
 if not Path(TSV_FILE).exists():
     sys.exit(f"TSV file not found: {TSV_FILE}\nExpected: data/tsvs/{args.tsv}")
 
-(DATA_PATH / "vectors").mkdir(parents=True, exist_ok=True)
-
-config = get_config()
-model = SentenceTransformer(os.path.expanduser(config.get("general", "model")))
-
-# Global array
-vector_arr = []
-vector_arr_body = []
-vector_arr_text = []
-vector_arr_formulas = []
-all_formulas_flat = []
-batch = []
+VECTORS_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def tsv_fingerprint():
+    stat = os.stat(TSV_FILE)
+    return {"path": TSV_FILE, "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def write_manifest(manifest):
+    """Atomically replaces the manifest so a crash never leaves it half-written."""
+    tmp_path = MANIFEST_PATH.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def staged(path):
+    """Where an output is written before it is swapped in."""
+    return path.with_name(path.name + ".tmp")
+
+
+def swap_in_outputs(manifest):
+    """
+    Moves the staged outputs and delta into place, then marks the manifest
+    assembled. Files already moved by an interrupted swap are skipped, so this
+    can be repeated.
+    """
+    targets = list(vector_paths(VECTORS_DIR, SOURCE).values()) + [delta_path(VECTORS_DIR, SOURCE)]
+    for path in targets:
+        if staged(path).exists():
+            os.replace(staged(path), path)
+    manifest["assembled"] = True
+    write_manifest(manifest)
+
+
+def start_or_resume():
+    """Returns the manifest to continue from, starting a fresh one unless --resume applies."""
+    if args.resume and MANIFEST_PATH.exists():
+        with open(MANIFEST_PATH, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("assembled"):
+            sys.exit(f"Output files were already assembled from {SHARD_DIR}; nothing to resume.")
+        if manifest.get("assembling"):
+            # Everything was staged; only the swap was interrupted
+            print("Finishing the swap of assembled output files interrupted in the last run.")
+            swap_in_outputs(manifest)
+            print("All vectors saved. Process complete.")
+            sys.exit(0)
+        if manifest["tsv"] != tsv_fingerprint():
+            sys.exit(f"{TSV_FILE} changed since the checkpoint in {SHARD_DIR}; rerun without --resume.")
+        print(f"Resuming after {len(manifest['shards'])} completed shards (next TSV row {manifest['next_row']}).")
+        return manifest
+    if SHARD_DIR.exists():
+        shutil.rmtree(SHARD_DIR)
+    SHARD_DIR.mkdir(parents=True)
+    manifest = {"source": SOURCE, "tsv": tsv_fingerprint(), "delta": args.delta,
+                "next_row": 0, "shards": [], "complete": False}
+    write_manifest(manifest)
+    return manifest
+
+
+manifest = start_or_resume()
+OUTPUT_PATHS = vector_paths(VECTORS_DIR, SOURCE)
+
+
+def load_previous():
+    """
+    Memory-maps the previous run's output files for --delta. Returns None if
+    there is no complete previous output to reuse vectors from.
+    """
+    if not all(path.exists() for path in OUTPUT_PATHS.values()):
+        print("No previous vector files with document IDs found; embedding every row.")
+        return None
+    previous = {key: np.load(path, mmap_mode="r") for key, path in OUTPUT_PATHS.items()}
+    # Sorted IDs plus their row numbers, as in LocalVectorStore; lookups are a binary search
+    order = np.argsort(previous["doc_ids"], kind="stable")
+    previous["sorted_ids"] = np.asarray(previous["doc_ids"][order])
+    previous["order"] = order
+    print(f"Delta mode: {len(order)} documents in the previous run.")
+    return previous
+
+
+def previous_row(doc_id):
+    """Row of doc_id in the previous run's files, or -1 if it was not there."""
+    sorted_ids = previous["sorted_ids"]
+    key = doc_id.encode()
+    pos = int(np.searchsorted(sorted_ids, key))
+    return int(previous["order"][pos]) if pos < len(sorted_ids) and sorted_ids[pos] == key else -1
+
+
+def previous_ids():
+    """Sorted IDs of the previous run, used to find vanished documents even without --delta."""
+    path = OUTPUT_PATHS["doc_ids"]
+    return np.sort(np.load(path)) if path.exists() else np.empty(0, dtype="S40")
+
+
+class RowLog:
+    """
+    Per-row bookkeeping for every usable TSV row (TSV row number, doc ID and
+    the row it reuses from the previous run, or -1), streamed to flat files in
+    SHARD_DIR so memory does not grow with the corpus. Rebuilt on every run,
+    since IDs are computed for every row anyway.
+    """
+
+    FIELDS = {"tsv_row": np.int32, "doc_id": "S40", "prev_row": np.int64}
+    FLUSH_EVERY = 65536
+
+    def __init__(self):
+        self.paths = {name: SHARD_DIR / f"rows_{name}.bin" for name in self.FIELDS}
+        self._files = {name: open(path, "wb") for name, path in self.paths.items()}
+        self._buffer = {name: [] for name in self.FIELDS}
+        self.count = 0
+
+    def append(self, tsv_row, doc_id, prev_row):
+        self._buffer["tsv_row"].append(tsv_row)
+        self._buffer["doc_id"].append(doc_id)
+        self._buffer["prev_row"].append(prev_row)
+        self.count += 1
+        if len(self._buffer["tsv_row"]) >= self.FLUSH_EVERY:
+            self._flush()
+
+    def _flush(self):
+        for name, dtype in self.FIELDS.items():
+            self._files[name].write(np.array(self._buffer[name], dtype=dtype).tobytes())
+            self._buffer[name].clear()
+
+    def close(self):
+        self._flush()
+        for f in self._files.values():
+            f.close()
+
+    def arrays(self):
+        """Read-only memmaps of the logged columns, each of length count."""
+        if not self.count:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in self.FIELDS.items()}
+        return {
+            name: np.memmap(self.paths[name], dtype=dtype, mode="r", shape=(self.count,))
+            for name, dtype in self.FIELDS.items()
+        }
 
-# batch_count = 0
-# formula_batches_dir = f"./data/{SOURCE}_latex_batches"
-# os.makedirs(formula_batches_dir, exist_ok=True)
 
-# Track start/end index for formulas of each doc
-formula_index = []   # list of (doc_id, start, end)
-current_formula_pos = 0
+# A resumed run keeps the mode it was started with
+previous = load_previous() if manifest.get("delta") else None
+if manifest["complete"]:
+    print("Checkpoint is already complete; assembling output files.")
+else:
+    load_models(embedding_backend=args.embedding_backend)
+    model = get_embedding_model()
+    if get_tangent_backend() is None:
+        sys.exit("TangentCFT backend failed to load. Check that formula-search is initialized.")
+
+
+def encode_length_sorted(texts):
+    """
+    Encode texts in batches ordered by token length so each batch pads to a
+    similar length. Returns an array aligned with the input order.
+    """
+    if not texts:
+        return np.empty((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    token_ids = model.tokenizer(
+        texts,
+        add_special_tokens=False,
+        truncation=True,
+        max_length=model.max_seq_length,
+    )["input_ids"]
+    order = np.argsort([len(ids) for ids in token_ids], kind="stable")
+    sorted_vecs = model.encode(
+        [texts[j] for j in order],
+        batch_size=ENCODE_BATCH_SIZE,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    )
+    vecs = np.empty_like(sorted_vecs)
+    vecs[order] = sorted_vecs
+    return vecs
+
+
+def flush_pending(pending, next_row):
+    """
+    Encode the pending rows in one stage and write them out as the next shard.
+    Identical strings (e.g. a body with no formulas) are encoded only once, and
+    all formulas of the stage go through a single encode_formulas call.
+
+    Args:
+        pending (list): (doc_id, body, text_only, formulas) rows, in TSV order.
+        next_row (int): First TSV row not covered by this shard.
+    """
+    unique_texts = []
+    slots = {}
+    body_slots, text_slots = [], []
+    for _, body, text_only, _ in pending:
+        for text, target in ((body, body_slots), (text_only, text_slots)):
+            if text not in slots:
+                slots[text] = len(unique_texts)
+                unique_texts.append(text)
+            target.append(slots[text])
+    vecs = encode_length_sorted(unique_texts)
+
+    stage_formulas = [formula for _, _, _, formulas in pending for formula in formulas]
+    failed = []
+    formula_vecs = encode_formulas(stage_formulas, failed=failed) if stage_formulas else None
+    if failed:
+        print(f"{len(failed)} of {len(stage_formulas)} formulas in this shard failed to encode and are left out")
+    kept_vecs, kept_formulas, formula_index = [], [], []
+    pos = 0
+    for i, _, _, formulas in pending:
+        formula_start = len(kept_vecs)
+        for formula in formulas:
+            vec = formula_vecs[pos]
+            pos += 1
+            # Failed formulas and formulas with no SLT tuples come back as all-zero rows
+            if not vec.any():
+                continue
+            kept_vecs.append(vec)
+            kept_formulas.append(formula)
+        # Offsets are shard-local; assemble_outputs() shifts them to global positions
+        formula_index.append((i, formula_start, len(kept_vecs)))
+
+    shard_name = f"shard_{len(manifest['shards']):05d}.npz"
+    tmp_path = SHARD_DIR / (shard_name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            body=vecs[body_slots],
+            text=vecs[text_slots],
+            formulas=np.stack(kept_vecs).astype(np.float32) if kept_vecs else np.zeros((0, 0), dtype=np.float32),
+            formula_index=np.array(formula_index, dtype=index_dtype),
+            formula_latex=np.array(kept_formulas, dtype=str),
+        )
+    os.replace(tmp_path, SHARD_DIR / shard_name)
+
+    manifest["shards"].append({
+        "file": shard_name,
+        "docs": len(pending),
+        "formulas": len(kept_vecs),
+        "first_row": pending[0][0],
+        "next_row": next_row,
+    })
+    manifest["next_row"] = next_row
+    write_manifest(manifest)
+    pending.clear()
+
+
+def _ranges(starts, counts):
+    """Concatenates range(start, start + count) for each pair, vectorized."""
+    counts = np.asarray(counts, dtype=np.int64)
+    offsets = np.cumsum(counts) - counts
+    return np.repeat(np.asarray(starts, dtype=np.int64) - offsets, counts) + np.arange(counts.sum())
+
+
+def assemble_outputs(rows):
+    """
+    Writes the final .npy files through preallocated memmaps: new rows come
+    from the shards (one shard in memory at a time) and, with --delta, reused
+    rows are copied from the previous run's files. Outputs are written to
+    staged .tmp files for swap_in_outputs(), since the previous files are
+    still being read.
+
+    Args:
+        rows (dict): RowLog.arrays() for every usable TSV row, in order.
+    """
+    shards = [SHARD_DIR / entry["file"] for entry in manifest["shards"]]
+    total_docs = len(rows["tsv_row"])
+    tsv_rows = rows["tsv_row"]
+    reused = rows["prev_row"] >= 0
+    new_positions = np.flatnonzero(~reused)
+    reused_positions = np.flatnonzero(reused)
+    prev_rows = np.asarray(rows["prev_row"][reused_positions], dtype=np.int64)
+    if len(new_positions) != sum(entry["docs"] for entry in manifest["shards"]):
+        sys.exit(f"Shards in {SHARD_DIR} do not match {TSV_FILE}; rerun without --resume.")
+
+    # Formula counts per output document decide where each document's formulas go
+    counts = np.zeros(total_docs, dtype=np.int64)
+    dims, latex_width = {}, 1
+    cursor = 0
+    for shard in shards:
+        with np.load(shard) as data:
+            index = data["formula_index"]
+            counts[new_positions[cursor:cursor + len(index)]] = index["end"] - index["start"]
+            cursor += len(index)
+            for key in ("body", "text", "formulas"):
+                if data[key].size:
+                    dims[key] = data[key].shape[1]
+            if data["formula_latex"].size:
+                latex_width = max(latex_width, data["formula_latex"].dtype.itemsize // 4)
+    if len(prev_rows):
+        prev_index = previous["formula_index"][prev_rows]
+        counts[reused_positions] = prev_index["end"] - prev_index["start"]
+        for key in ("body", "text", "formulas"):
+            if previous[key].size:
+                dims.setdefault(key, previous[key].shape[1])
+        latex_width = max(latex_width, previous["formula_latex"].dtype.itemsize // 4)
+    starts = np.cumsum(counts) - counts
+    total_formulas = int(counts.sum())
+
+    tmp_paths = {key: staged(path) for key, path in OUTPUT_PATHS.items()}
+
+    def open_output(key, shape, dtype):
+        return np.lib.format.open_memmap(str(tmp_paths[key]), mode="w+", dtype=dtype, shape=shape)
+
+    outputs = {
+        "text": open_output("text", (total_docs, dims.get("text", 0)), np.float32),
+        "body": open_output("body", (total_docs, dims.get("body", 0)), np.float32),
+        "formulas": open_output("formulas", (total_formulas, dims.get("formulas", 0)), np.float32),
+        "formula_index": open_output("formula_index", (total_docs,), index_dtype),
+        "formula_latex": open_output("formula_latex", (total_formulas,), f"<U{latex_width}"),
+        "doc_ids": open_output("doc_ids", (total_docs,), "S40"),
+    }
+    outputs["formula_index"]["doc_id"] = tsv_rows
+    outputs["formula_index"]["start"] = starts
+    outputs["formula_index"]["end"] = starts + counts
+    for begin in range(0, total_docs, 1_000_000):
+        outputs["doc_ids"][begin:begin + 1_000_000] = rows["doc_id"][begin:begin + 1_000_000]
+
+    cursor = 0
+    for shard in tqdm(shards, desc="Assembling shards"):
+        with np.load(shard) as data:
+            positions = new_positions[cursor:cursor + data["body"].shape[0]]
+            cursor += len(positions)
+            outputs["body"][positions] = data["body"]
+            outputs["text"][positions] = data["text"]
+            if data["formulas"].shape[0]:
+                index = data["formula_index"]
+                src = _ranges(index["start"], counts[positions])
+                dst = _ranges(starts[positions], counts[positions])
+                outputs["formulas"][dst] = data["formulas"][src]
+                outputs["formula_latex"][dst] = data["formula_latex"][src]
+
+    step = 50000
+    for begin in tqdm(range(0, len(reused_positions), step), desc="Copying unchanged rows"):
+        positions = reused_positions[begin:begin + step]
+        source_rows = prev_rows[begin:begin + step]
+        outputs["body"][positions] = previous["body"][source_rows]
+        outputs["text"][positions] = previous["text"][source_rows]
+        prev_index = previous["formula_index"][source_rows]
+        src = _ranges(prev_index["start"], counts[positions])
+        if len(src):
+            dst = _ranges(starts[positions], counts[positions])
+            outputs["formulas"][dst] = previous["formulas"][src]
+            outputs["formula_latex"][dst] = previous["formula_latex"][src]
+
+    for array in outputs.values():
+        array.flush()
+    del outputs
+    print(f"Text and body vectors saved ({total_docs} documents, {len(reused_positions)} reused)")
+    print(f"Formula vectors saved ({total_formulas} formulas)")
+    print("Formula index, formula strings and document IDs saved")
+
+
+def _decoded(ids):
+    return [doc_id.decode() for doc_id in ids]
+
+
+def write_delta(rows, old_ids):
+    """
+    Writes <source>_delta.json: IDs to upsert and IDs that vanished since the
+    previous run. A delta bulk_index.py has not applied yet is merged in, so
+    running generate twice before an ingest loses no upserts or deletes.
+
+    Args:
+        rows (dict): RowLog.arrays().
+        old_ids (np.ndarray): Sorted IDs of the previous run.
+    """
+    current_ids = np.sort(np.asarray(rows["doc_id"]))
+    full = previous is None
+    upsert = np.unique(rows["doc_id"][rows["prev_row"] < 0]) if not full else np.empty(0, dtype="S40")
+    delete = np.unique(old_ids[~np.isin(old_ids, current_ids)])
+
+    path = delta_path(VECTORS_DIR, SOURCE)
+    pending = None
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            pending = json.load(f)
+        if pending.get("applied"):
+            pending = None
+    if pending is not None:
+        # Earlier upserts still in the corpus stay; earlier deletes that came back are dropped
+        full = full or pending["full"]
+        earlier_upserts = np.array([doc_id.encode() for doc_id in pending["upsert"]], dtype="S40")
+        earlier_deletes = np.array([doc_id.encode() for doc_id in pending["delete"]], dtype="S40")
+        upsert = np.union1d(upsert, earlier_upserts[np.isin(earlier_upserts, current_ids)])
+        delete = np.union1d(delete, earlier_deletes[~np.isin(earlier_deletes, current_ids)])
+        print("Merged with the pending delta from an earlier run that was not ingested yet.")
+
+    delta = {
+        "source": SOURCE,
+        "full": full,
+        "applied": False,
+        "upsert": [] if full else _decoded(upsert),
+        "delete": _decoded(delete),
+    }
+    # Staged with the other outputs; swap_in_outputs() moves it into place
+    with open(staged(path), "w", encoding="utf-8") as f:
+        json.dump(delta, f)
+    upserts = len(current_ids) if full else len(delta["upsert"])
+    print(f"Delta saved: {upserts} documents to upsert, {len(delta['delete'])} to delete.")
+
+
+# Structured formula index: (doc_id, start, end) per document
+index_dtype = np.dtype([
+    ("doc_id", np.int32),
+    ("start", np.int64),
+    ("end", np.int64)
+])
 
-# Get total
-with open(TSV_FILE, 'r', encoding='utf-8') as f_in:
-    lines = f_in.readlines()
+# (tsv_row, doc_id, previous row) for every usable row, in TSV order
+row_log = RowLog()
+# (doc_id, body, text_only, formulas) rows waiting for the next batched encoding stage
+pending_rows = []
 
-# Open TSV and output JSONL file
 with open(TSV_FILE, 'r', encoding='utf-8') as f_in:
     reader = csv.reader(f_in, delimiter='\t')
 
@@ -111,112 +486,50 @@ with open(TSV_FILE, 'r', encoding='utf-8') as f_in:
         r'(\\\((?:[^)]|\\\))+\\\))|'   # \(...\)
         r'(\\\[(?:[^\]]|\\\])+\\\])'   # \[...\]
     )
-    for i, row in tqdm( enumerate(reader), total=len(lines) ):
+    resume_row = manifest["next_row"]
+    for i, row in tqdm(enumerate(reader), unit=" rows"):
         if len(row) < 3:
             print(f"Skipping line {i} due to missing fields")
             continue
 
-        vector_arr.append( model.encode( row[1] ) )
-
+        # IDs are needed for every row, including checkpointed and reused ones
+        doc_id = document_id(SOURCE, row)
+        prev_row = previous_row(doc_id) if previous is not None else -1
+        reused = prev_row >= 0
+        row_log.append(i, doc_id, prev_row)
+        # Rows before the checkpoint are already in completed shards
+        if manifest["complete"] or i < resume_row or reused:
+            continue
 
         title, body, source_url = row[0].strip(), row[1].strip(), row[2].strip()
 
         matches = latex_pattern.findall(body)
         formulas = []
-        formula_start = current_formula_pos
         for group in matches:
             formula = next((g for g in group if g), None)
             if formula:
                 formulas.append(formula.strip())
-        
-        text_only = latex_pattern.sub('', body).strip()
 
-        entry = {
-            "title": title,
-            "url": source_url,
-            "body": body,
-            "body_text": text_only,
-            "formulas": formulas
-        }
-        vector_arr_body.append(model.encode(body))
-        vector_arr_text.append(model.encode(text_only))
-        for formula in formulas:
-            try:
-                formula_ml = format_for_tangent_cft_search(formula)
-
-                formula_file = write_temp_query_tsv(formula_ml)
-
-                backend.data_reader.queries_dir_path = formula_file
-
-                vec = backend.retrieval(
-                    encoded_file_path=ENCODED_FILE_PATH,
-                    embedding_type=TupleTokenizationMode(3),
-                    ignore_full_relative_path=True,
-                    tokenize_all=False,
-                    tokenize_number=True,
-                    streaming=True,
-                    faiss=True,
-                    faiss_index=faiss_index,
-                    single_query=True,
-                    do_retrieval=False
-                )
-                if not isinstance(vec, np.ndarray) or vec.size == 0:
-                    continue
-                vector_arr_formulas.append(vec)
-                all_formulas_flat.append(formula)
-                current_formula_pos += 1
-                    # if len(batch) >= BATCH_SIZE:
-                    #     np.save(f"{formula_batches_dir}/batch_{batch_count}.npy", np.array(batch, dtype=object))
-                    #     batch = []
-                    #     batch_count += 1
-                
-                # DELETE temp file to avoid /tmp filling up
-                # try:
-                #     os.remove(formula_file)
-                # except Exception as e:
-                #     print(f"Warning: failed to delete temp file {formula_file}: {e}")
-
-            except Exception:
-                continue
-        formula_end = current_formula_pos
-        formula_index.append((i, formula_start, formula_end))
-
-    # if batch:  # batch not empty
-    #     np.save(
-    #         f"{formula_batches_dir}/batch_{batch_count}.npy",
-    #         np.array(batch, dtype=object)
-    #     )
-    #     print(f"Saved final incomplete batch_{batch_count} with {len(batch)} items.")
-
-
-
-np.save(str(DATA_PATH / f"vectors/{SOURCE}_text_vectors"), vector_arr_text)
-print("Text vectors saved")
-np.save(str(DATA_PATH / f"vectors/{SOURCE}_content_vectors"), vector_arr_body)
-print("Body vectors saved")
-np.save(str(DATA_PATH / f"vectors/{SOURCE}_formulas_vectors"), vector_arr_formulas)
-print("Formula vectors saved")
-
-# Save structured formula index
-index_dtype = np.dtype([
-    ("doc_id", np.int32),
-    ("start", np.int64),
-    ("end", np.int64)
-])
-index_array = np.array(formula_index, dtype=index_dtype)
-np.save(str(DATA_PATH / f"vectors/{SOURCE}_formula_index.npy"), index_array)
-print("Formula index saved", index_array.shape)
-
-np.save(str(DATA_PATH / f"vectors/{SOURCE}_all_formulas_flat.npy"), all_formulas_flat)
-print("All formula strings saved")
-
-
-# batches = sorted(os.listdir(formula_batches_dir))
-# arrays = [np.load(os.path.join(formula_batches_dir, f), allow_pickle=True) for f in batches]
-# full = np.concatenate(arrays, axis=0)
-
-# final = np.array(full, dtype=object)
-# np.save(os.path.join(DATA_DIR, f"vectors/{SOURCE}_all_formulas_flat.npy"), final)
+        text_only = latex_pattern.sub('', body).strip()
 
+        pending_rows.append((i, body, text_only, formulas))
+        if len(pending_rows) >= BATCH_SIZE:
+            flush_pending(pending_rows, next_row=i + 1)
+
+    if pending_rows:
+        flush_pending(pending_rows, next_row=pending_rows[-1][0] + 1)
+
+if not manifest["complete"]:
+    manifest["complete"] = True
+    write_manifest(manifest)
+
+row_log.close()
+rows = row_log.arrays()
+old_ids = previous_ids()
+assemble_outputs(rows)
+write_delta(rows, old_ids)
+manifest["assembling"] = True
+write_manifest(manifest)
+swap_in_outputs(manifest)
 
 print("All vectors saved. Process complete.")
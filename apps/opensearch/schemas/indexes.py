@@ -1,12 +1,15 @@
 # Re-export from backend (canonical source)
-# Admin scripts add backend to path; use: from schemas.indexes import source_to_index
-import sys
+# Admin scripts use: from schemas.indexes import source_to_index
+# This package shadows backend/schemas on sys.path, so load the backend file directly.
+import importlib.util
 from pathlib import Path
 
-_backend = Path(__file__).resolve().parents[2] / "backend"
-if str(_backend) not in sys.path:
-    sys.path.insert(0, str(_backend))
+_backend_indexes = Path(__file__).resolve().parents[2] / "backend" / "schemas" / "indexes.py"
+_spec = importlib.util.spec_from_file_location("_backend_schemas_indexes", _backend_indexes)
+_module = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_module)
 
-from schemas.indexes import source_to_index  # noqa: F401, E402
+source_to_index = _module.source_to_index
+CONSOLIDATED_INDEX = _module.CONSOLIDATED_INDEX
 
-__all__ = ["source_to_index"]
+__all__ = ["source_to_index", "CONSOLIDATED_INDEX"]
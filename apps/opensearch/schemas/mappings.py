@@ -1,67 +1,288 @@
 """
 OpenSearch index mapping for MathMex indices (KNN vectors, text fields).
 Import in scripts when creating a new index.
+
+`mapping` is the default profile. Other named profiles in PROFILES change the
+kNN engine, vector quantization and per-field HNSW parameters; build one with
+build_mapping(name) and compare their footprint with estimate_native_memory.
+
+Schema version 2 (SCHEMA_VERSION) uses keyword fields for filters, no
+fielddata on body_text, and keeps vectors out of _source. Existing indices
+are moved to it with scripts/migrate_index.py.
 """
-# Mapping definition for MathMex indices
-mapping = {
-    "settings": {
-        "index": {
-            "knn": True  # Enable KNN search for semantic queries
-        }
+# Bumped when the field layout changes; stored in the mapping's _meta
+SCHEMA_VERSION = 2
+
+# kNN vector fields and their dimensions
+VECTOR_FIELDS = {
+    "body_vector": 768,
+    "text_vector": 768,
+    "formulas.formula_vector": 300,
+}
+
+# Bytes per vector component for each encoder (None = full float32)
+_ENCODER_BYTES = {None: 4, "fp16": 2, "int8": 1}
+
+# OpenSearch defaults, used for estimates when a profile leaves a parameter unset
+_DEFAULT_M = 16
+
+# Named mapping profiles. Per-field entries set HNSW m / ef_construction / ef_search;
+# parameters left out fall back to the engine defaults.
+PROFILES = {
+    "default": {
+        "description": "nmslib HNSW, float32; the original MathMex vector settings",
+        "engine": "nmslib",
+        "encoder": None,
+        "fields": {
+            "body_vector": {"m": 16, "ef_construction": 128},
+            "text_vector": {},
+            "formulas.formula_vector": {},
+        },
     },
-    "mappings": {
-        "properties": {
-            # Document ID = Order docs occur in TSV; e.g., Doc_0, Doc_1, Doc_2, ...
-            "doc_ID": {"type": "text"},
-            # Title of the document (searchable text)
-            "title": {"type": "text"},
-            # Type of media (e.g., article, video, pdf)
-            "media_type": {"type": "text"},
-            # Main content body (searchable text, with fielddata enabled for aggregations)
-            "body_text": {"type": "text", "fielddata": True},
-            # Vector embedding for whole-bodysemantic search (KNN)
-            "body_vector": {
-                "type": "knn_vector",
-                "dimension": 768,  # Embedding vector size
-                "method": {
-                    "name": "hnsw",  # HNSW algorithm for KNN
-                    "space_type": "cosinesimil",  # Cosine similarity
-                    "engine": "nmslib",
-                    "parameters": {
-                        "ef_construction": 128,
-                        "m": 16
-                    }
-                }
-            },
-
-            # Split text & formula vectors from body_text
-            "text_vector": {
-                "type": "knn_vector",
-                "dimension": 768,
-                "method": {
-                    "name": "hnsw",
-                    "space_type": "cosinesimil",
-                    "engine": "nmslib",
-                }
-            },
-
-            "formulas": {
-                "type": "nested",
-                "properties": {
-                    "latex": { "type": "text" },
-                    "formula_vector": {
-                    "type": "knn_vector",
-                    "dimension": 300,
-                    "method": {
-                        "name": "hnsw",
-                        "space_type": "cosinesimil",
-                        "engine": "nmslib"
-                    }
+    "faiss": {
+        "description": "faiss HNSW, float32, explicit parameters on every field",
+        "engine": "faiss",
+        "encoder": None,
+        "fields": {
+            "body_vector": {"m": 16, "ef_construction": 128, "ef_search": 100},
+            "text_vector": {"m": 16, "ef_construction": 128, "ef_search": 100},
+            "formulas.formula_vector": {"m": 16, "ef_construction": 128, "ef_search": 100},
+        },
+    },
+    "faiss-fp16": {
+        "description": "faiss HNSW with fp16 scalar quantization; about half the vector memory",
+        "engine": "faiss",
+        "encoder": "fp16",
+        "fields": {
+            "body_vector": {"m": 16, "ef_construction": 128, "ef_search": 100},
+            "text_vector": {"m": 16, "ef_construction": 128, "ef_search": 100},
+            "formulas.formula_vector": {"m": 16, "ef_construction": 128, "ef_search": 100},
+        },
+    },
+    "faiss-fp16-compact": {
+        "description": "faiss fp16 with smaller graphs (m=8) on the secondary fields; lowest faiss memory",
+        "engine": "faiss",
+        "encoder": "fp16",
+        "fields": {
+            "body_vector": {"m": 16, "ef_construction": 128, "ef_search": 100},
+            "text_vector": {"m": 8, "ef_construction": 64, "ef_search": 64},
+            "formulas.formula_vector": {"m": 8, "ef_construction": 64, "ef_search": 64},
+        },
+    },
+    "lucene": {
+        "description": "Lucene HNSW, float32; graphs live in Lucene segments, not native memory",
+        "engine": "lucene",
+        "encoder": None,
+        "fields": {
+            "body_vector": {"m": 16, "ef_construction": 128},
+            "text_vector": {"m": 16, "ef_construction": 128},
+            "formulas.formula_vector": {"m": 16, "ef_construction": 128},
+        },
+    },
+    "lucene-int8": {
+        "description": "Lucene HNSW with int8 scalar quantization (byte vectors); quarter of the vector memory",
+        "engine": "lucene",
+        "encoder": "int8",
+        "fields": {
+            "body_vector": {"m": 16, "ef_construction": 128},
+            "text_vector": {"m": 16, "ef_construction": 128},
+            "formulas.formula_vector": {"m": 16, "ef_construction": 128},
+        },
+    },
+}
+
+# The consolidated index filters by source and media type inside the knn query,
+# which only these engines support
+FILTERING_ENGINES = ("faiss", "lucene")
+CONSOLIDATED_FALLBACK_PROFILE = "faiss"
+
+
+def resolve_profile(profile_name, consolidated=False, explicit=False):
+    """
+    The profile to create an index with. For the consolidated index, a default
+    nmslib profile is replaced by CONSOLIDATED_FALLBACK_PROFILE.
+
+    Args:
+        explicit (bool): profile_name was asked for on the command line.
+    Raises:
+        ValueError: If an explicitly chosen profile cannot serve the consolidated index.
+    """
+    if not consolidated or PROFILES[profile_name]["engine"] in FILTERING_ENGINES:
+        return profile_name
+    if explicit:
+        raise ValueError(
+            f"Profile '{profile_name}' uses {PROFILES[profile_name]['engine']}, which does not support "
+            f"filtered kNN; the consolidated index needs one of: "
+            + ", ".join(sorted(name for name, p in PROFILES.items() if p["engine"] in FILTERING_ENGINES))
+        )
+    print(f"Profile '{profile_name}' uses {PROFILES[profile_name]['engine']}, which does not support filtered kNN; "
+          f"using '{CONSOLIDATED_FALLBACK_PROFILE}' for the consolidated index.")
+    return CONSOLIDATED_FALLBACK_PROFILE
+
+
+def _encoder(engine, encoder):
+    if encoder == "fp16":
+        return {"name": "sq", "parameters": {"type": "fp16"}}
+    if encoder == "int8":
+        # Lucene's scalar quantizer turns float input into byte vectors at index time
+        return {"name": "sq"}
+    return None
+
+
+def knn_vector_field(dimension, engine, encoder=None, m=None, ef_construction=None, ef_search=None):
+    """
+    Builds a knn_vector field definition.
+
+    Args:
+        dimension (int): Vector size.
+        engine (str): "nmslib", "faiss" or "lucene".
+        encoder (str, optional): None (float32), "fp16" (faiss) or "int8" (lucene).
+        m, ef_construction, ef_search (int, optional): HNSW parameters; omitted when None.
+            ef_search is only set in the mapping for faiss; nmslib reads it from the
+            index setting and Lucene derives it from k.
+    Returns:
+        dict: The field mapping.
+    """
+    parameters = {}
+    if ef_construction is not None:
+        parameters["ef_construction"] = ef_construction
+    if m is not None:
+        parameters["m"] = m
+    if ef_search is not None and engine == "faiss":
+        parameters["ef_search"] = ef_search
+    encoder_spec = _encoder(engine, encoder)
+    if encoder_spec:
+        parameters["encoder"] = encoder_spec
+
+    method = {
+        "name": "hnsw",
+        "space_type": "cosinesimil",
+        "engine": engine,
+    }
+    if parameters:
+        method["parameters"] = parameters
+    return {"type": "knn_vector", "dimension": dimension, "method": method}
+
+
+def build_mapping(profile_name="default", consolidated=False, shards=None):
+    """
+    Builds the full index body (settings + mappings) for a named profile.
+
+    Args:
+        profile_name (str): Name in PROFILES.
+        consolidated (bool): Mapping for the single all-sources index, which
+            requires a routing value (the source name) on every document.
+        shards (int, optional): number_of_shards; cluster default if None.
+    Raises:
+        KeyError: If the profile does not exist.
+        ValueError: If a consolidated mapping is asked for with an engine without filtered kNN.
+    """
+    profile = PROFILES[profile_name]
+    engine, encoder = profile["engine"], profile["encoder"]
+    if consolidated and engine not in FILTERING_ENGINES:
+        raise ValueError(f"The consolidated index needs filtered kNN, which {engine} does not support")
+    vectors = {
+        field: knn_vector_field(VECTOR_FIELDS[field], engine, encoder, **params)
+        for field, params in profile["fields"].items()
+    }
+
+    index_settings = {
+        "knn": True  # Enable KNN search for semantic queries
+    }
+    ef_search = profile["fields"]["body_vector"].get("ef_search")
+    if engine == "nmslib" and ef_search is not None:
+        index_settings["knn.algo_param.ef_search"] = ef_search
+    if shards:
+        index_settings["number_of_shards"] = shards
+
+    body = {
+        "settings": {
+            "index": index_settings
+        },
+        "mappings": {
+            "_meta": {"schema_version": SCHEMA_VERSION, "profile": profile_name},
+            # Vectors are indexed for kNN but not stored in _source, which keeps
+            # fetches small; rebuild from data/vectors/ rather than reindexing.
+            "_source": {"excludes": list(VECTOR_FIELDS)},
+            "properties": {
+                # Document ID = content hash of the TSV row (see data-processing/documents.py)
+                "doc_ID": {"type": "keyword"},
+                # Title of the document (searchable text)
+                "title": {"type": "text"},
+                # Type of media (e.g., article, video, pdf); keyword so terms filters are exact and cached
+                "media_type": {"type": "keyword"},
+                # Main content body (searchable text; no fielddata, nothing aggregates on it)
+                "body_text": {"type": "text"},
+                # Vector embedding for whole-body semantic search (KNN)
+                "body_vector": vectors["body_vector"],
+                # Split text & formula vectors from body_text
+                "text_vector": vectors["text_vector"],
+                "formulas": {
+                    "type": "nested",
+                    "properties": {
+                        "latex": {"type": "text"},
+                        "formula_vector": vectors["formulas.formula_vector"],
                     }
-                }
-            },
-            # Source link (unique identifier for the document)
-            "link": {"type": "keyword"}
+                },
+                # Source link (unique identifier for the document)
+                "link": {"type": "keyword"},
+                # Source name (e.g. wikipedia); the filter and routing key in the consolidated index
+                "source": {"type": "keyword"}
+            }
         }
     }
-}
+    if consolidated:
+        body["mappings"]["_meta"]["consolidated"] = True
+        body["mappings"]["_routing"] = {"required": True}
+    return body
+
+
+def estimate_native_memory(profile_name, num_docs, num_formulas):
+    """
+    Estimates HNSW graph memory per vector field with the OpenSearch sizing
+    rule 1.1 * (bytes_per_dimension * dimension + 8 * m) bytes per vector.
+
+    For nmslib and faiss this is off-heap native memory; for Lucene it is the
+    page cache the graphs need to stay fast.
+
+    Args:
+        profile_name (str): Name in PROFILES.
+        num_docs (int): Documents (one body and one text vector each).
+        num_formulas (int): Formula vectors across all documents.
+    Returns:
+        dict: Bytes per field, plus "total".
+    """
+    profile = PROFILES[profile_name]
+    bytes_per_dim = _ENCODER_BYTES[profile["encoder"]]
+    counts = {"body_vector": num_docs, "text_vector": num_docs, "formulas.formula_vector": num_formulas}
+    estimate = {}
+    for field, params in profile["fields"].items():
+        m = params.get("m", _DEFAULT_M)
+        per_vector = 1.1 * (bytes_per_dim * VECTOR_FIELDS[field] + 8 * m)
+        estimate[field] = int(per_vector * counts[field])
+    estimate["total"] = sum(estimate.values())
+    return estimate
+
+
+def vectors_in_source(index_mapping):
+    """
+    True if an index mapping (as returned by indices.get_mapping) keeps the
+    vectors in _source, i.e. the index can be reindexed without losing them.
+    """
+    excludes = index_mapping.get("_source", {}).get("excludes", [])
+    return not any(field in excludes for field in VECTOR_FIELDS)
+
+
+def describe_profiles(num_docs, num_formulas):
+    """Returns printable lines with each profile's description and estimated memory."""
+    lines = [f"Estimated kNN memory for {num_docs:,} documents and {num_formulas:,} formulas:"]
+    for name, profile in PROFILES.items():
+        estimate = estimate_native_memory(name, num_docs, num_formulas)
+        fields = ", ".join(f"{field} {size / 2**30:.2f}" for field, size in estimate.items() if field != "total")
+        lines.append(f"  {name:<20} {estimate['total'] / 2**30:7.2f} GiB  ({fields})")
+        lines.append(f"  {'':<20} {profile['description']}")
+    return lines
+
+
+# Mapping definition for MathMex indices
+mapping = build_mapping("default")
@@ -0,0 +1,137 @@
+"""
+benchmark_layout.py
+
+Compare kNN latency of the per-source indices (fan-out) against the
+consolidated index with filtered kNN and routing. Both layouts must hold the
+same data (bulk_index.py SOURCE and bulk_index.py SOURCE --consolidated).
+
+Query vectors are sampled from data/vectors/<source>_content_vectors.npy, so
+no model is loaded. For each source selection the script reports client and
+server ("took") latency and how many of the top hits both layouts agree on.
+
+Run from project root: python apps/opensearch/scripts/benchmark_layout.py [--queries 50] [--media-type article]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+_OPENSEARCH = Path(__file__).resolve().parents[1]
+_BACKEND = _OPENSEARCH.parent / "backend"
+sys.path.insert(0, str(_OPENSEARCH))
+sys.path.insert(0, str(_BACKEND))
+
+import warnings
+import numpy as np
+from opensearchpy import OpenSearch, RequestsHttpConnection
+
+from paths import DATA_PATH
+from config_loader import get_config
+from schemas.indexes import source_to_index
+from services.index_layout import search_targets, knn_query
+
+config = get_config()
+OPENSEARCH_HOST = config.get('opensearch', 'host')
+USER = config.get('opensearch', 'username')
+PASSWORD = config.get('opensearch', 'password')
+
+parser = argparse.ArgumentParser(description="Benchmark fan-out vs consolidated filtered kNN")
+parser.add_argument("--queries", type=int, default=50, help="Query vectors per source selection (default: 50)")
+parser.add_argument("--k", type=int, default=1000, help="kNN k (default: 1000, as in perform_search)")
+parser.add_argument("--size", type=int, default=100, help="Hits returned (default: 100, as in perform_search)")
+parser.add_argument("--media-type", action="append", default=[], help="Add a media_type filter (repeatable)")
+parser.add_argument("--warmup", type=int, default=5, help="Untimed queries per layout before measuring (default: 5)")
+parser.add_argument("--seed", type=int, default=0)
+args = parser.parse_args()
+
+# Suppress the security warning from using a self-signed cert
+warnings.filterwarnings('ignore', message='Unverified HTTPS request')
+
+
+def get_opensearch_client():
+    """Initializes and returns the OpenSearch client."""
+    return OpenSearch(
+        hosts=[{'host': OPENSEARCH_HOST}],
+        http_auth=(USER, PASSWORD),
+        use_ssl=True,
+        verify_certs=False,
+        ssl_show_warn=False,
+        connection_class=RequestsHttpConnection,
+        timeout=60,
+    )
+
+
+def sample_query_vectors(n, rng):
+    """Samples n body vectors across the sources that have vector files."""
+    arrays = []
+    for source in source_to_index:
+        path = DATA_PATH / "vectors" / f"{source}_content_vectors.npy"
+        if path.exists():
+            arrays.append(np.load(path, mmap_mode="r"))
+    if not arrays:
+        sys.exit("No data/vectors/<source>_content_vectors.npy files found to sample queries from.")
+    picks = [arrays[rng.integers(len(arrays))] for _ in range(n)]
+    return [np.asarray(array[rng.integers(array.shape[0])], dtype=np.float32).tolist() for array in picks]
+
+
+def build_request(vector, sources, consolidated):
+    """Same request shape as perform_search's text search, for either layout."""
+    params, source_filter = search_targets(sources, consolidated=consolidated)
+    filters = [{"terms": {"media_type": args.media_type}}] if args.media_type else []
+    body = {"size": args.size, "_source": {"includes": ["doc_ID"]}}
+    if source_filter:
+        # Filters inside the ANN search
+        body["query"] = {"bool": {"must": [knn_query("body_vector", vector, args.k, [source_filter] + filters)]}}
+    else:
+        # Filters applied to each index's kNN results
+        body["query"] = {"bool": {"must": [knn_query("body_vector", vector, args.k)]}}
+        if filters:
+            body["query"]["bool"]["filter"] = filters
+    return params, body
+
+
+def run(client, vectors, sources, consolidated):
+    """Returns (client latencies ms, server took ms, top-hit ID lists) for one layout."""
+    for vector in vectors[:args.warmup]:
+        params, body = build_request(vector, sources, consolidated)
+        client.search(body=body, **params)
+    latencies, took, hits = [], [], []
+    for vector in vectors:
+        params, body = build_request(vector, sources, consolidated)
+        start = time.perf_counter()
+        response = client.search(body=body, **params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        took.append(response["took"])
+        hits.append([hit["_source"].get("doc_ID") or hit["_id"] for hit in response["hits"]["hits"]])
+    return np.array(latencies), np.array(took), hits
+
+
+def summarize(values):
+    return f"p50 {np.percentile(values, 50):7.1f}  p95 {np.percentile(values, 95):7.1f}  mean {values.mean():7.1f}"
+
+
+def main():
+    client = get_opensearch_client()
+    rng = np.random.default_rng(args.seed)
+    vectors = sample_query_vectors(args.queries, rng)
+
+    selections = [("all sources", [])] + [(source, [source]) for source in source_to_index]
+    sources = list(source_to_index)
+    if len(sources) > 2:
+        selections.append((" + ".join(sources[:2]), sources[:2]))
+
+    print(f"{args.queries} queries per selection, k={args.k}, size={args.size}, media types: {args.media_type or 'any'}")
+    for label, selected in selections:
+        fan_lat, fan_took, fan_hits = run(client, vectors, selected, consolidated=False)
+        con_lat, con_took, con_hits = run(client, vectors, selected, consolidated=True)
+        overlap = np.mean([
+            len(set(a) & set(b)) / max(len(a), 1) for a, b in zip(fan_hits, con_hits)
+        ])
+        print(f"\n[{label}]")
+        print(f"  fan-out       client ms: {summarize(fan_lat)} | took ms: {summarize(fan_took)}")
+        print(f"  consolidated  client ms: {summarize(con_lat)} | took ms: {summarize(con_took)}")
+        print(f"  top-{args.size} overlap: {overlap:.1%}")
+
+
+if __name__ == "__main__":
+    main()
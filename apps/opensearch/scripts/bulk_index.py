@@ -4,6 +4,12 @@ bulk_index.py
 Bulk upload documents from JSONL to OpenSearch.
 Run from project root: python apps/opensearch/scripts/bulk_index.py SOURCE
   e.g. python apps/opensearch/scripts/bulk_index.py wikipedia
+  or, skipping the JSONL file: bulk_index.py wikipedia --from-vectors final_wikipedia.tsv
+  or, applying only the last generate_vectors.py delta: bulk_index.py wikipedia --from-vectors final_wikipedia.tsv --delta
+  or, into the all-sources index: bulk_index.py wikipedia --from-vectors final_wikipedia.tsv --consolidated
+
+Documents are indexed under their content-hash doc_ID as _id, so re-running
+an upload overwrites documents instead of duplicating them.
 """
 import argparse
 import sys
@@ -11,30 +17,59 @@ from pathlib import Path
 
 _OPENSEARCH = Path(__file__).resolve().parents[1]
 _BACKEND = _OPENSEARCH.parent / "backend"
+_DATA_PROCESSING = _OPENSEARCH.parent / "data-processing"
 sys.path.insert(0, str(_OPENSEARCH))
 sys.path.insert(0, str(_BACKEND))
+sys.path.insert(0, str(_DATA_PROCESSING))
 
+import itertools
 import json
+import os
+import re
+import threading
+import time
 import warnings
+from contextlib import contextmanager
 from opensearchpy import OpenSearch, RequestsHttpConnection
-from opensearchpy.helpers import bulk
+from opensearchpy.helpers import bulk, streaming_bulk
 
 from paths import DATA_PATH
 from config_loader import get_config
-from schemas.mappings import mapping
+from schemas.indexes import CONSOLIDATED_INDEX
+from schemas.mappings import PROFILES, build_mapping, estimate_native_memory, resolve_profile
+from services.query_cache import mark_index_updated
 
 parser = argparse.ArgumentParser(description="Bulk upload JSONL to OpenSearch")
 parser.add_argument("source", help="Source name (e.g. wikipedia, mathematica)")
+parser.add_argument("--from-vectors", metavar="TSV_FILE",
+                    help="Index straight from data/tsvs/TSV_FILE and data/vectors/ instead of the JSONL file")
+parser.add_argument("--consolidated", action="store_true",
+                    help=f"With --from-vectors: index into {CONSOLIDATED_INDEX} (all sources, routed by source name)")
+parser.add_argument("--profile", choices=sorted(PROFILES),
+                    help="Mapping profile if the index has to be created "
+                         "(default: [opensearch] mapping_profile in config.ini, else 'default')")
+parser.add_argument("--fast", action="store_true",
+                    help="High-throughput mode: parallel workers, byte-sized chunks, no refresh/replicas during load")
+parser.add_argument("--delta", action="store_true",
+                    help="With --from-vectors: upsert only new/changed documents and delete vanished ones, "
+                         "as listed in data/vectors/SOURCE_delta.json")
+parser.add_argument("--workers", type=int, default=4, help="Parallel bulk workers in --fast mode (default: 4)")
+parser.add_argument("--chunk-mb", type=float, default=10, help="Max bulk request size in MB in --fast mode (default: 10)")
+parser.add_argument("--max-retries", type=int, default=8, help="Retries per chunk on 429 rejections in --fast mode (default: 8)")
 args = parser.parse_args()
 
 SOURCE_NAME = args.source
-INDEX_NAME = f"mathmex_{SOURCE_NAME}"
+INDEX_NAME = CONSOLIDATED_INDEX if args.consolidated else f"mathmex_{SOURCE_NAME}"
+# The consolidated index requires every document to be routed by its source
+ROUTING = SOURCE_NAME if args.consolidated else None
 JSONL_FILE_PATH = str(DATA_PATH / f"jsonl/mathmex_{SOURCE_NAME}.jsonl")
+DEAD_LETTER_PATH = str(DATA_PATH / f"jsonl/mathmex_{SOURCE_NAME}.failed.jsonl")
 
 config = get_config()
 OPENSEARCH_HOST = config.get('opensearch', 'host')
 USER = config.get('opensearch_admin', 'username')
 PASSWORD = config.get('opensearch_admin', 'password')
+MAPPING_PROFILE = args.profile or config.get('opensearch', 'mapping_profile', fallback='default')
 
 # Suppress the security warning from using a self-signed cert
 warnings.filterwarnings('ignore', message='Unverified HTTPS request')
@@ -70,38 +105,286 @@ def generate_bulk_actions(file_path, index_name):
             # Yield each document as a bulk action
             yield {
                 "_index": index_name,
+                "_id": document.get("doc_ID"),
                 "_source": document,
             }
 
 
+class ProgressCounter:
+    """Thread-safe docs/bytes counter that prints docs/s and MB/s every few seconds."""
+
+    def __init__(self, interval=5.0):
+        self.docs = 0
+        self.bytes = 0
+        self.failed = 0
+        self.interval = interval
+        self._start = time.monotonic()
+        self._last_report = self._start
+        self._lock = threading.Lock()
+
+    def add(self, docs, nbytes):
+        with self._lock:
+            self.docs += docs
+            self.bytes += nbytes
+            now = time.monotonic()
+            if now - self._last_report >= self.interval:
+                self._last_report = now
+                self.report()
+
+    def report(self):
+        elapsed = max(time.monotonic() - self._start, 1e-9)
+        print(f"  {self.docs} docs sent, {self.failed} failed | "
+              f"{self.docs / elapsed:.0f} docs/s, {self.bytes / elapsed / 1e6:.1f} MB/s")
+
+
+# doc_ID is the first key of every serialized document, so this finds it without parsing the vectors
+_DOC_ID = re.compile(r'"doc_ID"\s*:\s*"([^"]*)"')
+
+
+def read_jsonl_lines(file_path):
+    """Yields (doc_ID, raw line) for the document lines of a JSONL file, without parsing them."""
+    with open(file_path, mode='r', encoding='utf-8') as jsonlfile:
+        for line in jsonlfile:
+            line = line.strip()
+            if line:
+                match = _DOC_ID.search(line)
+                yield (match.group(1) if match else None), line
+
+
+def serialize_vector_documents(source, tsv_file, only_ids=None):
+    """Yields (doc_ID, serialized document) built directly from a TSV and memory-mapped vector files."""
+    from documents import iter_documents, serialize_document
+
+    for _, document in iter_documents(source, tsv_file, DATA_PATH / "vectors", only_ids=only_ids):
+        yield document["doc_ID"], serialize_document(document)
+
+
+def load_delta(source):
+    """Reads the delta written by generate_vectors.py for a source."""
+    from documents import delta_path
+
+    path = delta_path(DATA_PATH / "vectors", source)
+    if not path.exists():
+        sys.exit(f"Delta file not found: {path}\nRun generate_vectors.py for {source} first.")
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def mark_delta_applied(source):
+    """Flags the delta as ingested, so the next generate_vectors.py run starts a new one instead of merging."""
+    from documents import delta_path
+
+    path = delta_path(DATA_PATH / "vectors", source)
+    with open(path, encoding="utf-8") as f:
+        delta = json.load(f)
+    delta["applied"] = True
+    # Not <name>.tmp: generate_vectors.py stages its next delta under that name
+    tmp_path = path.with_suffix(".json.applied")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(delta, f)
+    os.replace(tmp_path, path)
+
+
+def generate_raw_actions(lines, index_name, progress):
+    """
+    Like generate_bulk_actions, but passes each document through as a JSON
+    string so it is not decoded and re-encoded on its way to OpenSearch.
+    """
+    for doc_id, line in lines:
+        progress.add(1, len(line))
+        action = {"_index": index_name}
+        if doc_id:
+            action["_id"] = doc_id
+        if ROUTING:
+            action["routing"] = ROUTING
+        yield {"index": action}, line
+
+
+def generate_delete_actions(doc_ids, index_name, progress):
+    """Yields bulk delete actions (no body line) for documents that vanished from the source."""
+    for doc_id in doc_ids:
+        progress.add(1, 0)
+        action = {"_index": index_name, "_id": doc_id}
+        if ROUTING:
+            action["routing"] = ROUTING
+        yield {"delete": action}, None
+
+
+class SharedIterator:
+    """Lets several bulk workers pull actions from one generator."""
+
+    def __init__(self, iterable):
+        self._it = iter(iterable)
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock:
+            return next(self._it)
+
+
+@contextmanager
+def tuned_for_bulk_load(client, index_name):
+    """Disables refresh and replicas for the duration of a load, then restores the previous values."""
+    # index_name may be an alias (see migrate_index.py); its one concrete index holds the settings
+    settings = next(iter(client.indices.get_settings(index=index_name).values()))["settings"]["index"]
+    previous = {
+        "refresh_interval": settings.get("refresh_interval", "1s"),
+        "number_of_replicas": settings.get("number_of_replicas", "1"),
+    }
+    client.indices.put_settings(index=index_name, body={"index": {"refresh_interval": "-1", "number_of_replicas": 0}})
+    print(f"Load settings applied (previous: {previous}).")
+    try:
+        yield
+    finally:
+        client.indices.put_settings(index=index_name, body={"index": previous})
+        client.indices.refresh(index=index_name)
+        print(f"Restored index settings: {previous}.")
+
+
+def fast_bulk_upload(client, lines, index_name, workers, deletes=()):
+    """
+    Uploads serialized documents with parallel streaming_bulk workers sharing one action stream.
+
+    Requests are capped by size (--chunk-mb) rather than document count, 429
+    rejections are retried with exponential backoff, and documents that still
+    fail are appended to DEAD_LETTER_PATH instead of being kept in memory.
+    IDs in deletes are removed after the documents are sent; deleting a
+    document that is already gone is not counted as a failure.
+    Returns:
+        tuple[int, int]: (documents sent, documents failed)
+    """
+    progress = ProgressCounter()
+    actions = SharedIterator(itertools.chain(
+        generate_raw_actions(lines, index_name, progress),
+        generate_delete_actions(deletes, index_name, progress),
+    ))
+    dead_letter_lock = threading.Lock()
+
+    with open(DEAD_LETTER_PATH, 'w', encoding='utf-8') as dead_letter:
+        def worker():
+            for ok, item in streaming_bulk(
+                client,
+                actions,
+                # Actions are already (action, raw JSON line) pairs
+                expand_action_callback=lambda action: action,
+                chunk_size=100000,  # bounded by max_chunk_bytes instead
+                max_chunk_bytes=int(args.chunk_mb * 1024 * 1024),
+                max_retries=args.max_retries,
+                initial_backoff=2,
+                max_backoff=120,
+                raise_on_error=False,
+                raise_on_exception=False,
+                yield_ok=False,
+                request_timeout=120,
+            ):
+                if not ok and item.get("delete", {}).get("status") == 404:
+                    continue
+                if not ok:
+                    with dead_letter_lock:
+                        progress.failed += 1
+                        dead_letter.write(json.dumps(item) + '\n')
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, workers))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    progress.report()
+    return progress.docs - progress.failed, progress.failed
+
+
+def vector_counts(source):
+    """(documents, formulas) in the source's vector files, or None if they are missing."""
+    import numpy as np
+    from documents import vector_paths
+
+    paths = vector_paths(DATA_PATH / "vectors", source)
+    if not (paths["body"].exists() and paths["formulas"].exists()):
+        return None
+    return np.load(paths["body"], mmap_mode="r").shape[0], np.load(paths["formulas"], mmap_mode="r").shape[0]
+
+
 def ensure_index_exists(client, index_name):
-    """Create the index with the explicit mapping if it does not exist."""
+    """Create the index with the selected mapping profile if it does not exist."""
     if not client.indices.exists(index=index_name):
-        print(f"Index '{index_name}' does not exist. Creating with explicit mapping...")
-        client.indices.create(index=index_name, body=mapping)
+        # nmslib has no filtered kNN, which searches on the consolidated index use
+        try:
+            profile = resolve_profile(MAPPING_PROFILE, consolidated=args.consolidated, explicit=bool(args.profile))
+        except ValueError as e:
+            sys.exit(str(e))
+        print(f"Index '{index_name}' does not exist. Creating with mapping profile '{profile}'...")
+        client.indices.create(index=index_name, body=build_mapping(profile, consolidated=args.consolidated))
         print(f"Created index '{index_name}'.")
+        counts = vector_counts(SOURCE_NAME)
+        if counts:
+            estimate = estimate_native_memory(profile, *counts)
+            print(f"Estimated kNN memory for {counts[0]} docs / {counts[1]} formulas: "
+                  f"{estimate['total'] / 2**30:.2f} GiB")
     else:
         print(f"Index '{index_name}' already exists.")
 
 
 def main():
     """Main function to run the bulk upload."""
-    if not Path(JSONL_FILE_PATH).exists():
-        sys.exit(f"JSONL file not found: {JSONL_FILE_PATH}\nRun bin/process.sh {SOURCE_NAME} <tsv_file> first.")
+    if args.delta and not args.from_vectors:
+        sys.exit("--delta requires --from-vectors TSV_FILE.")
+    if args.consolidated and not args.from_vectors:
+        sys.exit("--consolidated requires --from-vectors TSV_FILE.")
+    deletes = []
+    if args.from_vectors:
+        tsv_file = DATA_PATH / "tsvs" / args.from_vectors
+        if not tsv_file.exists():
+            sys.exit(f"TSV file not found: {tsv_file}")
+        input_description = f"{tsv_file} + data/vectors/{SOURCE_NAME}_*.npy"
+        only_ids = None
+        if args.delta:
+            delta = load_delta(SOURCE_NAME)
+            deletes = delta["delete"]
+            if not delta["full"]:
+                only_ids = set(delta["upsert"])
+            upserts = "all" if only_ids is None else len(only_ids)
+            print(f"Applying delta: {upserts} documents to upsert, {len(deletes)} to delete.")
+        lines = serialize_vector_documents(SOURCE_NAME, str(tsv_file), only_ids=only_ids)
+    else:
+        if not Path(JSONL_FILE_PATH).exists():
+            sys.exit(f"JSONL file not found: {JSONL_FILE_PATH}\nRun bin/process.sh {SOURCE_NAME} <tsv_file> first.")
+        input_description = JSONL_FILE_PATH
+        lines = read_jsonl_lines(JSONL_FILE_PATH)
 
     client = get_opensearch_client()
     ensure_index_exists(client, INDEX_NAME)
 
-    print(f"Starting bulk upload of '{JSONL_FILE_PATH}' to index '{INDEX_NAME}'...")
+    print(f"Starting bulk upload of '{input_description}' to index '{INDEX_NAME}'...")
 
     try:
-        # Perform the bulk upload using the OpenSearch helpers.bulk utility
-        success_count, errors = bulk(client, generate_bulk_actions(JSONL_FILE_PATH, INDEX_NAME), chunk_size=100,
-                                     request_timeout=60)
+        if args.fast:
+            with tuned_for_bulk_load(client, INDEX_NAME):
+                success_count, failed_count = fast_bulk_upload(client, lines, INDEX_NAME, args.workers, deletes)
+        elif args.from_vectors:
+            # Vectors stream straight into byte-sized bulk requests on a single worker
+            success_count, failed_count = fast_bulk_upload(client, lines, INDEX_NAME, workers=1, deletes=deletes)
+        else:
+            # Perform the bulk upload using the OpenSearch helpers.bulk utility
+            success_count, errors = bulk(client, generate_bulk_actions(JSONL_FILE_PATH, INDEX_NAME), chunk_size=100,
+                                         request_timeout=60)
+            failed_count = len(errors)
 
         print("\nBulk upload complete!")
         print(f"Successfully indexed: {success_count} documents.")
-        print(f"Failed to index: {len(errors)} documents.")
+        print(f"Failed to index: {failed_count} documents.")
+        if (args.fast or args.from_vectors) and failed_count:
+            print(f"Failed documents written to {DEAD_LETTER_PATH}")
+        # Drop cached search results and embeddings in running backends
+        mark_index_updated()
+        if args.delta:
+            if failed_count:
+                print("Delta kept pending; the next generate_vectors.py run merges into it.")
+            else:
+                mark_delta_applied(SOURCE_NAME)
 
     except Exception as e:
         print(f"\nAn error occurred during the bulk upload: {e}")
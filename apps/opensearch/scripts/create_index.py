@@ -2,8 +2,11 @@
 create_index.py
 
 Create an OpenSearch index for MathMex with the specified mapping.
-Run from project root: python apps/opensearch/scripts/create_index.py
+Run from project root: python apps/opensearch/scripts/create_index.py [--index NAME] [--profile NAME]
+  The all-sources index (routed by source): create_index.py --consolidated [--shards N]
+  List mapping profiles with their estimated kNN memory: create_index.py --list-profiles [--docs N --formulas N]
 """
+import argparse
 import sys
 from pathlib import Path
 
@@ -13,7 +16,8 @@ sys.path.insert(0, str(_OPENSEARCH))
 sys.path.insert(0, str(_BACKEND))
 
 from opensearchpy import OpenSearch
-from schemas.mappings import mapping
+from schemas.indexes import CONSOLIDATED_INDEX
+from schemas.mappings import PROFILES, build_mapping, describe_profiles, estimate_native_memory, resolve_profile
 import json
 
 from config_loader import get_config
@@ -23,9 +27,38 @@ OPENSEARCH_HOST = config.get('opensearch', 'host')
 USER = config.get('opensearch_admin', 'username')
 PASSWORD = config.get('opensearch_admin', 'password')
 
-# Name of the index to create (change as needed)
+# Name of the index to create (change as needed, or pass --index)
 INDEX_NAME = 'mathmex_youtube'
 
+parser = argparse.ArgumentParser(description="Create a MathMex OpenSearch index")
+parser.add_argument("--index", default=INDEX_NAME, help=f"Index name (default: {INDEX_NAME})")
+parser.add_argument("--profile", choices=sorted(PROFILES),
+                    help="Mapping profile (default: [opensearch] mapping_profile in config.ini, else 'default'; "
+                         "'faiss' for --consolidated if that is an nmslib profile)")
+parser.add_argument("--consolidated", action="store_true",
+                    help=f"Create {CONSOLIDATED_INDEX}, which holds every source and requires routing by source name")
+parser.add_argument("--shards", type=int, help="number_of_shards (default: cluster default)")
+parser.add_argument("--list-profiles", action="store_true", help="Print profiles with estimated memory and exit")
+parser.add_argument("--docs", type=int, default=1_000_000, help="Document count for memory estimates (default: 1M)")
+parser.add_argument("--formulas", type=int, default=5_000_000, help="Formula count for memory estimates (default: 5M)")
+args = parser.parse_args()
+
+if args.consolidated:
+    args.index = CONSOLIDATED_INDEX
+
+try:
+    args.profile = resolve_profile(
+        args.profile or config.get('opensearch', 'mapping_profile', fallback='default'),
+        consolidated=args.consolidated,
+        explicit=args.profile is not None,
+    )
+except ValueError as e:
+    sys.exit(str(e))
+
+if args.list_profiles:
+    print("\n".join(describe_profiles(args.docs, args.formulas)))
+    sys.exit(0)
+
 # --- Connect ---
 # Initialize the OpenSearch client
 client = OpenSearch(
@@ -38,10 +71,12 @@ client = OpenSearch(
 
 # --- Create the index ---
 # Check if the index already exists
-if client.indices.exists(index=INDEX_NAME):
-    print(f"Index '{INDEX_NAME}' already exists.")
+if client.indices.exists(index=args.index):
+    print(f"Index '{args.index}' already exists.")
 else:
-    # Create the index with the provided mapping
-    response = client.indices.create(index=INDEX_NAME, body=mapping)
-    print(f"Created index '{INDEX_NAME}':")
+    # Create the index with the selected mapping profile
+    response = client.indices.create(index=args.index, body=build_mapping(args.profile, consolidated=args.consolidated, shards=args.shards))
+    estimate = estimate_native_memory(args.profile, args.docs, args.formulas)
+    print(f"Created index '{args.index}' with mapping profile '{args.profile}' "
+          f"(~{estimate['total'] / 2**30:.2f} GiB kNN memory per {args.docs:,} docs / {args.formulas:,} formulas):")
     print(json.dumps(response, indent=2))
\ No newline at end of file
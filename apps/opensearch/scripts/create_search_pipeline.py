@@ -0,0 +1,56 @@
+"""
+create_search_pipeline.py
+
+Create (or replace) the search pipeline used by /fusion-search with
+[fusion] mode = hybrid. The pipeline fuses a hybrid query's [formula, text]
+sub-queries with the FUSION_METHOD / FUSION_RRF_K / FUSION_WEIGHT_* settings:
+rrf uses the score-ranker processor (OpenSearch 2.19+), weighted the
+normalization processor (min-max, weighted arithmetic mean).
+Run from project root: python apps/opensearch/scripts/create_search_pipeline.py [--name NAME] [--dry-run]
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+_OPENSEARCH = Path(__file__).resolve().parents[1]
+_BACKEND = _OPENSEARCH.parent / "backend"
+sys.path.insert(0, str(_OPENSEARCH))
+sys.path.insert(0, str(_BACKEND))
+
+from opensearchpy import OpenSearch
+
+from config_loader import get_config
+from services.fusion import FusionSettings, HYBRID_PIPELINE, pipeline_body
+
+config = get_config()
+OPENSEARCH_HOST = config.get('opensearch', 'host')
+USER = config.get('opensearch_admin', 'username')
+PASSWORD = config.get('opensearch_admin', 'password')
+
+parser = argparse.ArgumentParser(description="Create the MathMex fusion search pipeline")
+parser.add_argument("--name", default=HYBRID_PIPELINE,
+                    help=f"Pipeline name (default: [fusion] hybrid_pipeline, '{HYBRID_PIPELINE}')")
+parser.add_argument("--dry-run", action="store_true", help="Print the pipeline without creating it")
+args = parser.parse_args()
+
+try:
+    body = pipeline_body(FusionSettings.from_env())
+except ValueError as e:
+    sys.exit(str(e))
+
+if args.dry_run:
+    print(json.dumps(body, indent=2))
+    sys.exit(0)
+
+client = OpenSearch(
+    hosts=[{'host': OPENSEARCH_HOST}],
+    http_auth=(USER, PASSWORD),
+    use_ssl=True,
+    verify_certs=False,
+    ssl_show_warn=False
+)
+
+response = client.transport.perform_request("PUT", f"/_search/pipeline/{args.name}", body=body)
+print(f"Created search pipeline '{args.name}':")
+print(json.dumps(response, indent=2))
@@ -0,0 +1,204 @@
+"""
+migrate_index.py
+
+Move existing mathmex_* indices to the current schema (schemas/mappings.py,
+SCHEMA_VERSION): each index is reindexed server-side into <name>_v<version>
+and, with --swap, the old index is replaced by an alias of the same name so
+the backend keeps querying mathmex_<source> unchanged.
+
+Run from project root: python apps/opensearch/scripts/migrate_index.py [INDEX ...] [--profile NAME] [--swap]
+  e.g. python apps/opensearch/scripts/migrate_index.py mathmex_wikipedia
+       python apps/opensearch/scripts/migrate_index.py mathmex_wikipedia --swap
+
+Reindexing needs the vectors in the old index's _source. Indices already on
+the new schema keep vectors out of _source; re-ingest those from data/vectors/
+with bulk_index.py instead.
+
+The copy gets the fields the backend relies on for local vector lookups: a
+source field, and doc_ID (also the new _id) rewritten to the content hash
+bulk_index.py uses (documents.document_id), so hits match the rows of
+data/vectors/<source>_doc_ids.npy. Identical documents collapse into one.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+_OPENSEARCH = Path(__file__).resolve().parents[1]
+_BACKEND = _OPENSEARCH.parent / "backend"
+sys.path.insert(0, str(_OPENSEARCH))
+sys.path.insert(0, str(_BACKEND))
+
+import warnings
+from opensearchpy import OpenSearch, RequestsHttpConnection
+
+from config_loader import get_config
+from schemas.indexes import source_to_index
+from schemas.mappings import PROFILES, SCHEMA_VERSION, build_mapping, vectors_in_source
+from services.query_cache import mark_index_updated
+
+config = get_config()
+OPENSEARCH_HOST = config.get('opensearch', 'host')
+USER = config.get('opensearch_admin', 'username')
+PASSWORD = config.get('opensearch_admin', 'password')
+
+parser = argparse.ArgumentParser(description="Migrate mathmex_* indices to the current schema")
+parser.add_argument("indices", nargs="*", help="Index names (default: every index in source_to_index)")
+parser.add_argument("--profile", choices=sorted(PROFILES),
+                    default=config.get('opensearch', 'mapping_profile', fallback='default'),
+                    help="Mapping profile for the new indices (default: [opensearch] mapping_profile, else 'default')")
+parser.add_argument("--swap", action="store_true",
+                    help="After a successful reindex, delete the old index and point an alias with its name at the new one")
+parser.add_argument("--dry-run", action="store_true", help="Only print what would be done")
+args = parser.parse_args()
+
+# Suppress the security warning from using a self-signed cert
+warnings.filterwarnings('ignore', message='Unverified HTTPS request')
+
+
+def get_opensearch_client():
+    """Initializes and returns the OpenSearch client."""
+    return OpenSearch(
+        hosts=[{'host': OPENSEARCH_HOST}],
+        http_auth=(USER, PASSWORD),
+        use_ssl=True,
+        verify_certs=False,
+        ssl_show_warn=False,
+        connection_class=RequestsHttpConnection,
+        timeout=120,
+    )
+
+
+def resolve_index(client, name):
+    """Returns (concrete index name, its mapping) for an index or alias, or (None, None) if missing."""
+    if not client.indices.exists(index=name):
+        return None, None
+    concrete, info = next(iter(client.indices.get_mapping(index=name).items()))
+    return concrete, info["mappings"]
+
+
+# Same key as documents.document_id: SHA-1 of source, title, body and link joined by \x1f
+REINDEX_SCRIPT = """
+String source = params.source != null ? params.source : ctx._source.source;
+if (source == null) {
+    throw new IllegalArgumentException('no source for document ' + ctx._id);
+}
+ctx._source.source = source;
+String title = ctx._source.title == null ? '' : ctx._source.title;
+String body = ctx._source.body_text == null ? '' : ctx._source.body_text;
+String link = ctx._source.link == null ? '' : ctx._source.link;
+String id = (source + params.sep + title + params.sep + body + params.sep + link).sha1();
+ctx._source.doc_ID = id;
+ctx._id = id;
+"""
+
+index_to_source = {index: source for source, index in source_to_index.items()}
+
+
+def wait_for_task(client, task_id, interval=10):
+    """Polls a reindex task until it finishes, printing progress. Returns the task response."""
+    while True:
+        task = client.tasks.get(task_id=task_id)
+        status = task["task"]["status"]
+        print(f"  {status.get('created', 0) + status.get('updated', 0)} / {status.get('total', 0)} documents copied")
+        if task.get("completed"):
+            return task
+        time.sleep(interval)
+
+
+def migrate(client, name):
+    """Reindexes one index into the current schema. Returns True if it is (now) on the current schema."""
+    current, current_mapping = resolve_index(client, name)
+    if current is None:
+        print(f"'{name}' does not exist; skipping.")
+        return False
+    version = current_mapping.get("_meta", {}).get("schema_version", 1)
+    target = f"{name}_v{SCHEMA_VERSION}"
+    if version >= SCHEMA_VERSION:
+        print(f"'{name}' ({current}) is already on schema v{version}.")
+        return True
+    if not vectors_in_source(current_mapping):
+        print(f"'{name}' does not keep vectors in _source, so it cannot be reindexed. "
+              f"Re-ingest it with bulk_index.py --from-vectors instead.")
+        return False
+
+    print(f"'{name}' ({current}, schema v{version}) -> '{target}' (schema v{SCHEMA_VERSION}, profile '{args.profile}')")
+    if args.dry_run:
+        return False
+
+    settings = client.indices.get_settings(index=current)[current]["settings"]["index"]
+    final_settings = {
+        "refresh_interval": settings.get("refresh_interval", "1s"),
+        "number_of_replicas": settings.get("number_of_replicas", "1"),
+    }
+    fresh = not client.indices.exists(index=target)
+    if fresh:
+        body = build_mapping(args.profile)
+        # Load without refreshes or replicas; both are restored once the copy is done
+        body["settings"]["index"].update({"refresh_interval": "-1", "number_of_replicas": 0})
+        client.indices.create(index=target, body=body)
+        print(f"  Created '{target}'.")
+    else:
+        print(f"  '{target}' already exists; continuing the copy into it.")
+
+    # op_type=create + conflicts=proceed makes a rerun skip documents copied before
+    response = client.reindex(
+        body={
+            "source": {"index": current, "size": 500},
+            "dest": {"index": target, "op_type": "create"},
+            "script": {
+                "lang": "painless",
+                "source": REINDEX_SCRIPT,
+                # The consolidated index already has a source field per document
+                "params": {"source": index_to_source.get(name), "sep": "\x1f"},
+            },
+            "conflicts": "proceed",
+        },
+        wait_for_completion=False,
+        slices="auto",
+        requests_per_second=-1,
+    )
+    task = wait_for_task(client, response["task"])
+    failures = task.get("response", {}).get("failures", [])
+    client.indices.put_settings(index=target, body={"index": final_settings})
+    client.indices.refresh(index=target)
+    if failures or task.get("error"):
+        print(f"  Reindex reported errors: {task.get('error') or failures[:5]}")
+        return False
+
+    old_count = client.count(index=current)["count"]
+    new_count = client.count(index=target)["count"]
+    # Documents with the same content hash collapse into one (version conflicts on a fresh copy)
+    duplicates = task.get("response", {}).get("version_conflicts", 0) if fresh else 0
+    print(f"  Documents: {old_count} in '{current}', {new_count} in '{target}'"
+          + (f" ({duplicates} duplicates merged)." if duplicates else "."))
+    if new_count + duplicates != old_count:
+        print("  Counts differ; leaving both indices in place.")
+        return False
+
+    if not args.swap:
+        print(f"  Verify '{target}', then rerun with --swap to replace '{name}'.")
+        return True
+
+    # One atomic request: the old index disappears and the alias takes over its name
+    actions = [
+        {"remove_index": {"index": current}},
+        {"add": {"index": target, "alias": name}},
+    ]
+    client.indices.update_aliases(body={"actions": actions})
+    print(f"  '{name}' now points to '{target}'; '{current}' was deleted.")
+    return True
+
+
+def main():
+    client = get_opensearch_client()
+    names = args.indices or list(source_to_index.values())
+    migrated = [name for name in names if migrate(client, name)]
+    if migrated and args.swap and not args.dry_run:
+        # Drop cached search results in running backends
+        mark_index_updated()
+    print(f"\nDone: {len(migrated)} of {len(names)} indices on schema v{SCHEMA_VERSION}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,19 +2,24 @@
 # Process a data source: generate vectors, then JSONL. Optionally index to OpenSearch.
 # Run from project root.
 #
-# Usage: bin/process.sh SOURCE TSV_FILE [--index]
+# Usage: bin/process.sh SOURCE TSV_FILE [--index | --delta]
 #   e.g. bin/process.sh wikipedia final_wikipedia.tsv
 #   e.g. bin/process.sh wikipedia final_wikipedia.tsv --index
+#   e.g. bin/process.sh wikipedia final_wikipedia.tsv --delta
 #
-# Outputs data/jsonl/mathmex_<source>.jsonl ready for bulk indexing.
+# Outputs data/jsonl/mathmex_<source>.jsonl ready for bulk indexing. With --index,
+# documents go straight from the vector files to OpenSearch and no JSONL is written.
+# --delta is like --index, but only embeds and upserts rows that are new or changed
+# since the last run, and deletes documents whose rows vanished.
 
 set -e
 cd "$(dirname "$0")/.."
 
 if [ $# -lt 2 ]; then
-    echo "Usage: $0 SOURCE TSV_FILE [--index]"
+    echo "Usage: $0 SOURCE TSV_FILE [--index | --delta]"
     echo "  e.g. $0 wikipedia final_wikipedia.tsv"
     echo "  e.g. $0 wikipedia final_wikipedia.tsv --index"
+    echo "  e.g. $0 wikipedia final_wikipedia.tsv --delta"
     echo ""
     echo "TSV_FILE should exist in data/tsvs/"
     exit 1
@@ -23,7 +28,12 @@ fi
 SOURCE="$1"
 TSV="$2"
 DO_INDEX=false
+DELTA_FLAG=""
 [ "${3:-}" = "--index" ] && DO_INDEX=true
+if [ "${3:-}" = "--delta" ]; then
+    DO_INDEX=true
+    DELTA_FLAG="--delta"
+fi
 
 JSONL="data/jsonl/mathmex_${SOURCE}.jsonl"
 
@@ -34,25 +44,28 @@ echo "=========================================="
 echo ""
 
 echo "[1/2] Generating vectors..."
-python apps/data-processing/generate_vectors.py "$SOURCE" "$TSV"
-echo ""
-
-echo "[2/2] Generating JSONL..."
-python apps/data-processing/generate_jsonl.py "$SOURCE" "$TSV"
+python apps/data-processing/generate_vectors.py "$SOURCE" "$TSV" $DELTA_FLAG
 echo ""
 
 if [ "$DO_INDEX" = true ]; then
-    echo "[3/3] Indexing to OpenSearch..."
-    python apps/opensearch/scripts/bulk_index.py "$SOURCE"
+    # Index straight from the TSV + vector files; no JSONL intermediate
+    echo "[2/2] Indexing to OpenSearch..."
+    python apps/opensearch/scripts/bulk_index.py "$SOURCE" --from-vectors "$TSV" $DELTA_FLAG
+    echo ""
+else
+    echo "[2/2] Generating JSONL..."
+    python apps/data-processing/generate_jsonl.py "$SOURCE" "$TSV"
     echo ""
 fi
 
 echo "=========================================="
-echo "Done. Data ready for indexing."
-echo ""
-echo "  JSONL: $JSONL"
-echo ""
 if [ "$DO_INDEX" = false ]; then
+    echo "Done. Data ready for indexing."
+    echo ""
+    echo "  JSONL: $JSONL"
+    echo ""
     echo "  Index with: python apps/opensearch/scripts/bulk_index.py $SOURCE"
+else
+    echo "Done. Indexed $SOURCE."
 fi
 echo "=========================================="